@@ -0,0 +1,597 @@
+"""Benchmarks for comparing engines and `LocalEngine` backends.
+
+Measures insert and index build time, memory, query throughput, latency
+percentiles and recall@k against exact ground truth, with unfiltered and
+filtered workloads. From the command line:
+
+```
+python -m affine.bench --dataset gaussian --n 100000 --dim 128 \\
+    --backends numpy annoy faiss --json results.json --csv results.csv
+```
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from dataclasses import asdict, dataclass, fields
+from pathlib import Path
+from typing import Callable, Sequence, Type
+
+import numpy as np
+
+from affine.collection import Collection, Metric, Vector
+from affine.engine import Engine, LocalEngine
+from affine.engine.local import (
+    AnnoyBackend,
+    FAISSBackend,
+    HNSWBackend,
+    IVFBackend,
+    KDTreeBackend,
+    LocalBackend,
+    NumPyBackend,
+    ProductQuantizedBackend,
+    PyNNDescentBackend,
+    ScalarQuantizedBackend,
+)
+
+
+@dataclass
+class Dataset:
+    """Vectors to index (`train`) and query vectors (`test`)
+
+    Parameters
+    ----------
+    name
+        name used in the reports
+    train
+        (num_records, dim) array of the vectors to insert
+    test
+        (num_queries, dim) array of query vectors
+    metric
+        metric to search with
+    groups
+        integer label per record, used by the filtered workload. the i-th
+        query of the filtered workload is restricted to the records with
+        label `i % num_groups`
+    neighbors
+        optional exact (unfiltered) nearest neighbors of the query vectors, as
+        row positions into `train`. computed if not given
+    """
+
+    name: str
+    train: np.ndarray
+    test: np.ndarray
+    metric: Metric
+    groups: np.ndarray
+    neighbors: np.ndarray | None = None
+
+    @property
+    def num_groups(self) -> int:
+        return int(self.groups.max()) + 1
+
+    def collection_class(self, dtype: str = "float32") -> Type[Collection]:
+        """A collection class for the records of this dataset, storing the
+        vectors as `dtype`"""
+        return type(Collection)(
+            "BenchRecord",
+            (Collection,),
+            {
+                "__annotations__": {
+                    "group": int,
+                    "vector": Vector[self.train.shape[1], self.metric, dtype],
+                },
+                "__module__": __name__,
+            },
+        )
+
+
+def _random_groups(n: int, num_groups: int, seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, num_groups, size=n)
+
+
+def gaussian_dataset(
+    n: int = 10_000,
+    n_queries: int = 100,
+    dim: int = 64,
+    metric: Metric = Metric.EUCLIDEAN,
+    n_clusters: int = 32,
+    num_groups: int = 10,
+    seed: int = 0,
+) -> Dataset:
+    """Synthetic dataset drawn from a mixture of gaussians (which, unlike a
+    single gaussian, has the cluster structure real embeddings have)"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(scale=4.0, size=(n_clusters, dim))
+
+    def sample(m: int) -> np.ndarray:
+        return (
+            centers[rng.integers(0, n_clusters, size=m)]
+            + rng.normal(size=(m, dim))
+        ).astype(np.float32)
+
+    return Dataset(
+        name=f"gaussian-{n}x{dim}",
+        train=sample(n),
+        test=sample(n_queries),
+        metric=Metric(metric),
+        groups=_random_groups(n, num_groups, seed),
+    )
+
+
+def read_fvecs(path: str | Path) -> np.ndarray:
+    """Read a `.fvecs` file (as used by the SIFT/GIST datasets): every vector
+    is stored as its dimension (int32) followed by its float32 values"""
+    raw = np.fromfile(path, dtype=np.int32)
+    if len(raw) == 0:
+        return np.zeros((0, 0), dtype=np.float32)
+    dim = raw[0]
+    return raw.reshape(-1, dim + 1)[:, 1:].view(np.float32)
+
+
+def read_ivecs(path: str | Path) -> np.ndarray:
+    """Read an `.ivecs` file, the integer counterpart of `.fvecs`"""
+    raw = np.fromfile(path, dtype=np.int32)
+    if len(raw) == 0:
+        return np.zeros((0, 0), dtype=np.int32)
+    return raw.reshape(-1, raw[0] + 1)[:, 1:]
+
+
+def load_fvecs_dataset(
+    base_path: str | Path,
+    query_path: str | Path,
+    groundtruth_path: str | Path | None = None,
+    metric: Metric = Metric.EUCLIDEAN,
+    num_groups: int = 10,
+    seed: int = 0,
+) -> Dataset:
+    train = read_fvecs(base_path)
+    return Dataset(
+        name=Path(base_path).stem,
+        train=train,
+        test=read_fvecs(query_path),
+        metric=Metric(metric),
+        groups=_random_groups(len(train), num_groups, seed),
+        neighbors=(
+            None if groundtruth_path is None else read_ivecs(groundtruth_path)
+        ),
+    )
+
+
+def load_hdf5_dataset(
+    path: str | Path, num_groups: int = 10, seed: int = 0
+) -> Dataset:
+    """Load a dataset in the ann-benchmarks HDF5 format (`train`, `test` and
+    `neighbors` datasets and a `distance` attribute)"""
+    try:
+        import h5py
+    except ModuleNotFoundError:
+        raise RuntimeError("Loading HDF5 datasets requires h5py")
+    with h5py.File(path, "r") as f:
+        distance = f.attrs.get("distance", "euclidean")
+        if distance not in ("euclidean", "angular"):
+            raise ValueError(f"Unsupported distance {distance}")
+        train = np.asarray(f["train"], dtype=np.float32)
+        return Dataset(
+            name=Path(path).stem,
+            train=train,
+            test=np.asarray(f["test"], dtype=np.float32),
+            metric=(
+                Metric.EUCLIDEAN if distance == "euclidean" else Metric.COSINE
+            ),
+            groups=_random_groups(len(train), num_groups, seed),
+            neighbors=(
+                np.asarray(f["neighbors"]) if "neighbors" in f else None
+            ),
+        )
+
+
+def subsample(dataset: Dataset, n: int | None, n_queries: int | None):
+    """Restrict a dataset to its first `n` records and `n_queries` queries.
+    Restricting the records invalidates the stored ground truth."""
+    neighbors = dataset.neighbors
+    if n is not None and n < len(dataset.train):
+        neighbors = None
+    elif neighbors is not None:
+        neighbors = neighbors[:n_queries]
+    return Dataset(
+        name=dataset.name,
+        train=dataset.train[:n],
+        test=dataset.test[:n_queries],
+        metric=dataset.metric,
+        groups=dataset.groups[:n],
+        neighbors=neighbors,
+    )
+
+
+def exact_neighbors(
+    train: np.ndarray, test: np.ndarray, k: int, metric: Metric
+) -> list[np.ndarray]:
+    """The exact `k` nearest neighbors (row positions into `train`) of each
+    row of `test`"""
+    if len(test) == 0:
+        return []
+    backend = NumPyBackend()
+    backend.create_index(train.astype(np.float32), metric)
+    return [ids for ids, _ in backend.query_batch(test, min(k, len(train)))]
+
+
+def filtered_ground_truth(dataset: Dataset, k: int) -> list[np.ndarray]:
+    """Exact neighbors for the filtered workload, in which query `i` only
+    considers the records of group `i % num_groups`"""
+    ret: list[np.ndarray | None] = [None] * len(dataset.test)
+    query_groups = np.arange(len(dataset.test)) % dataset.num_groups
+    for g in range(dataset.num_groups):
+        rows = np.flatnonzero(dataset.groups == g)
+        queries = np.flatnonzero(query_groups == g)
+        if len(rows) == 0:
+            for i in queries:
+                ret[i] = np.zeros(0, dtype=np.int64)
+            continue
+        for i, n in zip(
+            queries,
+            exact_neighbors(
+                dataset.train[rows], dataset.test[queries], k, dataset.metric
+            ),
+        ):
+            ret[i] = rows[n]
+    return ret
+
+
+@dataclass
+class BenchmarkResult:
+    name: str
+    dataset: str
+    workload: str
+    k: int
+    num_records: int
+    num_queries: int
+    insert_seconds: float
+    # time of the first query, which is when `LocalEngine` builds its index
+    build_seconds: float
+    # growth of the resident memory of the process while inserting and
+    # building (None where it can't be measured)
+    memory_mb: float | None
+    qps: float
+    latency_mean_ms: float
+    latency_p50_ms: float
+    latency_p99_ms: float
+    recall: float
+    # throughput of `similarity_batch` queries, if measured
+    batch_qps: float | None = None
+    # dtype the vectors were stored as
+    dtype: str = "float32"
+
+
+def _rss_bytes() -> int | None:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _recall(found: list[np.ndarray], truth: list[np.ndarray], k: int) -> float:
+    recalls = [
+        len(set(f.tolist()) & set(t[:k].tolist())) / min(k, len(t))
+        for f, t in zip(found, truth)
+        if len(t) > 0
+    ]
+    return float(np.mean(recalls)) if recalls else 1.0
+
+
+def run_benchmark(
+    engine: Engine,
+    dataset: Dataset,
+    k: int = 10,
+    filtered: bool = True,
+    batch_size: int | None = None,
+    name: str | None = None,
+    cleanup: bool = True,
+    dtype: str = "float32",
+) -> list[BenchmarkResult]:
+    """Insert `dataset` into `engine` and measure its queries.
+
+    Parameters
+    ----------
+    engine
+        the engine to benchmark. it should not contain records of the
+        benchmark collection yet
+    dataset
+        the dataset to insert and query
+    k
+        number of neighbors per query
+    filtered
+        whether to also run the filtered workload
+    batch_size
+        if given, also measure the throughput of `similarity_batch` queries
+        with this many query vectors per batch
+    name
+        name of the engine in the reports
+    cleanup
+        whether to delete the inserted records afterwards
+    dtype
+        dtype to store the vectors as
+
+    Returns
+    -------
+    list[BenchmarkResult]
+        one result per workload
+    """
+    name = name or engine.__class__.__name__
+    collection_class = dataset.collection_class(dtype)
+    records = [
+        collection_class(group=int(g), vector=Vector(v))
+        for v, g in zip(dataset.train, dataset.groups)
+    ]
+
+    # vector databases have to create the collection before inserting into
+    # it
+    engine.register_collection(collection_class)
+    rss = _rss_bytes()
+    start = time.perf_counter()
+    ids = engine.insert_many(records)
+    # eventually consistent engines would otherwise be queried before they
+    # see all the records
+    engine.wait_for_records(collection_class, len(ids))
+    insert_seconds = time.perf_counter() - start
+    del records
+    row_of_id = {str(id_): row for row, id_ in enumerate(ids)}
+
+    def query(i: int, filter_group: int | None) -> np.ndarray:
+        q = engine.query(collection_class).similarity(
+            collection_class.vector == dataset.test[i]
+        )
+        if filter_group is not None:
+            q = q.filter(collection_class.group == filter_group)
+        return np.array(
+            [row_of_id[str(r.id)] for r in q.limit(k)], dtype=np.int64
+        )
+
+    start = time.perf_counter()
+    query(0, None)
+    build_seconds = time.perf_counter() - start
+    rss_after = _rss_bytes()
+    memory_mb = (
+        None if rss is None or rss_after is None else (rss_after - rss) / 2**20
+    )
+
+    workloads: dict[str, tuple[Callable[[int], int | None], list]] = {}
+    neighbors = dataset.neighbors
+    if neighbors is None:
+        neighbors = exact_neighbors(
+            dataset.train, dataset.test, k, dataset.metric
+        )
+    workloads["unfiltered"] = (lambda i: None, list(neighbors))
+    if filtered:
+        workloads["filtered"] = (
+            lambda i: i % dataset.num_groups,
+            filtered_ground_truth(dataset, k),
+        )
+
+    results = []
+    for workload, (filter_group, truth) in workloads.items():
+        latencies, found = [], []
+        for i in range(len(dataset.test)):
+            start = time.perf_counter()
+            found.append(query(i, filter_group(i)))
+            latencies.append(time.perf_counter() - start)
+        latencies = np.array(latencies) * 1000
+        results.append(
+            BenchmarkResult(
+                name=name,
+                dataset=dataset.name,
+                workload=workload,
+                k=k,
+                num_records=len(dataset.train),
+                num_queries=len(dataset.test),
+                insert_seconds=insert_seconds,
+                build_seconds=build_seconds,
+                memory_mb=memory_mb,
+                qps=1000 * len(latencies) / latencies.sum(),
+                latency_mean_ms=float(latencies.mean()),
+                latency_p50_ms=float(np.percentile(latencies, 50)),
+                latency_p99_ms=float(np.percentile(latencies, 99)),
+                recall=_recall(found, truth, k),
+                dtype=dtype,
+            )
+        )
+
+    if batch_size is not None:
+        start = time.perf_counter()
+        for i in range(0, len(dataset.test), batch_size):
+            engine.query(collection_class).similarity_batch(
+                collection_class.vector == dataset.test[i : i + batch_size]
+            ).limit(k)
+        results[0].batch_qps = len(dataset.test) / (
+            time.perf_counter() - start
+        )
+
+    if cleanup:
+        engine.delete_many(collection_class, ids)
+    return results
+
+
+# the `LocalEngine` backends that can be selected from the command line
+BACKENDS: dict[str, Callable[[], LocalBackend]] = {
+    "numpy": NumPyBackend,
+    "kdtree": KDTreeBackend,
+    "annoy": lambda: AnnoyBackend(n_trees=50),
+    "faiss": lambda: FAISSBackend("HNSW32"),
+    "pynndescent": PyNNDescentBackend,
+    "ivf": IVFBackend,
+    "hnsw": HNSWBackend,
+    "sq8": lambda: ScalarQuantizedBackend(rerank_factor=4),
+    "pq": lambda: ProductQuantizedBackend(rerank_factor=10),
+}
+
+
+def write_json(results: Sequence[BenchmarkResult], path: str | Path) -> None:
+    with open(path, "w") as f:
+        json.dump([asdict(r) for r in results], f, indent=2)
+
+
+def write_csv(results: Sequence[BenchmarkResult], path: str | Path) -> None:
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(
+            f, fieldnames=[field.name for field in fields(BenchmarkResult)]
+        )
+        writer.writeheader()
+        for r in results:
+            writer.writerow(asdict(r))
+
+
+def format_results(results: Sequence[BenchmarkResult]) -> str:
+    """A plain text table of the most important numbers"""
+    header = (
+        f"{'name':<24}{'workload':<12}{'recall':>8}{'qps':>10}"
+        f"{'p50 ms':>9}{'p99 ms':>9}{'build s':>9}{'mem MB':>9}"
+    )
+    lines = [header, "-" * len(header)]
+    for r in results:
+        memory = "-" if r.memory_mb is None else f"{r.memory_mb:.1f}"
+        lines.append(
+            f"{r.name:<24}{r.workload:<12}{r.recall:>8.3f}{r.qps:>10.1f}"
+            f"{r.latency_p50_ms:>9.3f}{r.latency_p99_ms:>9.3f}"
+            f"{r.insert_seconds + r.build_seconds:>9.2f}{memory:>9}"
+        )
+    return "\n".join(lines)
+
+
+def _host_port(value: str) -> tuple[str, int]:
+    host, _, port = value.rpartition(":")
+    return host or "localhost", int(port)
+
+
+def _parse_args(argv: Sequence[str] | None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m affine.bench", description=__doc__.splitlines()[0]
+    )
+    parser.add_argument(
+        "--dataset",
+        default="gaussian",
+        help="'gaussian', an ann-benchmarks .hdf5 file or a .fvecs file of "
+        "base vectors (together with --queries)",
+    )
+    parser.add_argument("--queries", help=".fvecs file of query vectors")
+    parser.add_argument("--groundtruth", help=".ivecs file of neighbors")
+    parser.add_argument("--n", type=int, help="number of records")
+    parser.add_argument("--n-queries", type=int, help="number of queries")
+    parser.add_argument("--dim", type=int, default=64)
+    parser.add_argument(
+        "--metric", choices=[m.value for m in Metric], default="euclidean"
+    )
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--num-groups", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--backends",
+        nargs="*",
+        choices=list(BACKENDS),
+        default=["numpy"],
+        help="LocalEngine backends to benchmark",
+    )
+    parser.add_argument("--qdrant", metavar="HOST:PORT")
+    parser.add_argument("--weaviate", metavar="HOST:PORT")
+    parser.add_argument(
+        "--pinecone",
+        action="store_true",
+        help="benchmark Pinecone (configured through environment variables)",
+    )
+    parser.add_argument(
+        "--no-filtered",
+        action="store_true",
+        help="skip the filtered workload",
+    )
+    parser.add_argument("--batch-size", type=int)
+    parser.add_argument(
+        "--dtype",
+        choices=["float16", "float32", "float64"],
+        default="float32",
+        help="dtype to store the vectors as",
+    )
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--csv", help="write the results to this file")
+    return parser.parse_args(argv)
+
+
+def _load_dataset(args: argparse.Namespace) -> Dataset:
+    if args.dataset == "gaussian":
+        return gaussian_dataset(
+            n=args.n or 10_000,
+            n_queries=args.n_queries or 100,
+            dim=args.dim,
+            metric=Metric(args.metric),
+            num_groups=args.num_groups,
+            seed=args.seed,
+        )
+    if args.dataset.endswith((".hdf5", ".h5")):
+        dataset = load_hdf5_dataset(args.dataset, args.num_groups, args.seed)
+    elif args.dataset.endswith(".fvecs"):
+        if args.queries is None:
+            raise ValueError("--queries is required for .fvecs datasets")
+        dataset = load_fvecs_dataset(
+            args.dataset,
+            args.queries,
+            args.groundtruth,
+            metric=Metric(args.metric),
+            num_groups=args.num_groups,
+            seed=args.seed,
+        )
+    else:
+        raise ValueError(f"Unknown dataset {args.dataset}")
+    return subsample(dataset, args.n, args.n_queries)
+
+
+def _engines(args: argparse.Namespace) -> dict[str, Callable[[], Engine]]:
+    ret: dict[str, Callable[[], Engine]] = {
+        f"LocalEngine[{name}]": (
+            lambda name=name: LocalEngine(backend=BACKENDS[name]())
+        )
+        for name in args.backends
+    }
+    if args.qdrant:
+        from affine.engine import QdrantEngine
+
+        ret["QdrantEngine"] = lambda: QdrantEngine(*_host_port(args.qdrant))
+    if args.weaviate:
+        from affine.engine import WeaviateEngine
+
+        ret["WeaviateEngine"] = lambda: WeaviateEngine(
+            *_host_port(args.weaviate)
+        )
+    if args.pinecone:
+        from affine.engine import PineconeEngine
+
+        ret["PineconeEngine"] = PineconeEngine
+    return ret
+
+
+def main(argv: Sequence[str] | None = None) -> list[BenchmarkResult]:
+    args = _parse_args(argv)
+    dataset = _load_dataset(args)
+    results = []
+    for name, make_engine in _engines(args).items():
+        results.extend(
+            run_benchmark(
+                make_engine(),
+                dataset,
+                k=args.k,
+                filtered=not args.no_filtered,
+                batch_size=args.batch_size,
+                dtype=args.dtype,
+                name=name,
+            )
+        )
+    print(format_results(results))
+    if args.json:
+        write_json(results, args.json)
+    if args.csv:
+        write_csv(results, args.csv)
+    return results
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
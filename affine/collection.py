@@ -1,6 +1,14 @@
 from dataclasses import dataclass, fields
 from enum import Enum
-from typing import Any, Generic, Literal, Type, TypeVar, get_origin
+from typing import (
+    Any,
+    ForwardRef,
+    Generic,
+    Literal,
+    Type,
+    TypeVar,
+    get_origin,
+)
 
 import numpy as np
 from typing_extensions import dataclass_transform
@@ -13,15 +21,66 @@ class Metric(str, Enum):
 
 N = TypeVar("N", bound=int)
 M = TypeVar("M", bound=Metric)
+D = TypeVar("D")
 
 Operation = Literal["eq", "lte", "gte", "lt", "gt"]
 
-
-class Vector(Generic[N, M]):
-    def __init__(self, array: np.ndarray | list):
-        if isinstance(array, list):
-            array = np.array(array)
-        self.array = array
+# the dtypes vectors can be stored as
+VECTOR_DTYPES = (np.float16, np.float32, np.float64)
+DEFAULT_VECTOR_DTYPE = np.float32
+
+
+def vector_dtype(dtype: Any) -> np.dtype:
+    """Validates a vector dtype given as a numpy dtype, scalar type or
+    name (e.g. "float16")"""
+    if isinstance(dtype, ForwardRef):
+        dtype = dtype.__forward_arg__
+    ret = np.dtype(dtype)
+    if ret not in VECTOR_DTYPES:
+        raise ValueError(
+            f"Unsupported vector dtype {ret}, expected one of "
+            f"{[np.dtype(d).name for d in VECTOR_DTYPES]}"
+        )
+    return ret
+
+
+class Vector(Generic[N, M, D]):
+    """A vector. As a type annotation of a collection field,
+    `Vector[dim, metric]` declares a vector field that is stored as float32
+    and `Vector[dim, metric, dtype]` one that is stored as `dtype`, which is
+    one of `np.float16`, `np.float32` or `np.float64` (or their names).
+    Vectors assigned to the field are converted to its dtype when the record
+    is created.
+
+    float16 halves the memory `LocalEngine` uses for the vectors (and
+    Qdrant stores float16 fields as float16 too). Backends that can't work
+    with float16 convert the vectors when building their index, except for
+    `NumPyBackend`, which keeps them as float16 and converts them while
+    searching, so exact single-vector searches get slower.
+
+    Parameters
+    ----------
+    array
+        the values of the vector
+    dtype
+        dtype to store the values as. if not given, floating point arrays of
+        one of the supported dtypes keep their dtype and everything else is
+        converted to float32
+    """
+
+    def __class_getitem__(cls, params):
+        if isinstance(params, tuple) and len(params) == 2:
+            params = (*params, np.dtype(DEFAULT_VECTOR_DTYPE).name)
+        return super().__class_getitem__(params)
+
+    def __init__(self, array: np.ndarray | list, dtype: Any = None):
+        if dtype is not None:
+            dtype = vector_dtype(dtype)
+        elif isinstance(array, np.ndarray) and array.dtype in VECTOR_DTYPES:
+            dtype = array.dtype
+        else:
+            dtype = DEFAULT_VECTOR_DTYPE
+        self.array = np.asarray(array, dtype=dtype)
 
     def __len__(self) -> int:
         return len(self.array)
@@ -33,7 +92,10 @@ class Vector(Generic[N, M]):
 
     def normalize(self) -> "Vector":
         """Returns the L2 normalized vector"""
-        return Vector(array=self.array / np.linalg.norm(self.array))
+        return Vector(
+            array=self.array / np.linalg.norm(self.array),
+            dtype=self.array.dtype,
+        )
 
     def __repr__(self) -> str:
         return f"<Vector: {self.array}>"
@@ -75,6 +137,31 @@ class Similarity:
             return self.value
         return np.array(self.value)
 
+    def get_batch_array(self) -> np.ndarray:
+        """Returns the query vectors of a batched similarity as an array
+        of shape (num_queries, dim)"""
+        if isinstance(self.value, np.ndarray):
+            ret = self.value
+        else:
+            ret = np.stack(
+                [
+                    v.array if isinstance(v, Vector) else np.asarray(v)
+                    for v in self.value
+                ]
+            )
+        if ret.ndim != 2:
+            raise ValueError(
+                f"Expected a 2D array of query vectors, got shape {ret.shape}"
+            )
+        return ret
+
+    def unbatch(self) -> list["Similarity"]:
+        """Splits a batched similarity into one similarity per query vector"""
+        return [
+            Similarity(collection=self.collection, field=self.field, value=v)
+            for v in self.get_batch_array()
+        ]
+
 
 @dataclass
 class FilterSet:
@@ -144,12 +231,25 @@ class Attribute:
         )
 
 
+# attributes that engines set on returned records, which a field of the same
+# name would clash with
+_RESERVED_FIELD_NAMES = {"query_distance"}
+
+
 class MetaCollection(type):
     """This metaclass is used so that subclasses of Collection are automatically decorated with dataclass"""
 
     def __new__(cls, name, bases, dct):
-        new_class = super().__new__(cls, name, bases, dct)
-        return dataclass(new_class)
+        reserved = _RESERVED_FIELD_NAMES & set(dct.get("__annotations__", {}))
+        if reserved:
+            raise TypeError(
+                f"{name} declares the fields {sorted(reserved)}, whose names "
+                "are reserved"
+            )
+        new_class = dataclass(super().__new__(cls, name, bases, dct))
+        # fail early on unsupported vector dtypes
+        new_class.get_vector_dtypes()
+        return new_class
 
     def __getattribute__(cls, name: str) -> Any:
         try:
@@ -171,11 +271,24 @@ class Collection(metaclass=MetaCollection):
                 n = field.type.__args__[0]
                 attr = getattr(self, field.name)
                 # when returning a query result the vector may not be present
-                if attr is not None and len(getattr(self, field.name)) != n:
+                if attr is None:
+                    continue
+                if len(attr) != n:
                     raise ValueError(
-                        f"Expected vector of length {n}, got {len(getattr(self, field.name))}"
+                        f"Expected vector of length {n}, got {len(attr)}"
+                    )
+                dtype = vector_dtype(field.type.__args__[2])
+                if not isinstance(attr, Vector) or attr.array.dtype != dtype:
+                    setattr(
+                        self,
+                        field.name,
+                        Vector(
+                            attr.array if isinstance(attr, Vector) else attr,
+                            dtype=dtype,
+                        ),
                     )
         self.id = None
+        self._query_distance = None
 
     @property
     def id(self) -> str | None:
@@ -185,6 +298,18 @@ class Collection(metaclass=MetaCollection):
     def id(self, value: str):
         self._id = value
 
+    @property
+    def query_distance(self) -> float | None:
+        """The distance of the record to the query vector if it was returned
+        by a similarity query (the euclidean distance for euclidean vector
+        fields and 1 - cosine similarity for cosine ones, so smaller is
+        closer for every engine), otherwise `None`"""
+        return self._query_distance
+
+    @query_distance.setter
+    def query_distance(self, value: float | None):
+        self._query_distance = value
+
     @classmethod
     def get_vector_fields(
         cls: Type["Collection"],
@@ -204,6 +329,21 @@ class Collection(metaclass=MetaCollection):
             if get_origin(f.type) == Vector
         ]
 
+    @classmethod
+    def get_vector_dtypes(cls: Type["Collection"]) -> dict[str, np.dtype]:
+        """Get the dtypes the vector fields of a collection are stored as
+
+        Returns
+        -------
+        dict[str, np.dtype]
+            maps the name of each vector field to its dtype
+        """
+        return {
+            f.name: vector_dtype(f.type.__args__[2])
+            for f in fields(cls)
+            if get_origin(f.type) == Vector
+        }
+
     def get_non_vector_dict(self) -> dict[str, Any]:
         """Returns a dictionary of all metadata (i.e. all fields and values that are not vectors)"""
         return {
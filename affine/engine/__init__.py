@@ -1,18 +1,19 @@
-from .base import Engine
-from .local import LocalEngine
+from .base import AsyncEngine, Engine, ExecutorAsyncEngine
+from .cache import CacheStats, CachingEngine
+from .local import AsyncLocalEngine, LocalEngine
 
 try:
-    from .qdrant import QdrantEngine
+    from .qdrant import AsyncQdrantEngine, QdrantEngine
 except ModuleNotFoundError:
     pass
 
 try:
-    from .weaviate import WeaviateEngine
+    from .weaviate import AsyncWeaviateEngine, WeaviateEngine
 except ModuleNotFoundError:
     pass
 
 try:
-    from .pinecone import PineconeEngine
+    from .pinecone import AsyncPineconeEngine, PineconeEngine
 except ModuleNotFoundError:
     pass
 
@@ -22,4 +23,12 @@ __all__ = [
     "QdrantEngine",
     "WeaviateEngine",
     "PineconeEngine",
+    "AsyncEngine",
+    "ExecutorAsyncEngine",
+    "AsyncLocalEngine",
+    "AsyncQdrantEngine",
+    "AsyncWeaviateEngine",
+    "AsyncPineconeEngine",
+    "CachingEngine",
+    "CacheStats",
 ]
@@ -1,13 +1,142 @@
+import asyncio
+import contextvars
+import functools
 from abc import ABC, abstractmethod
-from typing import Type
+from collections import defaultdict
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Iterable,
+    Iterator,
+    Type,
+)
 
-from affine.collection import Collection, FilterSet, Similarity
-from affine.query import QueryObject
+from affine.collection import (
+    Collection,
+    Filter,
+    FilterSet,
+    Metric,
+    Similarity,
+)
+from affine.query import AsyncQueryObject, QueryObject
+from affine.tracing import Tracer
+
+
+def _group_batches(
+    records: list[Collection], batch_size: int
+) -> Iterator[tuple[Type[Collection], list[int]]]:
+    """Split the positions of `records` into batches of at most `batch_size`
+    records that all belong to the same collection"""
+    positions = defaultdict(list)
+    for i, record in enumerate(records):
+        positions[type(record)].append(i)
+    for collection_class, collection_positions in positions.items():
+        for start in range(0, len(collection_positions), batch_size):
+            yield collection_class, collection_positions[
+                start : start + batch_size
+            ]
+
+
+def _chunks(items: list, size: int) -> Iterator[list]:
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+async def _gather_limited(
+    awaitables: Iterable[Awaitable], max_concurrent: int
+) -> list:
+    """Like `asyncio.gather`, but with at most `max_concurrent` of the
+    awaitables running at once"""
+    semaphore = asyncio.Semaphore(max_concurrent)
+
+    async def run(awaitable: Awaitable) -> Any:
+        async with semaphore:
+            return await awaitable
+
+    return await asyncio.gather(*(run(a) for a in awaitables))
+
+
+def _order_by_ids(
+    records: list[Collection], ids: list[int | str]
+) -> list[Collection]:
+    """Put `records` in the order of `ids` (as strings, since databases may
+    normalize the ids they return), dropping ids that were not found"""
+    by_id = {str(record.id): record for record in records}
+    return [by_id[str(id_)] for id_ in ids if str(id_) in by_id]
+
+
+def _similarity_metric(
+    collection_class: Type[Collection], similarity: Similarity
+) -> Metric:
+    """The metric of the vector field `similarity` searches"""
+    for name, _, metric in collection_class.get_vector_fields():
+        if name == similarity.field:
+            return metric
+    raise ValueError(
+        f"{collection_class.__name__} has no vector field {similarity.field}"
+    )
+
+
+def _apply_score_threshold(
+    records: list[Collection], score_threshold: float | None
+) -> list[Collection]:
+    """Drop the records whose `query_distance` is larger than
+    `score_threshold`, for engines whose database cannot apply the threshold
+    itself"""
+    if score_threshold is None:
+        return records
+    return [
+        record
+        for record in records
+        if record.query_distance <= score_threshold
+    ]
+
+
+def _as_delete_filter_set(filter_set: FilterSet | Filter) -> FilterSet:
+    if isinstance(filter_set, Filter):
+        filter_set = FilterSet(
+            filters=[filter_set], collection=filter_set.collection
+        )
+    if len(filter_set.filters) == 0:
+        # almost certainly a mistake, and a costly one
+        raise ValueError("delete_where requires at least one filter")
+    return filter_set
+
+
+def _resolve_delete_target(
+    record: Collection | None,
+    collection: Type[Collection] | None,
+    id: str | None,
+) -> tuple[Type[Collection], str]:
+    """Validate the arguments of `delete` and return the collection class and
+    id of the record to delete"""
+    if bool(record is None) == bool(collection is None and id is None):
+        raise ValueError("Either record or collection and id must be provided")
+    if record is not None:
+        if collection is not None or id is not None:
+            raise ValueError(
+                "Either record or collection and id must be provided"
+            )
+        return record.__class__, record.id
+    if collection is None or id is None:
+        raise ValueError("Either record or collection and id must be provided")
+    return collection, id
 
 
 class Engine(ABC):
 
     _RETURNS_NORMALIZED_FOR_COSINE = False
+    # number of queries `_query_batch` has in flight at once if the engine
+    # does not implement a native batch search
+    _MAX_CONCURRENT_QUERIES = 1
+    # default maximum number of records sent in one request by `insert_many`
+    # (`None` means no limit)
+    _INSERT_BATCH_SIZE: int | None = None
+    # receives the spans and counters of the engine's operations (see
+    # `affine.tracing`). does nothing unless replaced
+    tracer: Tracer = Tracer()
 
     @abstractmethod
     def _query(
@@ -16,9 +145,59 @@ class Engine(ABC):
         with_vectors: bool = False,
         similarity: Similarity | None = None,
         limit: int | None = None,
+        score_threshold: float | None = None,
     ) -> list[Collection]:
+        """Query the records matching `filter_set`. For similarity queries
+        the returned records have their `query_distance` set, and those
+        whose distance is larger than `score_threshold` (if given) are left
+        out."""
         pass
 
+    def _query_batch(
+        self,
+        filter_set: FilterSet,
+        similarity: Similarity,
+        limit: int,
+        with_vectors: bool = False,
+        score_threshold: float | None = None,
+    ) -> list[list[Collection]]:
+        """Similarity search for a batch of query vectors (the rows of
+        `similarity.get_batch_array()`). Engines should override this if the
+        backing library supports searching multiple vectors in one call."""
+
+        def query(s: Similarity) -> list[Collection]:
+            return self._query(
+                filter_set,
+                with_vectors=with_vectors,
+                similarity=s,
+                limit=limit,
+                score_threshold=score_threshold,
+            )
+
+        if self._MAX_CONCURRENT_QUERIES == 1:
+            return [query(s) for s in similarity.unbatch()]
+        with ThreadPoolExecutor(self._MAX_CONCURRENT_QUERIES) as executor:
+            # run each query in a copy of the current context so that their
+            # spans are children of the current span
+            futures = [
+                executor.submit(contextvars.copy_context().run, query, s)
+                for s in similarity.unbatch()
+            ]
+            return [f.result() for f in futures]
+
+    def _query_iter(
+        self,
+        filter_set: FilterSet,
+        with_vectors: bool = False,
+        batch_size: int = 1000,
+    ) -> Iterator[list[Collection]]:
+        """Pages of (at most `batch_size` of) the records matching
+        `filter_set`. Engines should override this to fetch the pages lazily
+        instead of loading all of the matching records at once."""
+        records = self._query(filter_set, with_vectors=with_vectors)
+        for start in range(0, len(records), batch_size):
+            yield records[start : start + batch_size]
+
     def query(
         self, collection_class: Type[Collection], with_vectors: bool = False
     ) -> QueryObject:
@@ -54,6 +233,63 @@ class Engine(ABC):
         """
         pass
 
+    def _insert_batch(
+        self, collection_class: Type[Collection], records: list[Collection]
+    ) -> list[int | str]:
+        """Insert records that all belong to `collection_class`. Engines
+        should override this if the backing database supports bulk inserts."""
+        return [self.insert(record) for record in records]
+
+    def _prepare_batch(
+        self, collection_class: Type[Collection], records: list[Collection]
+    ) -> Any:
+        """First stage of inserting a batch of records: assign ids to the
+        records and convert them to whatever `_send_batch` sends to the
+        database. Since the ids are assigned here, sending the result more
+        than once (e.g. when retrying) must not create duplicates."""
+        return records
+
+    def _send_batch(
+        self, collection_class: Type[Collection], payload: Any
+    ) -> None:
+        """Second stage of inserting a batch of records: send the result of
+        `_prepare_batch` to the database"""
+        self._insert_batch(collection_class, payload)
+
+    def _is_transient_error(self, exc: Exception) -> bool:
+        """Whether a request that failed with `exc` is worth retrying"""
+        return isinstance(exc, (ConnectionError, TimeoutError))
+
+    def insert_many(
+        self, records: Iterable[Collection], batch_size: int | None = None
+    ) -> list[int | str]:
+        """Insert multiple records, using as few requests as possible.
+
+        Parameters
+        ----------
+        records
+            the records to insert. these may belong to different collections
+        batch_size
+            maximum number of records to insert at once. defaults to an
+            engine-specific value
+
+        Returns
+        -------
+        list[int | str]
+            the resulting ids of the inserted records, in the same order as
+            `records`
+        """
+        records = list(records)
+        batch_size = batch_size or self._INSERT_BATCH_SIZE or len(records)
+        ids = [None] * len(records)
+        for collection_class, batch in _group_batches(records, batch_size):
+            batch_ids = self._insert_batch(
+                collection_class, [records[i] for i in batch]
+            )
+            for i, id_ in zip(batch, batch_ids):
+                ids[i] = id_
+        return ids
+
     @abstractmethod
     def _delete_by_id(self, collection: Type[Collection], id: str) -> None:
         pass
@@ -77,22 +313,60 @@ class Engine(ABC):
         id
             the id of the record
         """
-        if bool(record is None) == bool(collection is None and id is None):
-            raise ValueError(
-                "Either record or collection and id must be provided"
+        self._delete_by_id(*_resolve_delete_target(record, collection, id))
+
+    def _delete_by_ids(
+        self, collection: Type[Collection], ids: list[int | str]
+    ) -> None:
+        """Delete the records with the given ids. Engines should override this
+        if the backing database supports deleting multiple records at once."""
+        for id_ in ids:
+            self._delete_by_id(collection, id_)
+
+    def delete_many(
+        self, collection: Type[Collection], ids: Iterable[int | str]
+    ) -> None:
+        """Delete multiple records by their ids, using as few requests as
+        possible. Ids that do not exist are ignored.
+
+        Parameters
+        ----------
+        collection
+            the collection the records belong to
+        ids
+            the ids of the records to delete
+        """
+        ids = list(ids)
+        if len(ids) > 0:
+            self._delete_by_ids(collection, ids)
+
+    def _delete_where(self, filter_set: FilterSet) -> None:
+        """Delete the records matching `filter_set`. Engines should override
+        this if the backing database can delete by filter."""
+        # collect all of the records before deleting anything so that the
+        # deletes can't interfere with paging through the results
+        records = [
+            record for page in self._query_iter(filter_set) for record in page
+        ]
+        if len(records) > 0:
+            self._delete_by_ids(
+                type(records[0]), [record.id for record in records]
             )
-        if record is not None:
-            if collection is not None or id is not None:
-                raise ValueError(
-                    "Either record or collection and id must be provided"
-                )
-            self._delete_by_id(record.__class__, record.id)
-        else:
-            if collection is None or id is None:
-                raise ValueError(
-                    "Either record or collection and id must be provided"
-                )
-            self._delete_by_id(collection, id)
+
+    def delete_where(self, filter_set: FilterSet | Filter) -> None:
+        """Delete all records that match a filter, e.g.
+
+        ```python
+        db.delete_where(C.created_at < cutoff)
+        ```
+
+        Parameters
+        ----------
+        filter_set
+            the `FilterSet` or `Filter` the records to delete have to match.
+            it must contain at least one filter.
+        """
+        self._delete_where(_as_delete_filter_set(filter_set))
 
     @abstractmethod
     def get_elements_by_ids(
@@ -123,6 +397,31 @@ class Engine(ABC):
         """
         pass
 
+    def wait_for_records(
+        self,
+        collection_class: Type[Collection],
+        count: int,
+        timeout: float = 60.0,
+    ) -> None:
+        """Wait until at least `count` records of a collection are visible
+        to queries. Inserted records are visible right away in most engines,
+        so by default this returns immediately.
+
+        Parameters
+        ----------
+        collection_class
+            the collection to wait for
+        count
+            the number of records to wait for
+        timeout
+            seconds to wait before giving up
+
+        Raises
+        ------
+        TimeoutError
+            if fewer than `count` records are visible after `timeout` seconds
+        """
+
     def get_element_by_id(
         self, collection: type, id_: int | str
     ) -> Collection:
@@ -151,3 +450,330 @@ class Engine(ABC):
         if len(ret) > 1:
             raise ValueError(f"Multiple records found with id {id_}")
         return ret[0]
+
+
+class AsyncEngine(ABC):
+    """Counterpart of `Engine` for use with asyncio: every method that talks
+    to the database is a coroutine and `query` returns an `AsyncQueryObject`,
+    e.g.
+
+    ```python
+    await db.query(C).similarity(C.embedding == v).limit(10)
+    ```
+    """
+
+    _RETURNS_NORMALIZED_FOR_COSINE = False
+    # default maximum number of records sent in one request by `insert_many`
+    # (`None` means no limit)
+    _INSERT_BATCH_SIZE: int | None = None
+    # maximum number of requests in flight at once when an operation is
+    # split into many requests (e.g. `delete_many` with a lot of ids)
+    _MAX_CONCURRENT_REQUESTS = 16
+    tracer: Tracer = Tracer()
+
+    @abstractmethod
+    async def _query(
+        self,
+        filter_set: FilterSet,
+        with_vectors: bool = False,
+        similarity: Similarity | None = None,
+        limit: int | None = None,
+        score_threshold: float | None = None,
+    ) -> list[Collection]:
+        """Query the records matching `filter_set`, see `Engine._query`"""
+        pass
+
+    async def _query_batch(
+        self,
+        filter_set: FilterSet,
+        similarity: Similarity,
+        limit: int,
+        with_vectors: bool = False,
+        score_threshold: float | None = None,
+    ) -> list[list[Collection]]:
+        """Similarity search for a batch of query vectors. By default the
+        queries are sent concurrently, at most `_MAX_CONCURRENT_REQUESTS` at
+        a time."""
+        return await _gather_limited(
+            (
+                self._query(
+                    filter_set,
+                    with_vectors=with_vectors,
+                    similarity=s,
+                    limit=limit,
+                    score_threshold=score_threshold,
+                )
+                for s in similarity.unbatch()
+            ),
+            self._MAX_CONCURRENT_REQUESTS,
+        )
+
+    async def _query_iter(
+        self,
+        filter_set: FilterSet,
+        with_vectors: bool = False,
+        batch_size: int = 1000,
+    ) -> AsyncIterator[list[Collection]]:
+        """Pages of the records matching `filter_set`, see
+        `Engine._query_iter`"""
+        records = await self._query(filter_set, with_vectors=with_vectors)
+        for start in range(0, len(records), batch_size):
+            yield records[start : start + batch_size]
+
+    def query(
+        self, collection_class: Type[Collection], with_vectors: bool = False
+    ) -> AsyncQueryObject:
+        """
+        Parameters
+        ----------
+        collection_class
+            the collection class to query
+        with_vectors
+            wether or not the returned objects should have their vector attributes populated
+            (or otherwise be set to `None`)
+
+        Returns
+        -------
+        AsyncQueryObject
+            the resulting AsyncQueryObject
+        """
+        return AsyncQueryObject(
+            self, collection_class, with_vectors=with_vectors
+        )
+
+    @abstractmethod
+    async def insert(self, record: Collection) -> int | str:
+        """Insert a record
+
+        Parameters
+        ----------
+        record
+            the record to insert
+
+        Returns
+        -------
+        int | str
+            the resulting id of the inserted record
+        """
+        pass
+
+    async def _insert_batch(
+        self, collection_class: Type[Collection], records: list[Collection]
+    ) -> list[int | str]:
+        """Insert records that all belong to `collection_class`. Engines
+        should override this if the backing database supports bulk inserts."""
+        return [await self.insert(record) for record in records]
+
+    async def insert_many(
+        self, records: Iterable[Collection], batch_size: int | None = None
+    ) -> list[int | str]:
+        """Insert multiple records, see `Engine.insert_many`"""
+        records = list(records)
+        batch_size = batch_size or self._INSERT_BATCH_SIZE or len(records)
+        ids = [None] * len(records)
+        for collection_class, batch in _group_batches(records, batch_size):
+            batch_ids = await self._insert_batch(
+                collection_class, [records[i] for i in batch]
+            )
+            for i, id_ in zip(batch, batch_ids):
+                ids[i] = id_
+        return ids
+
+    @abstractmethod
+    async def _delete_by_id(
+        self, collection: Type[Collection], id: str
+    ) -> None:
+        pass
+
+    async def delete(
+        self,
+        *,
+        record: Collection | None = None,
+        collection: Type[Collection] | None = None,
+        id: str | None = None,
+    ) -> None:
+        """Delete a record from the database, see `Engine.delete`"""
+        await self._delete_by_id(
+            *_resolve_delete_target(record, collection, id)
+        )
+
+    async def _delete_by_ids(
+        self, collection: Type[Collection], ids: list[int | str]
+    ) -> None:
+        await _gather_limited(
+            (self._delete_by_id(collection, id_) for id_ in ids),
+            self._MAX_CONCURRENT_REQUESTS,
+        )
+
+    async def delete_many(
+        self, collection: Type[Collection], ids: Iterable[int | str]
+    ) -> None:
+        """Delete multiple records by their ids, see `Engine.delete_many`"""
+        ids = list(ids)
+        if len(ids) > 0:
+            await self._delete_by_ids(collection, ids)
+
+    async def _delete_where(self, filter_set: FilterSet) -> None:
+        records = [
+            record
+            async for page in self._query_iter(filter_set)
+            for record in page
+        ]
+        if len(records) > 0:
+            await self._delete_by_ids(
+                type(records[0]), [record.id for record in records]
+            )
+
+    async def delete_where(self, filter_set: FilterSet | Filter) -> None:
+        """Delete all records that match a filter, see `Engine.delete_where`"""
+        await self._delete_where(_as_delete_filter_set(filter_set))
+
+    @abstractmethod
+    async def get_elements_by_ids(
+        self, collection: type, ids: list[int | str]
+    ) -> list[Collection]:
+        """Get elements by ids, see `Engine.get_elements_by_ids`"""
+        pass
+
+    @abstractmethod
+    async def register_collection(
+        self, collection_class: Type[Collection]
+    ) -> None:
+        """Register a collection to the database, see
+        `Engine.register_collection`"""
+        pass
+
+    async def get_element_by_id(
+        self, collection: type, id_: int | str
+    ) -> Collection:
+        """Get an element by its id, see `Engine.get_element_by_id`"""
+        ret = await self.get_elements_by_ids(collection, [id_])
+        if len(ret) == 0:
+            raise ValueError(f"No record found with id {id_}")
+        if len(ret) > 1:
+            raise ValueError(f"Multiple records found with id {id_}")
+        return ret[0]
+
+
+class ExecutorAsyncEngine(AsyncEngine):
+    """Async engine that runs the methods of a synchronous `Engine` in an
+    executor, for databases whose client has no asyncio support.
+
+    Parameters
+    ----------
+    engine
+        the synchronous engine to wrap
+    executor
+        executor to run the calls in. defaults to the event loop's default
+        executor. the engine must be thread-safe unless the executor uses a
+        single thread
+    """
+
+    def __init__(self, engine: Engine, executor: Executor | None = None):
+        self.engine = engine
+        self.executor = executor
+        self._RETURNS_NORMALIZED_FOR_COSINE = (
+            engine._RETURNS_NORMALIZED_FOR_COSINE
+        )
+
+    @property
+    def tracer(self) -> Tracer:
+        # the wrapped engine reports the phases of the calls it runs, so
+        # both use the same tracer
+        return self.engine.tracer
+
+    @tracer.setter
+    def tracer(self, tracer: Tracer) -> None:
+        self.engine.tracer = tracer
+
+    async def _run(self, fn, *args, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        # run in a copy of the current context so that spans started by `fn`
+        # are children of the current span
+        return await loop.run_in_executor(
+            self.executor,
+            functools.partial(
+                contextvars.copy_context().run, fn, *args, **kwargs
+            ),
+        )
+
+    async def _query(
+        self,
+        filter_set: FilterSet,
+        with_vectors: bool = False,
+        similarity: Similarity | None = None,
+        limit: int | None = None,
+        score_threshold: float | None = None,
+    ) -> list[Collection]:
+        return await self._run(
+            self.engine._query,
+            filter_set,
+            with_vectors=with_vectors,
+            similarity=similarity,
+            limit=limit,
+            score_threshold=score_threshold,
+        )
+
+    async def _query_batch(
+        self,
+        filter_set: FilterSet,
+        similarity: Similarity,
+        limit: int,
+        with_vectors: bool = False,
+        score_threshold: float | None = None,
+    ) -> list[list[Collection]]:
+        return await self._run(
+            self.engine._query_batch,
+            filter_set,
+            similarity=similarity,
+            limit=limit,
+            with_vectors=with_vectors,
+            score_threshold=score_threshold,
+        )
+
+    async def _query_iter(
+        self,
+        filter_set: FilterSet,
+        with_vectors: bool = False,
+        batch_size: int = 1000,
+    ) -> AsyncIterator[list[Collection]]:
+        pages = self.engine._query_iter(
+            filter_set, with_vectors=with_vectors, batch_size=batch_size
+        )
+        while (page := await self._run(next, pages, None)) is not None:
+            yield page
+
+    async def insert(self, record: Collection) -> int | str:
+        return await self._run(self.engine.insert, record)
+
+    async def insert_many(
+        self, records: Iterable[Collection], batch_size: int | None = None
+    ) -> list[int | str]:
+        return await self._run(
+            self.engine.insert_many, list(records), batch_size=batch_size
+        )
+
+    async def _delete_by_id(
+        self, collection: Type[Collection], id: str
+    ) -> None:
+        await self._run(self.engine._delete_by_id, collection, id)
+
+    async def _delete_by_ids(
+        self, collection: Type[Collection], ids: list[int | str]
+    ) -> None:
+        await self._run(self.engine._delete_by_ids, collection, ids)
+
+    async def _delete_where(self, filter_set: FilterSet) -> None:
+        await self._run(self.engine._delete_where, filter_set)
+
+    async def get_elements_by_ids(
+        self, collection: type, ids: list[int | str]
+    ) -> list[Collection]:
+        return await self._run(
+            self.engine.get_elements_by_ids, collection, ids
+        )
+
+    async def register_collection(
+        self, collection_class: Type[Collection]
+    ) -> None:
+        await self._run(self.engine.register_collection, collection_class)
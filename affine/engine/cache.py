@@ -0,0 +1,403 @@
+import copy
+import hashlib
+import sys
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass, fields
+from typing import Any, Hashable, Iterable, Iterator, Type, get_origin
+
+import numpy as np
+
+from affine.collection import Collection, FilterSet, Similarity, Vector
+from affine.engine import Engine
+from affine.query import QueryObject
+from affine.tracing import Tracer
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    # entries dropped because of the size limits
+    evictions: int = 0
+    # entries dropped because they expired or their collection was written to
+    invalidations: int = 0
+    num_entries: int = 0
+    num_bytes: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+
+@dataclass
+class _CacheEntry:
+    collection: str
+    records: list[Collection]
+    num_bytes: int
+    expires_at: float
+
+
+def _vector_digest(array: np.ndarray) -> bytes:
+    array = np.ascontiguousarray(array, dtype=np.float64)
+    return hashlib.blake2b(array.tobytes(), digest_size=16).digest()
+
+
+def _cache_key(
+    filter_set: FilterSet,
+    similarity: Similarity | None,
+    limit: int | None,
+    with_vectors: bool,
+    score_threshold: float | None = None,
+    vector: np.ndarray | None = None,
+) -> Hashable:
+    """Key identifying a query. `vector` overrides the query vector of
+    `similarity`, which is used for the rows of batched queries."""
+    filters = tuple(
+        (f.field, f.operation, repr(f.value)) for f in filter_set.filters
+    )
+    if similarity is None:
+        similarity_key = None
+    else:
+        if vector is None:
+            vector = similarity.get_array()
+        similarity_key = (similarity.field, _vector_digest(vector))
+    return (
+        filter_set.collection,
+        filters,
+        similarity_key,
+        limit,
+        with_vectors,
+        score_threshold,
+    )
+
+
+def _copy_record(record: Collection) -> Collection:
+    """A copy of `record` that shares no mutable state with it (including
+    the arrays of its vectors)"""
+    ret = copy.copy(record)
+    for f in fields(record):
+        value = getattr(record, f.name)
+        if isinstance(value, Vector):
+            setattr(ret, f.name, Vector(value.array.copy()))
+    return ret
+
+
+def _estimate_num_bytes(records: list[Collection]) -> int:
+    """Rough estimate of the memory used by `records`"""
+    ret = sys.getsizeof(records)
+    for record in records:
+        ret += sys.getsizeof(record) + sys.getsizeof(record.__dict__)
+        for f in fields(record):
+            value = getattr(record, f.name)
+            if get_origin(f.type) == Vector and value is not None:
+                ret += value.array.nbytes
+            else:
+                ret += sys.getsizeof(value)
+    return ret
+
+
+class CachingEngine(Engine):
+    """Wraps an engine and caches the results of its queries (including
+    similarity queries, which are keyed on a hash of the query vector).
+
+    Entries are evicted in least recently used order once there are more
+    than `max_entries` of them or they take up more than `max_bytes`, and
+    expire after `ttl` seconds. Inserting into or deleting from a collection
+    through the caching engine drops all cached results for that collection;
+    writes that bypass it (e.g. through `engine` directly or by another
+    process) are only picked up once the entries expire.
+
+    Parameters
+    ----------
+    engine
+        the engine whose results to cache
+    max_entries
+        maximum number of cached query results
+    max_bytes
+        maximum (estimated) memory used by the cached records
+    ttl
+        number of seconds after which a cached result expires. `None` means
+        results only get evicted or invalidated by writes.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        max_entries: int = 1024,
+        max_bytes: int | None = 64 * 1024 * 1024,
+        ttl: float | None = None,
+    ):
+        self.engine = engine
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._RETURNS_NORMALIZED_FOR_COSINE = (
+            engine._RETURNS_NORMALIZED_FOR_COSINE
+        )
+        self._INSERT_BATCH_SIZE = engine._INSERT_BATCH_SIZE
+        self._entries: OrderedDict[Hashable, _CacheEntry] = OrderedDict()
+        self._stats = CacheStats()
+        # incremented whenever a collection is written to, so that results
+        # of queries that were running during the write don't get cached
+        self._generations: dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    @property
+    def tracer(self) -> Tracer:
+        # queries that miss the cache are reported by the wrapped engine, so
+        # both use the same tracer
+        return self.engine.tracer
+
+    @tracer.setter
+    def tracer(self, tracer: Tracer) -> None:
+        self.engine.tracer = tracer
+
+    @property
+    def stats(self) -> CacheStats:
+        """A snapshot of the cache counters"""
+        with self._lock:
+            return copy.copy(self._stats)
+
+    def clear(self) -> None:
+        """Drop all cached results"""
+        with self._lock:
+            for name in {e.collection for e in self._entries.values()}:
+                self._generations[name] += 1
+            self._stats.invalidations += len(self._entries)
+            self._entries.clear()
+            self._stats.num_entries = self._stats.num_bytes = 0
+
+    def invalidate(self, collection_class: Type[Collection]) -> None:
+        """Drop the cached results for a collection"""
+        self._invalidate(collection_class.__name__)
+
+    def _invalidate(self, collection_name: str) -> None:
+        with self._lock:
+            self._generations[collection_name] += 1
+            for key in [
+                k
+                for k, e in self._entries.items()
+                if e.collection == collection_name
+            ]:
+                self._drop(key)
+                self._stats.invalidations += 1
+
+    def _drop(self, key: Hashable) -> None:
+        entry = self._entries.pop(key)
+        self._stats.num_entries -= 1
+        self._stats.num_bytes -= entry.num_bytes
+
+    def _get(self, key: Hashable) -> list[Collection] | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= time.monotonic():
+                self._drop(key)
+                self._stats.invalidations += 1
+                entry = None
+            if entry is None:
+                self._stats.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self._stats.hits += 1
+        self.tracer.count("cache_misses" if entry is None else "cache_hits", 1)
+        if entry is None:
+            return None
+        # hand out copies so that callers modifying the returned records
+        # don't modify the cached ones
+        return [_copy_record(record) for record in entry.records]
+
+    def _put(
+        self,
+        key: Hashable,
+        collection_name: str,
+        records: list[Collection],
+        generation: int,
+    ) -> None:
+        num_bytes = _estimate_num_bytes(records)
+        if self.max_bytes is not None and num_bytes > self.max_bytes:
+            return
+        entry = _CacheEntry(
+            collection=collection_name,
+            records=[_copy_record(record) for record in records],
+            num_bytes=num_bytes,
+            expires_at=(
+                float("inf")
+                if self.ttl is None
+                else time.monotonic() + self.ttl
+            ),
+        )
+        with self._lock:
+            if self._generations[collection_name] != generation:
+                return
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = entry
+            self._stats.num_entries += 1
+            self._stats.num_bytes += num_bytes
+            while len(self._entries) > self.max_entries or (
+                self.max_bytes is not None
+                and self._stats.num_bytes > self.max_bytes
+            ):
+                self._drop(next(iter(self._entries)))
+                self._stats.evictions += 1
+
+    def _generation(self, collection_name: str) -> int:
+        with self._lock:
+            return self._generations[collection_name]
+
+    def _query(
+        self,
+        filter_set: FilterSet,
+        with_vectors: bool = False,
+        similarity: Similarity | None = None,
+        limit: int | None = None,
+        score_threshold: float | None = None,
+    ) -> list[Collection]:
+        key = _cache_key(
+            filter_set, similarity, limit, with_vectors, score_threshold
+        )
+        ret = self._get(key)
+        if ret is None:
+            generation = self._generation(filter_set.collection)
+            ret = self.engine._query(
+                filter_set,
+                with_vectors=with_vectors,
+                similarity=similarity,
+                limit=limit,
+                score_threshold=score_threshold,
+            )
+            self._put(key, filter_set.collection, ret, generation)
+        return ret
+
+    def _query_batch(
+        self,
+        filter_set: FilterSet,
+        similarity: Similarity,
+        limit: int,
+        with_vectors: bool = False,
+        score_threshold: float | None = None,
+    ) -> list[list[Collection]]:
+        # look up each query vector separately and only send the ones that
+        # are not cached to the engine
+        Q = similarity.get_batch_array()
+        keys = [
+            _cache_key(
+                filter_set,
+                similarity,
+                limit,
+                with_vectors,
+                score_threshold,
+                vector=q,
+            )
+            for q in Q
+        ]
+        ret = [self._get(key) for key in keys]
+        missing = [i for i, records in enumerate(ret) if records is None]
+        if len(missing) > 0:
+            generation = self._generation(filter_set.collection)
+            results = self.engine._query_batch(
+                filter_set,
+                similarity=Similarity(
+                    collection=similarity.collection,
+                    field=similarity.field,
+                    value=Q[missing],
+                ),
+                limit=limit,
+                with_vectors=with_vectors,
+                score_threshold=score_threshold,
+            )
+            for i, records in zip(missing, results):
+                self._put(keys[i], filter_set.collection, records, generation)
+                ret[i] = records
+        return ret
+
+    def _query_iter(
+        self,
+        filter_set: FilterSet,
+        with_vectors: bool = False,
+        batch_size: int = 1000,
+    ) -> Iterator[list[Collection]]:
+        # iterating is meant for reading a lot of records once, so it is
+        # not cached
+        return self.engine._query_iter(
+            filter_set, with_vectors=with_vectors, batch_size=batch_size
+        )
+
+    def query(
+        self,
+        collection_class: Type[Collection],
+        with_vectors: bool | None = None,
+    ) -> QueryObject:
+        if with_vectors is None:
+            # use the default of the wrapped engine
+            with_vectors = self.engine.query(collection_class).with_vectors
+        return super().query(collection_class, with_vectors=with_vectors)
+
+    def insert(self, record: Collection) -> int | str:
+        try:
+            return self.engine.insert(record)
+        finally:
+            self._invalidate(type(record).__name__)
+
+    def _insert_batch(
+        self, collection_class: Type[Collection], records: list[Collection]
+    ) -> list[int | str]:
+        try:
+            return self.engine._insert_batch(collection_class, records)
+        finally:
+            self._invalidate(collection_class.__name__)
+
+    def _prepare_batch(
+        self, collection_class: Type[Collection], records: list[Collection]
+    ) -> Any:
+        return self.engine._prepare_batch(collection_class, records)
+
+    def _send_batch(
+        self, collection_class: Type[Collection], payload: Any
+    ) -> None:
+        try:
+            self.engine._send_batch(collection_class, payload)
+        finally:
+            self._invalidate(collection_class.__name__)
+
+    def _is_transient_error(self, exc: Exception) -> bool:
+        return self.engine._is_transient_error(exc)
+
+    def _delete_by_id(self, collection: Type[Collection], id: str) -> None:
+        try:
+            self.engine._delete_by_id(collection, id)
+        finally:
+            self._invalidate(collection.__name__)
+
+    def _delete_by_ids(
+        self, collection: Type[Collection], ids: list[int | str]
+    ) -> None:
+        try:
+            self.engine._delete_by_ids(collection, ids)
+        finally:
+            self._invalidate(collection.__name__)
+
+    def _delete_where(self, filter_set: FilterSet) -> None:
+        try:
+            self.engine._delete_where(filter_set)
+        finally:
+            self._invalidate(filter_set.collection)
+
+    def get_elements_by_ids(
+        self, collection: type, ids: Iterable[int | str]
+    ) -> list[Collection]:
+        return self.engine.get_elements_by_ids(collection, ids)
+
+    def register_collection(self, collection_class: Type[Collection]) -> None:
+        self.engine.register_collection(collection_class)
+
+    def wait_for_records(
+        self,
+        collection_class: Type[Collection],
+        count: int,
+        timeout: float = 60.0,
+    ) -> None:
+        self.engine.wait_for_records(collection_class, count, timeout)
@@ -1,96 +1,843 @@
+import bisect
+import contextvars
+import copy
+import heapq
+import importlib
+import json
+import math
+import operator
+import os
 import pickle
+import tempfile
+import threading
 import warnings
 from abc import ABC, abstractmethod
 from collections import defaultdict
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from dataclasses import dataclass, fields
 from pathlib import Path
-from typing import BinaryIO, Type
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Iterator,
+    Literal,
+    Type,
+    get_origin,
+)
 
 import numpy as np
 
-from affine.collection import Collection, Filter, FilterSet, Metric, Similarity
-from affine.engine import Engine
-from affine.query import QueryObject
-
-
-def apply_filter_to_record(filter_: Filter, record: Collection) -> bool:
-    field = getattr(record, filter_.field)
-    if filter_.operation == "eq":
-        return field == filter_.value
-    elif filter_.operation == "gte":
-        return field >= filter_.value
-    elif filter_.operation == "lte":
-        return field <= filter_.value
-    elif filter_.operation == "gt":
-        return field > filter_.value
-    elif filter_.operation == "lt":
-        return field < filter_.value
-    else:
-        raise ValueError(f"Operation {filter_.operation} not supported")
+from affine.collection import (
+    Collection,
+    Filter,
+    FilterSet,
+    Metric,
+    Operation,
+    Similarity,
+    Vector,
+)
+from affine.engine import Engine, ExecutorAsyncEngine
+from affine.query import AsyncQueryObject, QueryObject
+from affine.tracing import Tracer, count_records
 
+_FILTER_OPERATIONS = {
+    "eq": operator.eq,
+    "gte": operator.ge,
+    "lte": operator.le,
+    "gt": operator.gt,
+    "lt": operator.lt,
+}
 
-def apply_filters_to_records(
-    filters: list[Filter], records: list[Collection]
-) -> list[Collection]:
-    ret = []
-    for record in records:
-        record_match = True
-        for f in filters:
-            if not apply_filter_to_record(f, record):
-                record_match = False
-                break
-        if record_match:
-            ret.append(record)
-    return ret
 
+def compile_filter_mask(
+    filters: list[Filter],
+    store: "ColumnStore",
+    rows: np.ndarray | None = None,
+) -> np.ndarray:
+    """Evaluates `filters` against the columns of `store`.
+
+    Parameters
+    ----------
+    filters
+        the filters to evaluate
+    store
+        the store holding the records
+    rows
+        if provided, only evaluate the filters on these row positions
+
+    Returns
+    -------
+    np.ndarray
+        boolean mask over the rows of `store` (or over `rows`, if passed) which
+        is `True` for the records that match all of the filters
+    """
+    mask = np.ones(len(store) if rows is None else len(rows), dtype=bool)
+    for f in filters:
+        if f.operation not in _FILTER_OPERATIONS:
+            raise ValueError(f"Operation {f.operation} not supported")
+        column = store.column(f.field)
+        if rows is not None:
+            column = column[rows]
+        mask &= _FILTER_OPERATIONS[f.operation](column, f.value)
+    return mask
 
-def build_data_matrix(
-    field_name: str, records: list[Collection]
+
+def apply_filters_to_store(
+    filters: list[Filter], store: "ColumnStore", tracer: Tracer = Tracer()
 ) -> np.ndarray:
-    return np.stack([getattr(r, field_name).array for r in records])
+    """Returns the (sorted) row positions of the records in `store` that
+    match all of `filters`.
 
+    If any of the filters can be answered by one of the store's metadata
+    indexes then the most selective of those is used to get a set of
+    candidate rows, and only the remaining filters are evaluated (on the
+    candidates only). The number of rows the remaining filters are evaluated
+    on is reported to `tracer` as "rows_scanned".
+    """
+    if len(filters) == 0:
+        return store.live_rows()
+
+    indexed = [
+        (store.metadata_indexes[f.field], f)
+        for f in filters
+        if f.field in store.metadata_indexes
+        and store.metadata_indexes[f.field].supports(f.operation)
+    ]
+    if len(indexed) == 0:
+        tracer.count("rows_scanned", len(store))
+        return np.flatnonzero(
+            compile_filter_mask(filters, store) & store.live_mask()
+        )
+
+    index, best = min(indexed, key=lambda x: x[0].estimate(x[1]))
+    rows = store.rows_for_ids(index.lookup(best))
+    remaining = [f for f in filters if f is not best]
+    if len(remaining) > 0:
+        tracer.count("rows_scanned", len(rows))
+    return rows[compile_filter_mask(remaining, store, rows)]
+
+
+class MetadataIndex(ABC):
+    """Secondary index over a metadata field of a `ColumnStore`, mapping
+    field values to record ids."""
 
-class LocalBackend(ABC):
     @abstractmethod
-    def create_index(self, data: np.ndarray, metric: Metric) -> None:
+    def supports(self, operation: Operation) -> bool:
+        """Whether the index can answer filters with this operation"""
         pass
 
     @abstractmethod
-    def query(self, q: np.ndarray, k: int) -> list[int]:
+    def add(self, values: list, ids: list[int]) -> None:
         pass
 
-    # TODO: implement save and load
-    # @abstractmethod
-    # def save(self, fp):
-    #     pass
+    @abstractmethod
+    def remove(self, values: list, ids: list[int]) -> None:
+        pass
+
+    @abstractmethod
+    def estimate(self, filter_: Filter) -> int:
+        """Number of records matching `filter_`, used for query planning"""
+        pass
+
+    @abstractmethod
+    def lookup(self, filter_: Filter) -> np.ndarray:
+        """Ids of the records matching `filter_`"""
+        pass
+
+
+class HashIndex(MetadataIndex):
+    """Index for equality filters"""
+
+    def __init__(self) -> None:
+        self._buckets: dict[Any, set[int]] = defaultdict(set)
+
+    def supports(self, operation: Operation) -> bool:
+        return operation == "eq"
+
+    def add(self, values: list, ids: list[int]) -> None:
+        for value, id_ in zip(values, ids):
+            self._buckets[value].add(id_)
+
+    def remove(self, values: list, ids: list[int]) -> None:
+        for value, id_ in zip(values, ids):
+            bucket = self._buckets[value]
+            bucket.discard(id_)
+            if len(bucket) == 0:
+                del self._buckets[value]
+
+    def estimate(self, filter_: Filter) -> int:
+        return len(self._buckets.get(filter_.value, ()))
+
+    def lookup(self, filter_: Filter) -> np.ndarray:
+        return np.fromiter(
+            self._buckets.get(filter_.value, ()), dtype=np.int64
+        )
+
+
+class SortedIndex(MetadataIndex):
+    """Index for range (and equality) filters. Keeps the values in sorted
+    order so that matches can be found by bisection. `None` values are not
+    indexed since they can't be compared."""
+
+    def __init__(self) -> None:
+        self._values: list = []
+        self._ids: list[int] = []
+
+    def supports(self, operation: Operation) -> bool:
+        return operation in ("eq", "lt", "lte", "gt", "gte")
+
+    def add(self, values: list, ids: list[int]) -> None:
+        for value, id_ in zip(values, ids):
+            if value is None:
+                continue
+            i = bisect.bisect_right(self._values, value)
+            self._values.insert(i, value)
+            self._ids.insert(i, id_)
+
+    def remove(self, values: list, ids: list[int]) -> None:
+        for value, id_ in zip(values, ids):
+            if value is None:
+                continue
+            lo = bisect.bisect_left(self._values, value)
+            hi = bisect.bisect_right(self._values, value)
+            i = lo + self._ids[lo:hi].index(id_)
+            del self._values[i]
+            del self._ids[i]
+
+    def _bounds(self, filter_: Filter) -> tuple[int, int]:
+        value = filter_.value
+        if filter_.operation == "eq":
+            return (
+                bisect.bisect_left(self._values, value),
+                bisect.bisect_right(self._values, value),
+            )
+        if filter_.operation == "lt":
+            return 0, bisect.bisect_left(self._values, value)
+        if filter_.operation == "lte":
+            return 0, bisect.bisect_right(self._values, value)
+        if filter_.operation == "gt":
+            return bisect.bisect_right(self._values, value), len(self._values)
+        if filter_.operation == "gte":
+            return bisect.bisect_left(self._values, value), len(self._values)
+        raise ValueError(f"Operation {filter_.operation} not supported")
+
+    def estimate(self, filter_: Filter) -> int:
+        lo, hi = self._bounds(filter_)
+        return hi - lo
+
+    def lookup(self, filter_: Filter) -> np.ndarray:
+        lo, hi = self._bounds(filter_)
+        return np.array(self._ids[lo:hi], dtype=np.int64)
+
+
+_METADATA_INDEX_KINDS = {"hash": HashIndex, "sorted": SortedIndex}
+
+
+# numpy dtypes used for the metadata columns of a `ColumnStore`. fields whose
+# type is not in here (e.g. `str`) are stored in object arrays.
+_COLUMN_DTYPES = {int: np.int64, float: np.float64, bool: np.bool_}
+
+
+def _values_fit_column(values: np.ndarray, column: np.ndarray) -> bool:
+    if column.dtype == object:
+        return True
+    if values.dtype.kind == column.dtype.kind:
+        return True
+    # ints can be stored in a float column without surprises
+    return column.dtype.kind == "f" and values.dtype.kind in "iu"
+
+
+class ColumnStore:
+    """Columnar storage for the records of a single collection.
+
+    Every vector field is kept in a contiguous matrix of the field's dtype
+    (float32 unless declared otherwise), every metadata
+    field in a numpy column and the record ids in an int64 array. All of these
+    are over-allocated and grow geometrically so that appends are amortized
+    O(1). `Collection` objects are only created (by `materialize`) for the
+    rows that are returned from a query.
+
+    Rows are kept sorted by id, so ids passed to `append` must be larger than
+    any id already in the store.
+
+    Deleting records with `mark_deleted` only sets a tombstone on their rows,
+    so that row positions (and thereby any index built over them) stay valid.
+    The rows are removed for real by `compact`.
+    """
+
+    def __init__(
+        self, collection_class: Type[Collection], capacity: int = 16
+    ) -> None:
+        self.collection_class = collection_class
+        self._size = 0
+        self._capacity = capacity
+        self.ids = np.empty(capacity, dtype=np.int64)
+        dtypes = collection_class.get_vector_dtypes()
+        self.vectors: dict[str, np.ndarray] = {
+            name: np.empty((capacity, dim), dtype=dtypes[name])
+            for name, dim, _ in collection_class.get_vector_fields()
+        }
+        self.columns: dict[str, np.ndarray] = {
+            f.name: np.empty(
+                capacity, dtype=_COLUMN_DTYPES.get(f.type, object)
+            )
+            for f in fields(collection_class)
+            if get_origin(f.type) != Vector
+        }
+        # maps metadata field name to a secondary index over it
+        self.metadata_indexes: dict[str, MetadataIndex] = {}
+        # tombstones of the deleted rows
+        self.deleted = np.zeros(capacity, dtype=bool)
+        self.num_deleted = 0
+
+    def __len__(self) -> int:
+        """The number of rows, including the deleted rows that have not been
+        compacted yet"""
+        return self._size
+
+    @property
+    def num_live(self) -> int:
+        return self._size - self.num_deleted
+
+    def live_mask(self) -> np.ndarray:
+        return ~self.deleted[: self._size]
+
+    def live_rows(self) -> np.ndarray:
+        if self.num_deleted == 0:
+            return np.arange(self._size)
+        return np.flatnonzero(self.live_mask())
+
+    def __getstate__(self) -> dict:
+        # don't serialize the unused capacity
+        state = self.__dict__.copy()
+        state["ids"] = self.ids[: self._size]
+        state["vectors"] = {
+            k: v[: self._size] for k, v in self.vectors.items()
+        }
+        state["columns"] = {
+            k: v[: self._size] for k, v in self.columns.items()
+        }
+        state["deleted"] = self.deleted[: self._size]
+        state["_capacity"] = self._size
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        if "deleted" not in state:
+            # stores pickled before tombstones were introduced
+            state["deleted"] = np.zeros(state["_capacity"], dtype=bool)
+            state["num_deleted"] = 0
+        self.__dict__.update(state)
+
+    def _reserve(self, n: int) -> None:
+        """Make sure there is room for `n` more rows"""
+        if self._size + n <= self._capacity:
+            return
+        capacity = max(2 * self._capacity, self._size + n, 16)
+
+        def grow(arr: np.ndarray) -> np.ndarray:
+            ret = np.empty((capacity,) + arr.shape[1:], dtype=arr.dtype)
+            ret[: self._size] = arr[: self._size]
+            return ret
+
+        self.ids = grow(self.ids)
+        self.vectors = {k: grow(v) for k, v in self.vectors.items()}
+        self.columns = {k: grow(v) for k, v in self.columns.items()}
+        self.deleted = grow(self.deleted)
+        self._capacity = capacity
+
+    def append(self, records: list[Collection], ids: list[int]) -> None:
+        n = len(records)
+        if n == 0:
+            return
+        if self._size > 0 and min(ids) <= self.ids[self._size - 1]:
+            raise ValueError("Ids must be larger than the existing ids")
+        self._reserve(n)
+        start, end = self._size, self._size + n
+        for name, matrix in self.vectors.items():
+            vectors = [getattr(r, name) for r in records]
+            if any(v is None for v in vectors):
+                raise ValueError(f"Vector field {name} must be set")
+            matrix[start:end] = np.stack(
+                [v.array if isinstance(v, Vector) else v for v in vectors]
+            )
+        for name, column in self.columns.items():
+            values = [getattr(r, name) for r in records]
+            if column.dtype != object:
+                if _values_fit_column(np.array(values), column):
+                    column[start:end] = values
+                    continue
+                # fall back to storing python objects
+                column = column.astype(object)
+                self.columns[name] = column
+            for i, value in enumerate(values):
+                column[start + i] = value
+        self.ids[start:end] = ids
+        self.deleted[start:end] = False
+        self._size = end
+        for name, index in self.metadata_indexes.items():
+            index.add(self.columns[name][start:end].tolist(), list(ids))
+
+    def mark_deleted(self, rows: np.ndarray) -> None:
+        """Set tombstones on the given rows and remove them from the metadata
+        indexes, without moving any rows"""
+        rows = np.unique(np.asarray(rows, dtype=np.int64))
+        rows = rows[~self.deleted[rows]]
+        for name, index in self.metadata_indexes.items():
+            index.remove(
+                self.columns[name][rows].tolist(), self.ids[rows].tolist()
+            )
+        self.deleted[rows] = True
+        self.num_deleted += len(rows)
+
+    def compact(self) -> None:
+        """Remove the rows marked as deleted. This changes the row positions
+        of the remaining rows."""
+        if self.num_deleted > 0:
+            self.delete_rows(np.flatnonzero(self.deleted[: self._size]))
+
+    def delete_rows(self, rows: np.ndarray) -> None:
+        """Remove the given rows right away"""
+        rows = np.asarray(rows, dtype=np.int64)
+        live = rows[~self.deleted[rows]]
+        for name, index in self.metadata_indexes.items():
+            index.remove(
+                self.columns[name][live].tolist(), self.ids[live].tolist()
+            )
+        keep = np.ones(self._size, dtype=bool)
+        keep[rows] = False
+        n = int(keep.sum())
+
+        # compact into new arrays rather than in place since the arrays may be
+        # read-only memory maps
+        def compact(arr: np.ndarray) -> np.ndarray:
+            ret = np.empty((self._capacity,) + arr.shape[1:], dtype=arr.dtype)
+            ret[:n] = arr[: self._size][keep]
+            return ret
+
+        self.ids = compact(self.ids)
+        self.vectors = {k: compact(v) for k, v in self.vectors.items()}
+        self.columns = {k: compact(v) for k, v in self.columns.items()}
+        self.deleted = compact(self.deleted)
+        self.num_deleted = int(self.deleted[:n].sum())
+        self._size = n
+
+    def column(self, name: str) -> np.ndarray:
+        """Returns the values of the metadata field `name` (or the record ids if
+        `name` is "id") for all rows"""
+        if name == "id":
+            return self.ids[: self._size]
+        if name not in self.columns:
+            raise ValueError(
+                f"Collection {self.collection_class.__name__} has no "
+                f"metadata field {name}"
+            )
+        return self.columns[name][: self._size]
+
+    def rows_for_ids(self, ids: np.ndarray) -> np.ndarray:
+        """Returns the sorted row positions of the given (existing) ids"""
+        return np.searchsorted(self.column("id"), np.sort(ids))
+
+    def find_rows(self, ids: np.ndarray | list) -> np.ndarray:
+        """Returns the row positions of the given ids, in the same order,
+        skipping ids that are not in the store. Since the ids are sorted,
+        this is a binary search per id rather than a scan of the store.
+        Deleted rows are skipped as well, and so are ids that are not
+        integers (rather than converting e.g. "1", True or 1.9 to one)."""
+        if isinstance(ids, np.ndarray) and np.issubdtype(
+            ids.dtype, np.integer
+        ):
+            ids = ids.astype(np.int64, copy=False).reshape(-1)
+        else:
+            bounds = np.iinfo(np.int64)
+            ids = np.array(
+                [
+                    i
+                    for i in np.asarray(ids, dtype=object).reshape(-1)
+                    if isinstance(i, (int, np.integer))
+                    and not isinstance(i, bool)
+                    and bounds.min <= i <= bounds.max
+                ],
+                dtype=np.int64,
+            )
+        rows = self.lookup_rows(ids)
+        return rows[rows >= 0]
+
+    def lookup_rows(self, ids: np.ndarray) -> np.ndarray:
+        """Returns the row positions of the given int64 ids, in the same
+        order, with -1 for ids that are not in the store or deleted"""
+        stored = self.column("id")
+        rows = np.searchsorted(stored, ids)
+        found = rows < len(stored)
+        found[found] = stored[rows[found]] == ids[found]
+        found[found] = ~self.deleted[rows[found]]
+        return np.where(found, rows, -1)
+
+    def create_metadata_index(
+        self, field: str, kind: Literal["hash", "sorted"]
+    ) -> None:
+        if kind not in _METADATA_INDEX_KINDS:
+            raise ValueError(f"Unknown metadata index kind {kind}")
+        index = _METADATA_INDEX_KINDS[kind]()
+        live = self.live_mask()
+        index.add(
+            self.column(field)[live].tolist(),
+            self.column("id")[live].tolist(),
+        )
+        self.metadata_indexes[field] = index
+
+    def save(self, directory: Path) -> dict:
+        """Writes the store into `directory`: the ids, vector matrices and
+        typed metadata columns as `.npy` files and the columns holding python
+        objects as a single pickle.
+
+        Returns
+        -------
+        dict
+            information needed by `load`
+        """
+        directory.mkdir(parents=True)
+        np.save(directory / "ids.npy", self.column("id"))
+        for name in self.vectors:
+            np.save(directory / f"vector.{name}.npy", self.vector_matrix(name))
+        object_columns = {}
+        for name, column in self.columns.items():
+            if column.dtype == object:
+                object_columns[name] = column[: self._size]
+            else:
+                np.save(directory / f"column.{name}.npy", self.column(name))
+        with open(directory / "object_columns.pkl", "wb") as f:
+            pickle.dump(object_columns, f)
+        if self.num_deleted > 0:
+            np.save(directory / "deleted.npy", self.deleted[: self._size])
+        return {
+            "num_records": self._size,
+            "object_columns": list(object_columns),
+            "metadata_indexes": {
+                name: next(
+                    kind
+                    for kind, cls in _METADATA_INDEX_KINDS.items()
+                    if isinstance(index, cls)
+                )
+                for name, index in self.metadata_indexes.items()
+            },
+        }
+
+    @classmethod
+    def load(
+        cls,
+        directory: Path,
+        collection_class: Type[Collection],
+        info: dict,
+        mmap_mode: Literal["r", "c"] | None = "r",
+    ) -> "ColumnStore":
+        """Loads a store written by `save`. With `mmap_mode` set, the `.npy`
+        files are memory mapped so that loading is instant and the pages are
+        shared between processes. Since the memory maps are read-only, they
+        get copied into memory on the first write to the store."""
+        store = cls(collection_class, capacity=0)
+        store._size = store._capacity = info["num_records"]
+        store.ids = np.load(directory / "ids.npy", mmap_mode=mmap_mode)
+        store.vectors = {
+            name: np.load(
+                directory / f"vector.{name}.npy", mmap_mode=mmap_mode
+            )
+            for name in store.vectors
+        }
+        with open(directory / "object_columns.pkl", "rb") as f:
+            object_columns = pickle.load(f)
+        store.columns = {
+            name: (
+                object_columns[name]
+                if name in object_columns
+                else np.load(
+                    directory / f"column.{name}.npy", mmap_mode=mmap_mode
+                )
+            )
+            for name in store.columns
+        }
+        # the tombstones are small and get written to, so they are always
+        # read into memory
+        if (directory / "deleted.npy").exists():
+            store.deleted = np.load(directory / "deleted.npy")
+        else:
+            store.deleted = np.zeros(store._size, dtype=bool)
+        store.num_deleted = int(store.deleted.sum())
+        for name, kind in info["metadata_indexes"].items():
+            store.create_metadata_index(name, kind)
+        return store
+
+    def vector_matrix(self, name: str) -> np.ndarray:
+        """Returns the (num_rows, dim) matrix holding vector field `name`"""
+        return self.vectors[name][: self._size]
+
+    def materialize(self, rows: np.ndarray | list[int]) -> list[Collection]:
+        """Create `Collection` objects for the given row positions"""
+        rows = np.asarray(rows, dtype=np.int64)
+        field_values = {
+            name: column[rows].tolist()
+            for name, column in self.columns.items()
+        }
+        field_values.update(
+            {
+                name: [Vector(v) for v in matrix[rows]]
+                for name, matrix in self.vectors.items()
+            }
+        )
+        ret = []
+        for i, id_ in enumerate(self.ids[rows].tolist()):
+            record = self.collection_class(
+                **{name: values[i] for name, values in field_values.items()}
+            )
+            record.id = id_
+            ret.append(record)
+        return ret
+
+
+class LocalBackend(ABC):
+    """Nearest neighbor index over vectors identified by integer ids.
+    `LocalEngine` uses the record ids, so an index stays valid when
+    records are deleted or the store is compacted.
+
+    Backends with `_SUPPORTS_UPDATES` implement `add` and `remove`, which
+    change a built index in place. The others can only be rebuilt, which
+    `LocalEngine` does in the background (searching the records inserted
+    in the meantime exactly).
+    """
+
+    # whether `query` does an exhaustive search over all of the data
+    _IS_BRUTE_FORCE = False
+    # whether `add` and `remove` are implemented
+    _SUPPORTS_UPDATES = False
+
+    @abstractmethod
+    def create_index(
+        self, data: np.ndarray, metric: Metric, ids: np.ndarray | None = None
+    ) -> None:
+        """Build the index over the rows of `data`, which are identified by
+        `ids` (the row positions if not given)"""
+
+    @abstractmethod
+    def query(self, q: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """The ids of the (up to) `k` nearest neighbors of `q` and their
+        distances, closest first. Distances are euclidean distances or, for
+        `Metric.COSINE`, one minus the cosine similarity."""
+
+    def query_batch(
+        self, Q: np.ndarray, k: int
+    ) -> list[tuple[np.ndarray, np.ndarray]]:
+        """Nearest neighbors for every row of `Q`. Backends whose library
+        can search multiple vectors in one call should override this."""
+        return [self.query(q, k) for q in Q]
+
+    def add(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        """Add `vectors`, identified by `ids`, to the built index"""
+        raise NotImplementedError(
+            f"{type(self).__name__} does not support adding vectors, the "
+            "index has to be rebuilt"
+        )
+
+    def remove(self, ids: np.ndarray) -> None:
+        """Remove the vectors with the given ids from the built index. Ids
+        that are not in the index are ignored."""
+        raise NotImplementedError(
+            f"{type(self).__name__} does not support removing vectors, the "
+            "index has to be rebuilt"
+        )
+
+    def save(self, path: Path) -> None:
+        """Save the built index into the (existing, empty) directory `path`.
+        By default the attributes of the backend are pickled, backends whose
+        library has its own serialization format should override this."""
+        with open(path / "backend.pkl", "wb") as f:
+            pickle.dump(self.__dict__, f)
+
+    def load(self, path: Path, mmap_mode: str | None = "r") -> None:
+        """Load an index that was saved with `save` into this backend.
+        `mmap_mode` is passed to `np.load` by backends that save arrays
+        they can search memory mapped."""
+        with open(path / "backend.pkl", "rb") as f:
+            self.__dict__.update(pickle.load(f))
+
+
+def _index_ids(ids: np.ndarray | None, n: int) -> np.ndarray:
+    """The ids passed to `LocalBackend.create_index`, defaulting to the row
+    positions"""
+    if ids is None:
+        return np.arange(n, dtype=np.int64)
+    return np.asarray(ids, dtype=np.int64)
+
+
+def _unit_sq_distances_to_cosine(sq_distances: np.ndarray) -> np.ndarray:
+    """Cosine distances from the squared euclidean distances between
+    normalized vectors, since ||a - b||^2 = 2 - 2 cos(a, b)"""
+    return sq_distances / 2
+
+
+def top_k_smallest(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the `k` smallest entries along the last axis of `scores`,
+    sorted by score. Uses `np.argpartition` so that only the `k` selected
+    entries need to be sorted."""
+    n = scores.shape[-1]
+    if k >= n:
+        return np.argsort(scores, axis=-1)
+    idxs = np.argpartition(scores, k - 1, axis=-1)[..., :k]
+    order = np.argsort(np.take_along_axis(scores, idxs, axis=-1), axis=-1)
+    return np.take_along_axis(idxs, order, axis=-1)
+
+
+_thread_pools: dict[int, ThreadPoolExecutor] = {}
+_thread_pools_lock = threading.Lock()
+
+
+def _get_thread_pool(n_threads: int) -> ThreadPoolExecutor:
+    """Thread pools are shared by all backends (and created lazily) so that
+    creating backends doesn't leak threads"""
+    with _thread_pools_lock:
+        if n_threads not in _thread_pools:
+            _thread_pools[n_threads] = ThreadPoolExecutor(n_threads)
+        return _thread_pools[n_threads]
+
 
-    # @abstractmethod
-    # def load(self, fp):
-    #     pass
+def chunked_top_k(
+    scores: Callable[[int, int], np.ndarray],
+    n: int,
+    k: int,
+    chunk_size: int,
+    n_threads: int = 1,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Indices of the `k` smallest scores (per query) out of `n`, and those
+    scores, where `scores(start, end)` returns the (num_queries, end -
+    start) scores of rows `start:end`. The scores are computed `chunk_size`
+    rows at a time (using `n_threads` threads) so that memory use stays
+    proportional to `chunk_size` rather than to `n`."""
+    if n <= chunk_size:
+        all_scores = scores(0, n)
+        idxs = top_k_smallest(all_scores, k)
+        return idxs, np.take_along_axis(all_scores, idxs, axis=-1)
+
+    def search_chunk(start: int) -> tuple[np.ndarray, np.ndarray]:
+        chunk_scores = scores(start, min(start + chunk_size, n))
+        idxs = top_k_smallest(chunk_scores, k)
+        return np.take_along_axis(chunk_scores, idxs, axis=-1), idxs + start
+
+    starts = range(0, n, chunk_size)
+    if n_threads > 1:
+        executor = _get_thread_pool(n_threads)
+        results = list(executor.map(search_chunk, starts))
+    else:
+        results = [search_chunk(start) for start in starts]
+    # merge the top-k of every chunk
+    all_scores = np.concatenate([r[0] for r in results], axis=-1)
+    idxs = np.concatenate([r[1] for r in results], axis=-1)
+    top = top_k_smallest(all_scores, k)
+    return (
+        np.take_along_axis(idxs, top, axis=-1),
+        np.take_along_axis(all_scores, top, axis=-1),
+    )
 
 
 class NumPyBackend(LocalBackend):
-    def create_index(self, data: np.ndarray, metric: Metric) -> None:
+
+    _IS_BRUTE_FORCE = True
+
+    def __init__(self, chunk_size: int = 16384, n_threads: int | None = None):
+        """
+        Parameters
+        ----------
+        chunk_size
+            number of indexed vectors to score at a time. the data is searched
+            in chunks of this size so that memory use stays proportional to
+            `chunk_size` rather than to the number of indexed vectors
+        n_threads
+            number of threads to search chunks with. defaults to the number of
+            CPUs (numpy releases the GIL in the matrix products)
+        """
+        self.chunk_size = chunk_size
+        self.n_threads = n_threads or os.cpu_count() or 1
+
+    def create_index(
+        self, data: np.ndarray, metric: Metric, ids: np.ndarray | None = None
+    ) -> None:
         self.metric = metric
         self._index = data
+        self._ids = _index_ids(ids, len(data))
+        # float16 data is kept as is (halving the memory used) but scored in
+        # float32, for which there are fast matrix products (and which
+        # doesn't overflow when squaring)
+        self._dtype = np.promote_types(data.dtype, np.float32)
+        sq_norms = np.einsum("ij,ij->i", data, data, dtype=self._dtype)
+        if metric == Metric.COSINE:
+            norms = np.sqrt(sq_norms)
+            self._inv_norms = 1 / np.where(norms == 0, 1, norms)
+        else:
+            self._sq_norms = sq_norms
 
-    def query(self, q: np.ndarray, k: int) -> list[int]:
+    def _scores(self, Q: np.ndarray, start: int, end: int) -> np.ndarray:
+        """Scores (lower is closer) of the indexed vectors in rows
+        `start:end` for each query vector in `Q`. Only needs a single
+        matrix product with the data."""
+        data = self._index[start:end].astype(self._dtype, copy=False)
+        products = Q @ data.T
         if self.metric == Metric.COSINE:
-            return np.argsort(
-                -np.dot(self._index, q)
-                / (
-                    np.linalg.norm(
-                        self._index, axis=1
-                    )  # * np.linalg.norm(q) don't need to divide by this if not returning distances
-                )
-            )[:k].tolist()
-        return np.linalg.norm(self._index - q, axis=1).argsort()[:k].tolist()
+            # no need to divide by the query norm since it doesn't change
+            # the ranking
+            return -products * self._inv_norms[start:end]
+        # ||x - q||^2 = ||x||^2 - 2x.q + ||q||^2, and ||q||^2 doesn't change
+        # the ranking
+        return self._sq_norms[start:end] - 2 * products
+
+    def _search(self, Q: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        # avoid upcasting the whole index if the query is float64
+        Q = Q.astype(self._dtype, copy=False)
+        idxs, scores = chunked_top_k(
+            lambda start, end: self._scores(Q, start, end),
+            len(self._index),
+            k,
+            self.chunk_size,
+            self.n_threads,
+        )
+        # turn the scores of the neighbors into distances by adding back
+        # what only depends on the query
+        if self.metric == Metric.COSINE:
+            q_norms = np.linalg.norm(Q, axis=1, keepdims=True)
+            distances = 1 + scores / np.where(q_norms == 0, 1, q_norms)
+        else:
+            sq_q_norms = np.einsum("ij,ij->i", Q, Q)[:, None]
+            distances = np.sqrt(np.maximum(scores + sq_q_norms, 0))
+        return self._ids[idxs], distances
+
+    def query(self, q: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        ids, distances = self._search(q.reshape(1, -1), k)
+        return ids[0], distances[0]
+
+    def query_batch(
+        self, Q: np.ndarray, k: int
+    ) -> list[tuple[np.ndarray, np.ndarray]]:
+        return list(zip(*self._search(Q, k)))
+
+    def save(self, path: Path) -> None:
+        # the vectors are saved as they are rather than pickled so that
+        # `load` can memory map them
+        state = {k: v for k, v in self.__dict__.items() if k != "_index"}
+        with open(path / "backend.pkl", "wb") as f:
+            pickle.dump(state, f)
+        np.save(path / "vectors.npy", self._index)
+
+    def load(self, path: Path, mmap_mode: str | None = "r") -> None:
+        super().load(path, mmap_mode)
+        # the vectors are only read a chunk at a time when searching so
+        # memory mapping them keeps them out of memory
+        self._index = np.load(path / "vectors.npy", mmap_mode=mmap_mode)
 
 
 class KDTreeBackend(LocalBackend):
     def __init__(self, **kwargs):
         self.kwargs = kwargs
 
-    def create_index(self, data: np.ndarray, metric: Metric) -> None:
+    def create_index(
+        self, data: np.ndarray, metric: Metric, ids: np.ndarray | None = None
+    ) -> None:
         try:
             from sklearn.neighbors import KDTree
         except ModuleNotFoundError:
@@ -98,39 +845,83 @@ class KDTreeBackend(LocalBackend):
                 "KDTree backend requires scikit-learn to be installed"
             )
         self._metric = metric
+        # sklearn computes in float64 anyway
+        data = data.astype(np.float64, copy=False)
         if metric == Metric.COSINE:
             data = data / np.linalg.norm(data, axis=1).reshape(-1, 1)
 
         self.tree = KDTree(data, **self.kwargs)
+        self._ids = _index_ids(ids, len(data))
 
-    def query(self, q: np.ndarray, k: int) -> list[int]:
+    def query(self, q: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
         # q should be shape (N,)
         assert len(q.shape) == 1
-        q = q.reshape(1, -1)
+        return self.query_batch(q.reshape(1, -1), k)[0]
 
+    def query_batch(
+        self, Q: np.ndarray, k: int
+    ) -> list[tuple[np.ndarray, np.ndarray]]:
         if self._metric == Metric.COSINE:
-            q = q / np.linalg.norm(q)
-        return self.tree.query(q, k)[1][0].tolist()
+            Q = Q / np.linalg.norm(Q, axis=1).reshape(-1, 1)
+        distances, idxs = self.tree.query(Q, min(k, len(self._ids)))
+        if self._metric == Metric.COSINE:
+            distances = _unit_sq_distances_to_cosine(distances**2)
+        return list(zip(self._ids[idxs], distances))
 
 
 class PyNNDescentBackend(LocalBackend):
     def __init__(self, **kwargs):
         self.kwargs = kwargs
 
-    def create_index(self, data: np.ndarray, metric: Metric) -> None:
+    def create_index(
+        self, data: np.ndarray, metric: Metric, ids: np.ndarray | None = None
+    ) -> None:
         try:
             from pynndescent import NNDescent
         except ModuleNotFoundError:
             raise RuntimeError(
                 "PyNNDescentBackend backend requires pynndescent to be installed"
             )
+        # pynndescent does not support float16
+        data = data.astype(
+            np.promote_types(data.dtype, np.float32), copy=False
+        )
         self.index = NNDescent(data, metric=metric.value, **self.kwargs)
+        self._ids = _index_ids(ids, len(data))
 
-    def query(self, q: np.ndarray, k: int) -> list[int]:
-        if len(q.shape) == 1:
-            q = q.reshape(1, -1)
-        idxs, _ = self.index.query(q, k)
-        return idxs[0].tolist()
+    def query(self, q: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        return self.query_batch(q.reshape(1, -1), k)[0]
+
+    def query_batch(
+        self, Q: np.ndarray, k: int
+    ) -> list[tuple[np.ndarray, np.ndarray]]:
+        # pynndescent returns euclidean and cosine distances already
+        idxs, distances = self.index.query(Q, k)
+        # and pads with -1 if it finds fewer neighbors
+        return [
+            (self._ids[i[i >= 0]], d[i >= 0]) for i, d in zip(idxs, distances)
+        ]
+
+
+def _import_annoy():
+    try:
+        import annoy
+    except ModuleNotFoundError:
+        raise RuntimeError(
+            "AnnoyBackend backend requires annoy to be installed"
+        )
+    return annoy
+
+
+def _import_faiss():
+    try:
+        import faiss
+    except ModuleNotFoundError:
+        raise RuntimeError(
+            "FAISSBackend backend requires FAISS to be installed. See "
+            "https://github.com/facebookresearch/faiss/blob/main/INSTALL.md for installation instructions."
+        )
+    return faiss
 
 
 class AnnoyBackend(LocalBackend):
@@ -138,22 +929,46 @@ class AnnoyBackend(LocalBackend):
         self.n_trees = n_trees
         self.n_jobs = n_jobs
 
-    def create_index(self, data: np.ndarray, metric: Metric) -> None:
-        try:
-            from annoy import AnnoyIndex
-        except ModuleNotFoundError:
-            raise RuntimeError(
-                "AnnoyBackend backend requires annoy to be installed"
-            )
+    def create_index(
+        self, data: np.ndarray, metric: Metric, ids: np.ndarray | None = None
+    ) -> None:
+        annoy = _import_annoy()
 
-        annoy_metric = "angular" if metric == Metric.COSINE else "euclidean"
-        self.index = AnnoyIndex(data.shape[1], metric=annoy_metric)
+        self.annoy_metric = (
+            "angular" if metric == Metric.COSINE else "euclidean"
+        )
+        self.index = annoy.AnnoyIndex(data.shape[1], metric=self.annoy_metric)
         for i, v in enumerate(data):
             self.index.add_item(i, v)
         self.index.build(self.n_trees, self.n_jobs)
+        self._ids = _index_ids(ids, len(data))
+
+    def query(self, q: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        idxs, distances = self.index.get_nns_by_vector(
+            q, k, include_distances=True
+        )
+        distances = np.array(distances)
+        if self.annoy_metric == "angular":
+            # annoy's angular distance is the euclidean distance of the
+            # normalized vectors
+            distances = _unit_sq_distances_to_cosine(distances**2)
+        return self._ids[idxs], distances
 
-    def query(self, q: np.ndarray, k: int) -> list[int]:
-        return self.index.get_nns_by_vector(q, k)
+    def save(self, path: Path) -> None:
+        self.index.save(str(path / "index.ann"))
+        np.save(path / "ids.npy", self._ids)
+        with open(path / "params.json", "w") as f:
+            json.dump({"dim": self.index.f, "metric": self.annoy_metric}, f)
+
+    def load(self, path: Path, mmap_mode: str | None = "r") -> None:
+        annoy = _import_annoy()
+        with open(path / "params.json") as f:
+            params = json.load(f)
+        self.annoy_metric = params["metric"]
+        self.index = annoy.AnnoyIndex(params["dim"], metric=self.annoy_metric)
+        # this memory maps the file so it's fast even for large indexes
+        self.index.load(str(path / "index.ann"))
+        self._ids = np.load(path / "ids.npy", mmap_mode=mmap_mode)
 
 
 class FAISSBackend(LocalBackend):
@@ -167,65 +982,1359 @@ class FAISSBackend(LocalBackend):
         """
         self.index_factory_str = index_factory_str
 
-    def create_index(self, data: np.ndarray, metric: Metric) -> None:
-        try:
-            import faiss
-        except ModuleNotFoundError:
-            raise RuntimeError(
-                "FAISSBackend backend requires FAISS to be installed. See "
-                "https://github.com/facebookresearch/faiss/blob/main/INSTALL.md for installation instructions."
-            )
+    def create_index(
+        self, data: np.ndarray, metric: Metric, ids: np.ndarray | None = None
+    ) -> None:
+        faiss = _import_faiss()
         self.metric = metric
+        # FAISS only works with float32
+        data = data.astype(np.float32, copy=False)
         if metric == Metric.COSINE:
             data = data / np.linalg.norm(data, axis=1).reshape(-1, 1)
         self.index = faiss.index_factory(data.shape[1], self.index_factory_str)
         self.index.add(data)
+        self._ids = _index_ids(ids, len(data))
+
+    def query(self, q: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        return self.query_batch(q.reshape(1, -1), k)[0]
+
+    def query_batch(
+        self, Q: np.ndarray, k: int
+    ) -> list[tuple[np.ndarray, np.ndarray]]:
+        if self.metric == Metric.COSINE:
+            Q = Q / np.linalg.norm(Q, axis=1).reshape(-1, 1)
+        # FAISS returns squared euclidean distances
+        sq_distances, idxs = self.index.search(Q, k)
+        if self.metric == Metric.COSINE:
+            distances = _unit_sq_distances_to_cosine(sq_distances)
+        else:
+            distances = np.sqrt(np.maximum(sq_distances, 0))
+        # FAISS pads with -1 if it finds fewer neighbors
+        return [
+            (self._ids[i[i >= 0]], d[i >= 0]) for i, d in zip(idxs, distances)
+        ]
+
+    def save(self, path: Path) -> None:
+        _import_faiss().write_index(self.index, str(path / "index.faiss"))
+        np.save(path / "ids.npy", self._ids)
+        with open(path / "params.json", "w") as f:
+            json.dump({"metric": Metric(self.metric).value}, f)
+
+    def load(self, path: Path, mmap_mode: str | None = "r") -> None:
+        self.index = _import_faiss().read_index(str(path / "index.faiss"))
+        self._ids = np.load(path / "ids.npy", mmap_mode=mmap_mode)
+        with open(path / "params.json") as f:
+            self.metric = Metric(json.load(f)["metric"])
+
+
+def _nearest_centroids(
+    X: np.ndarray, centroids: np.ndarray, chunk_size: int = 16384
+) -> np.ndarray:
+    """Index of the closest (by euclidean distance) centroid for every row
+    of `X`"""
+    sq_norms = np.einsum("ij,ij->i", centroids, centroids)
+    ret = np.empty(len(X), dtype=np.int64)
+    for start in range(0, len(X), chunk_size):
+        # ||x - c||^2 = ||x||^2 - 2x.c + ||c||^2, and ||x||^2 doesn't change
+        # which centroid is closest
+        scores = X[start : start + chunk_size] @ centroids.T
+        scores *= -2
+        scores += sq_norms
+        ret[start : start + len(scores)] = np.argmin(scores, axis=1)
+    return ret
+
+
+def kmeans(
+    X: np.ndarray, k: int, n_iter: int = 10, seed: int | None = 0
+) -> np.ndarray:
+    """Lloyd's k-means clustering of the rows of `X`
+
+    Parameters
+    ----------
+    X
+        (n, dim) array of the points to cluster
+    k
+        number of clusters. if `X` has fewer rows, each row is a cluster
+    n_iter
+        number of iterations
+    seed
+        seed for picking the initial centroids (and for replacing the
+        centroids of clusters that become empty)
+
+    Returns
+    -------
+    np.ndarray
+        (min(k, n), dim) array of the centroids
+    """
+    rng = np.random.default_rng(seed)
+    X = X.astype(np.float32, copy=False)
+    k = min(k, len(X))
+    centroids = X[rng.choice(len(X), k, replace=False)].copy()
+    for _ in range(n_iter):
+        assignment = _nearest_centroids(X, centroids)
+        counts = np.bincount(assignment, minlength=k)
+        sums = np.stack(
+            [
+                np.bincount(assignment, weights=X[:, j], minlength=k)
+                for j in range(X.shape[1])
+            ],
+            axis=1,
+        )
+        nonempty = counts > 0
+        centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+        # restart empty clusters from random points
+        n_empty = k - int(nonempty.sum())
+        if n_empty > 0:
+            centroids[~nonempty] = X[rng.choice(len(X), n_empty)]
+    return centroids
 
-    def query(self, q: np.ndarray, k: int) -> list[int]:
-        q = q.reshape(1, -1)
+
+class _QuantizedBackend(LocalBackend):
+    """Base class for backends that keep a compressed code per vector and
+    scan all of the codes with approximate distances. The vectors are
+    encoded `chunk_size` at a time, so the full precision vectors are never
+    copied as a whole (which makes a difference if they are memory mapped,
+    see `LocalEngine.load_directory`)."""
+
+    def __init__(
+        self,
+        rerank_factor: int | None = None,
+        chunk_size: int = 16384,
+        n_threads: int | None = None,
+    ):
+        self.rerank_factor = rerank_factor
+        self.chunk_size = chunk_size
+        self.n_threads = n_threads or os.cpu_count() or 1
+
+    def _prepare(self, X: np.ndarray) -> np.ndarray:
+        """Vectors as they are quantized: float32 and, for cosine
+        similarity, normalized"""
+        X = np.atleast_2d(X).astype(np.float32, copy=False)
         if self.metric == Metric.COSINE:
-            q = q / np.linalg.norm(q)
-        _, idxs = self.index.search(q, k)
-        assert idxs.shape[0] == 1
-        return idxs[0].tolist()
+            norms = np.linalg.norm(X, axis=1, keepdims=True)
+            X = X / np.where(norms == 0, 1, norms)
+        return X
+
+    def _chunks(self, data: np.ndarray) -> Iterator[np.ndarray]:
+        for start in range(0, len(data), self.chunk_size):
+            yield self._prepare(data[start : start + self.chunk_size])
+
+    @abstractmethod
+    def _train(self, data: np.ndarray) -> None:
+        pass
+
+    @abstractmethod
+    def _encode(self, X: np.ndarray) -> np.ndarray:
+        """Codes of the (prepared) vectors `X`"""
+
+    @abstractmethod
+    def _reconstruction_sq_norms(self, codes: np.ndarray) -> np.ndarray:
+        """Squared norms of the vectors that `codes` decode to"""
+
+    @abstractmethod
+    def _query_tables(self, Q: np.ndarray) -> Any:
+        """Whatever `_scores` needs to know about the (prepared) queries"""
+
+    @abstractmethod
+    def _inner_products(self, tables: Any, start: int, end: int) -> Any:
+        """(num_queries, end - start) approximate inner products (or, for
+        `_DISTANCE_TABLES` and euclidean metric, squared distances) between
+        the queries and the rows `start:end`"""
+
+    # whether `_inner_products` returns squared distances for the euclidean
+    # metric
+    _DISTANCE_TABLES = False
+
+    def create_index(
+        self, data: np.ndarray, metric: Metric, ids: np.ndarray | None = None
+    ) -> None:
+        self.metric = metric
+        self._ids = _index_ids(ids, len(data))
+        self._train(data)
+        self._codes = np.concatenate(
+            [self._encode(X) for X in self._chunks(data)]
+        )
+        sq_norms = self._reconstruction_sq_norms(self._codes)
+        if metric == Metric.COSINE:
+            norms = np.sqrt(sq_norms)
+            self._inv_norms = 1 / np.where(norms == 0, 1, norms)
+        else:
+            self._sq_norms = sq_norms
+        # the full precision vectors are only kept (as a reference, not a
+        # copy) for re-ranking
+        self._data = data if self.rerank_factor else None
+
+    def _scores(self, tables: Any, start: int, end: int) -> np.ndarray:
+        """Approximate cosine distances minus one, or squared euclidean
+        distances (minus the squared norm of the query unless
+        `_DISTANCE_TABLES`)"""
+        products = self._inner_products(tables, start, end)
+        if self.metric == Metric.COSINE:
+            return -products * self._inv_norms[start:end]
+        if self._DISTANCE_TABLES:
+            return products
+        return self._sq_norms[start:end] - 2 * products
+
+    def _distances(self, Q: np.ndarray, scores: np.ndarray) -> np.ndarray:
+        """Turns the scores of `_scores` into distances"""
+        if self.metric == Metric.COSINE:
+            return 1 + scores
+        if not self._DISTANCE_TABLES:
+            scores = scores + np.einsum("ij,ij->i", Q, Q)[:, None]
+        return np.sqrt(np.maximum(scores, 0))
+
+    def _search(self, Q: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        Q = self._prepare(Q)
+        n = len(self._codes)
+        fetch_size = min(n, k * (self.rerank_factor or 1))
+        tables = self._query_tables(Q)
+        idxs, scores = chunked_top_k(
+            lambda start, end: self._scores(tables, start, end),
+            n,
+            fetch_size,
+            self.chunk_size,
+            self.n_threads,
+        )
+        if self._data is None:
+            return self._ids[idxs], self._distances(Q, scores)
+        # re-rank the candidates by their exact distances
+        k = min(k, n)
+        ret = np.empty((len(Q), k), dtype=np.int64)
+        distances = np.empty((len(Q), k), dtype=np.float32)
+        for i, (q, candidates) in enumerate(zip(Q, idxs)):
+            order = np.sort(candidates)
+            X = self._prepare(self._data[order])
+            if self.metric == Metric.COSINE:
+                exact = 1 - X @ q
+            else:
+                exact = np.sqrt(np.maximum(((X - q) ** 2).sum(axis=1), 0))
+            top = top_k_smallest(exact, k)
+            ret[i], distances[i] = order[top], exact[top]
+        return self._ids[ret], distances
+
+    def query(self, q: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        ids, distances = self._search(q.reshape(1, -1), k)
+        return ids[0], distances[0]
+
+    def query_batch(
+        self, Q: np.ndarray, k: int
+    ) -> list[tuple[np.ndarray, np.ndarray]]:
+        return list(zip(*self._search(Q, k)))
+
+    def save(self, path: Path) -> None:
+        state = {k: v for k, v in self.__dict__.items() if k != "_data"}
+        with open(path / "backend.pkl", "wb") as f:
+            pickle.dump(state, f)
+        if self._data is not None:
+            np.save(path / "vectors.npy", self._data)
+
+    def load(self, path: Path, mmap_mode: str | None = "r") -> None:
+        super().load(path, mmap_mode)
+        # the vectors are only read for re-ranking so memory mapping them
+        # keeps them out of memory
+        self._data = (
+            np.load(path / "vectors.npy", mmap_mode=mmap_mode)
+            if (path / "vectors.npy").exists()
+            else None
+        )
+
+
+class ScalarQuantizedBackend(_QuantizedBackend):
+    def __init__(
+        self,
+        rerank_factor: int | None = None,
+        chunk_size: int = 16384,
+        n_threads: int | None = None,
+    ):
+        """Exhaustive search over vectors quantized to 8 bits per component
+        (using the range of each component), i.e. 4 times less memory than
+        float32.
+
+        Parameters
+        ----------
+        rerank_factor
+            if given, `rerank_factor * k` candidates are found using the
+            quantized vectors and the `k` closest of them by exact distance
+            are returned. this improves recall but requires access to the
+            full precision vectors (which are saved with the index)
+        chunk_size
+            number of codes to score at a time
+        n_threads
+            number of threads to search chunks with. defaults to the number
+            of CPUs
+        """
+        super().__init__(rerank_factor, chunk_size, n_threads)
+
+    def _train(self, data: np.ndarray) -> None:
+        lo = np.full(data.shape[1], np.inf, dtype=np.float32)
+        hi = np.full(data.shape[1], -np.inf, dtype=np.float32)
+        for X in self._chunks(data):
+            lo, hi = np.minimum(lo, X.min(axis=0)), np.maximum(
+                hi, X.max(axis=0)
+            )
+        self._offset = lo
+        self._scale = (hi - lo) / 255
+        self._scale[self._scale == 0] = 1
+
+    def _encode(self, X: np.ndarray) -> np.ndarray:
+        codes = np.rint((X - self._offset) / self._scale)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def _decode(self, codes: np.ndarray) -> np.ndarray:
+        return self._offset + codes.astype(np.float32) * self._scale
+
+    def _reconstruction_sq_norms(self, codes: np.ndarray) -> np.ndarray:
+        ret = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), self.chunk_size):
+            X = self._decode(codes[start : start + self.chunk_size])
+            ret[start : start + len(X)] = np.einsum("ij,ij->i", X, X)
+        return ret
+
+    def _query_tables(self, Q: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # q . (offset + scale * code) = q . offset + (q * scale) . code
+        return Q * self._scale, Q @ self._offset
+
+    def _inner_products(
+        self, tables: tuple[np.ndarray, np.ndarray], start: int, end: int
+    ) -> np.ndarray:
+        scaled_Q, offsets = tables
+        codes = self._codes[start:end].astype(np.float32)
+        return scaled_Q @ codes.T + offsets[:, None]
+
+
+class ProductQuantizedBackend(_QuantizedBackend):
+    def __init__(
+        self,
+        n_subvectors: int | None = None,
+        n_bits: int = 8,
+        rerank_factor: int | None = None,
+        n_train: int = 65536,
+        n_iter: int = 10,
+        seed: int | None = 0,
+        chunk_size: int = 16384,
+        n_threads: int | None = None,
+    ):
+        """Exhaustive search over product quantized vectors: the vectors are
+        split into `n_subvectors` parts and each part is replaced by the
+        closest of `2 ** n_bits` centroids (trained with k-means), so every
+        vector takes up `n_subvectors` bytes. Queries are compared to the
+        centroids once and the distances to the vectors are looked up from
+        those tables (asymmetric distance computation).
+
+        Parameters
+        ----------
+        n_subvectors
+            number of parts to split the vectors into. more parts means
+            better recall but more memory. defaults to a part per 4
+            components
+        n_bits
+            the number of bits per code (at most 8)
+        rerank_factor
+            see `ScalarQuantizedBackend`
+        n_train
+            number of (randomly sampled) vectors to train the centroids on
+        n_iter
+            number of k-means iterations
+        seed
+            seed for sampling the training vectors and initializing k-means
+        chunk_size
+            number of codes to score at a time
+        n_threads
+            number of threads to search chunks with. defaults to the number
+            of CPUs
+        """
+        if not 1 <= n_bits <= 8:
+            raise ValueError("n_bits must be between 1 and 8")
+        super().__init__(rerank_factor, chunk_size, n_threads)
+        self.n_subvectors = n_subvectors
+        self.n_bits = n_bits
+        self.n_train = n_train
+        self.n_iter = n_iter
+        self.seed = seed
+
+    # the tables hold squared distances for the euclidean metric
+    _DISTANCE_TABLES = True
+
+    def _train(self, data: np.ndarray) -> None:
+        dim = data.shape[1]
+        n_subvectors = self.n_subvectors or max(1, dim // 4)
+        if n_subvectors > dim:
+            raise ValueError(
+                f"Cannot split vectors of dimension {dim} into "
+                f"{n_subvectors} subvectors"
+            )
+        # the boundaries of the parts of the vectors
+        self._bounds = np.linspace(0, dim, n_subvectors + 1).astype(int)
+        rng = np.random.default_rng(self.seed)
+        sample = np.sort(
+            rng.choice(len(data), min(self.n_train, len(data)), replace=False)
+        )
+        X = self._prepare(data[sample])
+        self._codebooks = [
+            kmeans(
+                X[:, start:end], 2**self.n_bits, self.n_iter, seed=self.seed
+            )
+            for start, end in zip(self._bounds[:-1], self._bounds[1:])
+        ]
+
+    def _encode(self, X: np.ndarray) -> np.ndarray:
+        return np.stack(
+            [
+                _nearest_centroids(X[:, start:end], codebook)
+                for start, end, codebook in zip(
+                    self._bounds[:-1], self._bounds[1:], self._codebooks
+                )
+            ],
+            axis=1,
+        ).astype(np.uint8)
+
+    def _reconstruction_sq_norms(self, codes: np.ndarray) -> np.ndarray:
+        # the parts are orthogonal so their squared norms add up
+        ret = np.zeros(len(codes), dtype=np.float32)
+        for j, codebook in enumerate(self._codebooks):
+            ret += np.einsum("ij,ij->i", codebook, codebook)[codes[:, j]]
+        return ret
+
+    def _query_tables(self, Q: np.ndarray) -> list[np.ndarray]:
+        """(num_queries, num_centroids) table per part, holding the inner
+        products with (or, for the euclidean metric, the squared distances
+        to) the centroids"""
+        tables = []
+        for start, end, codebook in zip(
+            self._bounds[:-1], self._bounds[1:], self._codebooks
+        ):
+            products = Q[:, start:end] @ codebook.T
+            if self.metric == Metric.EUCLIDEAN:
+                products = (
+                    np.einsum("ij,ij->i", codebook, codebook)
+                    - 2 * products
+                    + np.einsum("ij,ij->i", Q[:, start:end], Q[:, start:end])[
+                        :, None
+                    ]
+                )
+            tables.append(products)
+        return tables
+
+    def _inner_products(
+        self, tables: list[np.ndarray], start: int, end: int
+    ) -> np.ndarray:
+        codes = self._codes[start:end]
+        ret = np.zeros((len(tables[0]), end - start), dtype=np.float32)
+        for j, table in enumerate(tables):
+            ret += table[:, codes[:, j]]
+        return ret
+
+
+class IVFBackend(LocalBackend):
+
+    _SUPPORTS_UPDATES = True
+
+    def __init__(
+        self,
+        n_lists: int | None = None,
+        nprobe: int = 8,
+        n_train: int = 65536,
+        n_iter: int = 10,
+        seed: int | None = 0,
+    ):
+        """Inverted file index: the vectors are clustered with k-means and
+        each vector is put into the list of its closest centroid. A query
+        only scans the lists of the `nprobe` centroids closest to it (and
+        more lists if those hold fewer than `k` vectors). Only requires
+        numpy.
+
+        Vectors can be added with `add` after the index was built. They go
+        into the lists of their closest centroids without retraining, so if
+        the added data is distributed differently from the data the index
+        was built on, the lists become unbalanced and the index should be
+        rebuilt.
+
+        Parameters
+        ----------
+        n_lists
+            number of clusters. defaults to `4 * sqrt(n)` for `n` vectors
+        nprobe
+            number of lists to scan per query. more lists means better
+            recall but slower queries
+        n_train
+            number of (randomly sampled) vectors to train the centroids on
+        n_iter
+            number of k-means iterations
+        seed
+            seed for sampling the training vectors and initializing k-means
+        """
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self.n_train = n_train
+        self.n_iter = n_iter
+        self.seed = seed
+
+    def _prepare(self, X: np.ndarray) -> np.ndarray:
+        """Vectors as they are stored in the lists: float32 and, for cosine
+        similarity, normalized"""
+        X = np.atleast_2d(X).astype(np.float32, copy=False)
+        if self.metric == Metric.COSINE:
+            norms = np.linalg.norm(X, axis=1, keepdims=True)
+            X = X / np.where(norms == 0, 1, norms)
+        return X
+
+    def create_index(
+        self, data: np.ndarray, metric: Metric, ids: np.ndarray | None = None
+    ) -> None:
+        self.metric = metric
+        n, dim = data.shape
+        n_lists = self.n_lists or max(1, int(4 * math.sqrt(n)))
+        rng = np.random.default_rng(self.seed)
+        sample = np.sort(rng.choice(n, min(self.n_train, n), replace=False))
+        self._centroids = (
+            kmeans(
+                self._prepare(data[sample]), n_lists, self.n_iter, self.seed
+            )
+            if n > 0
+            else np.empty((0, dim), dtype=np.float32)
+        )
+        self._list_vectors = [
+            np.empty((0, dim), dtype=np.float32) for _ in self._centroids
+        ]
+        self._list_ids = [np.empty(0, dtype=np.int64) for _ in self._centroids]
+        # the list each id is in, so that `remove` only has to scan the
+        # lists holding the removed ids
+        self._list_of_id: dict[int, int] = {}
+        self.add(_index_ids(ids, n), data)
+
+    def add(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        """Add `vectors` to the lists of their closest centroids. `query`
+        returns `ids` for them."""
+        if len(vectors) == 0:
+            return
+        ids = np.asarray(ids, dtype=np.int64)
+        X = self._prepare(vectors)
+        assignment = _nearest_centroids(X, self._centroids)
+        order = np.argsort(assignment, kind="stable")
+        lists, starts = np.unique(assignment[order], return_index=True)
+        for i, rows in zip(lists, np.split(order, starts[1:])):
+            self._list_vectors[i] = np.concatenate(
+                [self._list_vectors[i], X[rows]]
+            )
+            self._list_ids[i] = np.concatenate([self._list_ids[i], ids[rows]])
+        self._list_of_id.update(zip(ids.tolist(), assignment.tolist()))
+
+    def remove(self, ids: np.ndarray) -> None:
+        removed_per_list = defaultdict(list)
+        for id_ in np.asarray(ids, dtype=np.int64).tolist():
+            i = self._list_of_id.pop(id_, None)
+            if i is not None:
+                removed_per_list[i].append(id_)
+        for i, removed in removed_per_list.items():
+            keep = ~np.isin(self._list_ids[i], removed)
+            self._list_vectors[i] = self._list_vectors[i][keep]
+            self._list_ids[i] = self._list_ids[i][keep]
+
+    def _probe(self, Q: np.ndarray, k: int) -> list[np.ndarray]:
+        """The lists to scan for each query: the `nprobe` ones with the
+        closest centroids, extended until they hold at least `k` vectors"""
+        sq_norms = np.einsum("ij,ij->i", self._centroids, self._centroids)
+        order = np.argsort(sq_norms - 2 * (Q @ self._centroids.T), axis=1)
+        sizes = np.array([len(ids) for ids in self._list_ids])
+        counts = np.cumsum(sizes[order], axis=1)
+        # number of lists needed to have `k` vectors (or all of them)
+        needed = np.minimum((counts < k).sum(axis=1) + 1, len(self._centroids))
+        return [
+            o[: max(self.nprobe, m)] for o, m in zip(order, needed.tolist())
+        ]
+
+    def _search(
+        self, Q: np.ndarray, k: int
+    ) -> list[tuple[np.ndarray, np.ndarray]]:
+        Q = self._prepare(Q)
+        empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+        if len(self._centroids) == 0:
+            return [empty for _ in Q]
+        probes = self._probe(Q, k)
+        # scan each probed list once for all of the queries probing it
+        queries_per_list = defaultdict(list)
+        for i, probe in enumerate(probes):
+            for j in probe.tolist():
+                queries_per_list[j].append(i)
+        scores: list[list[np.ndarray]] = [[] for _ in Q]
+        ids: list[list[np.ndarray]] = [[] for _ in Q]
+        for j, query_idxs in queries_per_list.items():
+            X = self._list_vectors[j]
+            if len(X) == 0:
+                continue
+            products = Q[query_idxs] @ X.T
+            if self.metric == Metric.COSINE:
+                list_scores = -products
+            else:
+                list_scores = np.einsum("ij,ij->i", X, X) - 2 * products
+            for i, s in zip(query_idxs, list_scores):
+                scores[i].append(s)
+                ids[i].append(self._list_ids[j])
+        ret = []
+        for q, s, i in zip(Q, scores, ids):
+            if len(s) == 0:
+                ret.append(empty)
+                continue
+            s, i = np.concatenate(s), np.concatenate(i)
+            top = top_k_smallest(s, k)
+            if self.metric == Metric.COSINE:
+                distances = 1 + s[top]
+            else:
+                distances = np.sqrt(np.maximum(s[top] + q @ q, 0))
+            ret.append((i[top], distances))
+        return ret
+
+    def query(self, q: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        return self._search(q.reshape(1, -1), k)[0]
+
+    def query_batch(
+        self, Q: np.ndarray, k: int
+    ) -> list[tuple[np.ndarray, np.ndarray]]:
+        return self._search(Q, k)
+
+
+class HNSWBackend(LocalBackend):
+
+    _SUPPORTS_UPDATES = True
+
+    def __init__(
+        self,
+        M: int = 16,
+        ef_construction: int = 100,
+        ef_search: int = 50,
+        seed: int | None = 0,
+    ):
+        """Hierarchical navigable small world graph (Malkov & Yashunin,
+        2016), implemented with numpy only. The distances from a vector to
+        all of the unvisited neighbors of a node are computed in a single
+        matrix-vector product.
+
+        Unlike the other backends, vectors can be added (`add`) and removed
+        (`remove`) after the index was built, without rebuilding it. Removed
+        vectors are only marked as deleted: they are never returned but stay
+        in the graph so that searches can still pass through them, and the
+        neighbors they link to are relinked to bypass them. Their memory is
+        only freed by rebuilding the index.
+
+        Parameters
+        ----------
+        M
+            number of links per node (twice as many on the bottom layer).
+            more links means better recall but more memory and slower
+            inserts
+        ef_construction
+            number of candidates considered when linking a new vector
+        ef_search
+            number of candidates considered when searching (at least `k`).
+            can be changed after the index was built
+        seed
+            seed for drawing the layers of the vectors
+        """
+        self.M = M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.seed = seed
+
+    def create_index(
+        self, data: np.ndarray, metric: Metric, ids: np.ndarray | None = None
+    ) -> None:
+        self.metric = metric
+        dim = data.shape[1]
+        self._rng = np.random.default_rng(self.seed)
+        self._vectors = np.empty((0, dim), dtype=np.float32)
+        self._sq_norms = np.empty(0, dtype=np.float32)
+        # the external id, layer and (per layer) links of each node
+        self._ids = np.empty(0, dtype=np.int64)
+        self._levels: list[int] = []
+        self._links: list[list[list[int]]] = []
+        self._deleted = np.empty(0, dtype=bool)
+        self._num_deleted = 0
+        # maps external id to node
+        self._nodes: dict[int, int] = {}
+        self._entry_point: int | None = None
+        self.add(_index_ids(ids, len(data)), data)
+
+    @property
+    def num_vectors(self) -> int:
+        """The number of vectors that were not removed"""
+        return len(self._nodes)
+
+    def _prepare(self, X: np.ndarray) -> np.ndarray:
+        X = np.atleast_2d(X).astype(np.float32, copy=False)
+        if self.metric == Metric.COSINE:
+            norms = np.linalg.norm(X, axis=1, keepdims=True)
+            X = X / np.where(norms == 0, 1, norms)
+        return X
+
+    def _distances(self, q: np.ndarray, nodes: list[int]) -> np.ndarray:
+        """Distances between the (prepared) vector `q` and `nodes`: squared
+        euclidean distances or, for cosine similarity, one minus the
+        cosine similarity"""
+        products = self._vectors[nodes] @ q
+        if self.metric == Metric.COSINE:
+            return 1 - products
+        return self._sq_norms[nodes] - 2 * products + q @ q
+
+    def _search_layer(
+        self,
+        q: np.ndarray,
+        entry_points: list[tuple[float, int]],
+        ef: int,
+        level: int,
+        skip_deleted: bool = False,
+    ) -> list[tuple[float, int]]:
+        """The (up to) `ef` nodes closest to `q` found by a best-first
+        search of layer `level`, as (distance, node) pairs sorted by
+        distance. With `skip_deleted`, deleted nodes are searched through
+        but not returned."""
+        visited = {node for _, node in entry_points}
+        candidates = list(entry_points)
+        heapq.heapify(candidates)
+        # max-heap (by negated distance) of the closest nodes found so far
+        results = [
+            (-d, node)
+            for d, node in entry_points
+            if not (skip_deleted and self._deleted[node])
+        ]
+        heapq.heapify(results)
+        while candidates:
+            dist, node = heapq.heappop(candidates)
+            if len(results) >= ef and dist > -results[0][0]:
+                break
+            neighbors = [
+                n for n in self._links[node][level] if n not in visited
+            ]
+            if not neighbors:
+                continue
+            visited.update(neighbors)
+            for d, n in zip(self._distances(q, neighbors).tolist(), neighbors):
+                if len(results) < ef or d < -results[0][0]:
+                    heapq.heappush(candidates, (d, n))
+                    if skip_deleted and self._deleted[n]:
+                        continue
+                    heapq.heappush(results, (-d, n))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+        return sorted((-d, node) for d, node in results)
+
+    def _select_neighbors(
+        self, candidates: list[tuple[float, int]], m: int
+    ) -> list[int]:
+        """Pick up to `m` of the (distance, node) `candidates`, sorted by
+        distance, with the heuristic of the HNSW paper: a candidate is only
+        picked if it is closer to the base vector than to any of the
+        candidates picked before it, which keeps links pointing in diverse
+        directions"""
+        if len(candidates) <= m:
+            return [node for _, node in candidates]
+        nodes = [node for _, node in candidates]
+        X = self._vectors[nodes]
+        # pairwise distances between the candidates
+        products = X @ X.T
+        if self.metric == Metric.COSINE:
+            pairwise = 1 - products
+        else:
+            sq_norms = self._sq_norms[nodes]
+            pairwise = sq_norms[:, None] + sq_norms[None, :] - 2 * products
+        selected: list[int] = []
+        # distance from each candidate to the closest selected one
+        closest = np.full(len(nodes), np.inf, dtype=pairwise.dtype)
+        for i, (dist, node) in enumerate(candidates):
+            if closest[i] > dist:
+                selected.append(node)
+                if len(selected) == m:
+                    break
+                np.minimum(closest, pairwise[i], out=closest)
+        return selected
+
+    def _max_links(self, level: int) -> int:
+        return 2 * self.M if level == 0 else self.M
+
+    def _set_links(self, node: int, level: int, candidates: list[int]) -> None:
+        """Link `node` to the best of `candidates` on layer `level`"""
+        candidates = [c for c in dict.fromkeys(candidates) if c != node]
+        dists = self._distances(self._vectors[node], candidates)
+        order = np.argsort(dists).tolist()
+        self._links[node][level] = self._select_neighbors(
+            [(dists[i], candidates[i]) for i in order],
+            self._max_links(level),
+        )
+
+    def _reserve(self, n: int) -> None:
+        size = len(self._levels)
+        if size + n <= len(self._vectors):
+            return
+        capacity = max(2 * len(self._vectors), size + n, 16)
+
+        def grow(arr: np.ndarray) -> np.ndarray:
+            ret = np.empty((capacity,) + arr.shape[1:], dtype=arr.dtype)
+            ret[:size] = arr[:size]
+            return ret
+
+        self._vectors = grow(self._vectors)
+        self._sq_norms = grow(self._sq_norms)
+        self._ids = grow(self._ids)
+        self._deleted = grow(self._deleted)
+
+    def add(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        """Insert `vectors` into the graph. `query` returns `ids` for them.
+        Adding an id that is in the index already replaces its vector."""
+        ids = np.asarray(ids, dtype=np.int64)
+        self.remove([i for i in ids.tolist() if i in self._nodes])
+        X = self._prepare(vectors)
+        self._reserve(len(X))
+        m_l = 1 / math.log(max(self.M, 2))
+        for id_, x in zip(ids.tolist(), X):
+            node = len(self._levels)
+            level = int(-math.log(1 - self._rng.random()) * m_l)
+            self._vectors[node] = x
+            self._sq_norms[node] = x @ x
+            self._ids[node] = id_
+            self._deleted[node] = False
+            self._levels.append(level)
+            self._links.append([[] for _ in range(level + 1)])
+            self._nodes[id_] = node
+            self._insert(node)
+
+    def _insert(self, node: int) -> None:
+        if len(self._nodes) == 1:
+            # the first node (or the only one that was not removed)
+            self._entry_point = node
+            return
+        q, level = self._vectors[node], self._levels[node]
+        entry_level = self._levels[self._entry_point]
+        entry_points = [
+            (self._distances(q, [self._entry_point])[0], self._entry_point)
+        ]
+        # greedy search down to the layer of the new node
+        for lc in range(entry_level, level, -1):
+            entry_points = self._search_layer(q, entry_points, 1, lc)
+        for lc in range(min(level, entry_level), -1, -1):
+            entry_points = self._search_layer(
+                q, entry_points, self.ef_construction, lc
+            )
+            # deleted nodes are searched through but not linked to
+            self._links[node][lc] = self._select_neighbors(
+                [(d, n) for d, n in entry_points if not self._deleted[n]],
+                self._max_links(lc),
+            )
+            for neighbor in self._links[node][lc]:
+                links = self._links[neighbor][lc]
+                links.append(node)
+                if len(links) > self._max_links(lc):
+                    self._set_links(neighbor, lc, links)
+        if level > entry_level:
+            self._entry_point = node
+
+    def remove(self, ids: list[int] | np.ndarray) -> None:
+        """Mark the vectors of `ids` as deleted and repair the links of
+        their neighbors. Ids that are not in the index are ignored."""
+        nodes = [
+            self._nodes.pop(i)
+            for i in np.asarray(ids, dtype=np.int64).reshape(-1).tolist()
+            if i in self._nodes
+        ]
+        self._deleted[nodes] = True
+        self._num_deleted += len(nodes)
+        for node in nodes:
+            for level, links in enumerate(self._links[node]):
+                for neighbor in links:
+                    neighbor_links = self._links[neighbor][level]
+                    if self._deleted[neighbor] or node not in neighbor_links:
+                        continue
+                    # link past the deleted node to its other neighbors
+                    self._set_links(
+                        neighbor,
+                        level,
+                        [n for n in neighbor_links if n != node]
+                        + [n for n in links if not self._deleted[n]],
+                    )
+
+    def query(self, q: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        if len(self._nodes) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        q = self._prepare(q)[0]
+        entry_points = [
+            (self._distances(q, [self._entry_point])[0], self._entry_point)
+        ]
+        for lc in range(self._levels[self._entry_point], 0, -1):
+            entry_points = self._search_layer(q, entry_points, 1, lc)
+        results = self._search_layer(
+            q, entry_points, max(self.ef_search, k), 0, skip_deleted=True
+        )[:k]
+        distances = np.array([d for d, _ in results], dtype=np.float32)
+        if self.metric == Metric.EUCLIDEAN:
+            distances = np.sqrt(np.maximum(distances, 0))
+        return self._ids[[node for _, node in results]], distances
+
+
+# version of the format written by `LocalEngine.save_directory`
+_DIRECTORY_FORMAT_VERSION = 1
+
+
+def _read_files(directory: Path) -> dict[str, bytes]:
+    return {p.name: p.read_bytes() for p in directory.iterdir()}
+
+
+def _write_files(directory: Path, files: dict[str, bytes]) -> None:
+    directory.mkdir()
+    for name, content in files.items():
+        (directory / name).write_bytes(content)
+
+
+def _records_from_lists(
+    records: dict[str, list[Collection]],
+) -> dict[str, ColumnStore]:
+    """Converts records stored as lists of `Collection` objects (which is how
+    older versions saved them) to `ColumnStore`s"""
+    ret = {}
+    for collection_name, recs in records.items():
+        if len(recs) == 0:
+            continue
+        store = ColumnStore(type(recs[0]))
+        store.append(recs, [r.id for r in recs])
+        ret[collection_name] = store
+    return ret
+
+
+@dataclass
+class _BuiltIndex:
+    backend: LocalBackend
+    # the largest record id in the index. records with larger ids were
+    # inserted after the index was built (by a backend that can't add
+    # vectors) and are not in it
+    max_id: int
+    # number of vectors in the index. for backends that can't remove
+    # vectors this includes the deleted records
+    size: int
+
+
+@dataclass
+class QueryPlan:
+    """Describes how `LocalEngine` executed a query.
+
+    `strategy` is one of:
+
+    - "scan": no similarity search, just (filtered) records in insertion order
+    - "index": similarity search using the index over the whole collection
+    - "post_filter": similarity search over the whole collection index,
+        fetching more neighbors than needed and dropping those that don't
+        match the filters
+    - "brute_force": exact similarity search over only the records that match
+        the filters
+
+    Records inserted after the index was built that are not in the index yet
+    (`num_unindexed` of them, see `LocalEngine`'s `rebuild_threshold`) are
+    searched exactly in addition to the index.
+    """
+
+    strategy: Literal["scan", "index", "post_filter", "brute_force"]
+    # number of records in the collection
+    num_records: int
+    # number of records that match the filters
+    num_candidates: int
+    # number of neighbors requested from the index in the last index query
+    fetch_size: int | None = None
+    num_index_queries: int = 0
+    # number of records that match the filters but are not in the index
+    num_unindexed: int = 0
 
 
 class LocalEngine(Engine):
     def __init__(
-        self, backend: LocalBackend | None = None
-    ) -> None:  # maybe add option to the init for ANN algo
-        self.records: dict[str, list[Collection]] = defaultdict(list)
+        self,
+        backend: LocalBackend | None = None,
+        brute_force_selectivity: float = 0.1,
+        overfetch_factor: int = 4,
+        compaction_threshold: float = 0.25,
+        rebuild_threshold: float = 0.1,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        backend
+            the nearest neighbor backend to use. defaults to `NumPyBackend`
+        brute_force_selectivity
+            filtered similarity queries for which at most this fraction of the
+            collection matches the filters are answered with an exact search
+            over the matching records instead of searching the index
+        overfetch_factor
+            when searching the index for a filtered query, this many times
+            more neighbors than requested are fetched (and the fetch size is
+            multiplied by this factor until enough neighbors pass the filters).
+            must be at least 2
+        compaction_threshold
+            deleted records are only marked as deleted (and skipped by
+            queries), so that deleting does not invalidate the indexes. once
+            more than this fraction of the records of a collection are marked
+            as deleted they get removed for real and the indexes of the
+            collection are rebuilt (unless the backend can remove vectors)
+        rebuild_threshold
+            records inserted into a collection are added to its indexes if
+            the backend supports it. otherwise the indexes are rebuilt in a
+            background thread once the number of records inserted since
+            they were built exceeds this fraction of their size. until the
+            rebuilt index is ready, queries search the new records exactly
+        """
+        if overfetch_factor < 2:
+            # the fetch size has to grow for post filtered queries to finish
+            raise ValueError("overfetch_factor must be at least 2")
+        # maps collection class name to the storage of its records
+        self.records: dict[str, ColumnStore] = {}
         self.build_collection_id_counter()
         self.backend = backend or NumPyBackend()
         # maps collection class name and then field name to metric
         self.collection_name_to_field_to_metric: dict[
             str, dict[str, Metric]
         ] = {}
+        # built indexes, keyed by collection class name and vector field name.
+        # `self.backend` is only used as a prototype that gets copied for
+        # each index so that building one index never clobbers another.
+        self._indexes: dict[tuple[str, str], _BuiltIndex] = {}
+        # indexes being rebuilt in the background, by the same key
+        self._rebuilds: dict[tuple[str, str], Future] = {}
+        self._rebuild_executor: ThreadPoolExecutor | None = None
+        self.brute_force_selectivity = brute_force_selectivity
+        self.overfetch_factor = overfetch_factor
+        self.compaction_threshold = compaction_threshold
+        self.rebuild_threshold = rebuild_threshold
+        # the plan of the most recently executed query
+        self.last_query_plan: QueryPlan | None = None
+
+    def _new_backend(self) -> LocalBackend:
+        return copy.deepcopy(self.backend)
+
+    def _invalidate_indexes(self, collection_name: str) -> None:
+        """Drop the indexes of a collection that can't remove vectors (and
+        their pending rebuilds). They get rebuilt lazily the next time a
+        similarity query hits them."""
+        for key in [k for k in self._indexes if k[0] == collection_name]:
+            if not self._indexes[key].backend._SUPPORTS_UPDATES:
+                del self._indexes[key]
+        for key in [k for k in self._rebuilds if k[0] == collection_name]:
+            del self._rebuilds[key]
+
+    def _index_builder(
+        self, collection_name: str, field_name: str
+    ) -> Callable[[], _BuiltIndex]:
+        """Returns a function building an index over the current records of
+        a collection. Inserts only write past the end of the store's arrays
+        (or into new arrays), so the function can run in another thread
+        while records are inserted."""
+        store = self.records[collection_name]
+        data = store.vector_matrix(field_name)
+        ids = store.column("id")
+        metric = self.collection_name_to_field_to_metric[collection_name][
+            field_name
+        ]
+        backend = self._new_backend()
+        deleted_ids = (
+            ids[store.deleted[: len(store)]]
+            if backend._SUPPORTS_UPDATES and store.num_deleted > 0
+            else None
+        )
+        tracer = self.tracer
+
+        def build() -> _BuiltIndex:
+            with tracer.span(
+                "create_index",
+                collection=collection_name,
+                field=field_name,
+                num_records=len(data),
+            ):
+                backend.create_index(data, metric, ids)
+            size = len(ids)
+            if deleted_ids is not None:
+                backend.remove(deleted_ids)
+                size -= len(deleted_ids)
+            return _BuiltIndex(
+                backend, int(ids[-1]) if len(ids) > 0 else 0, size
+            )
+
+        return build
+
+    def _start_rebuild(self, key: tuple[str, str]) -> None:
+        if key in self._rebuilds:
+            return
+        if self._rebuild_executor is None:
+            self._rebuild_executor = ThreadPoolExecutor(
+                1, thread_name_prefix="affine-index-rebuild"
+            )
+        self._rebuilds[key] = self._rebuild_executor.submit(
+            contextvars.copy_context().run, self._index_builder(*key)
+        )
+
+    def _maybe_start_rebuild(self, key: tuple[str, str]) -> None:
+        """Start rebuilding an index that can't add vectors if more than
+        `rebuild_threshold` of its size was inserted since it was built"""
+        index = self._indexes[key]
+        ids = self.records[key[0]].column("id")
+        num_unindexed = len(ids) - int(
+            np.searchsorted(ids, index.max_id, side="right")
+        )
+        if num_unindexed > self.rebuild_threshold * index.size:
+            self._start_rebuild(key)
+
+    def wait_for_rebuilds(self) -> None:
+        """Wait until the indexes that are being rebuilt in the background
+        are ready and start using them. This includes the rebuilds that
+        start because enough records were inserted during a rebuild."""
+        while self._rebuilds:
+            key, future = next(iter(self._rebuilds.items()))
+            future.result()
+            self._get_index(*key)
+
+    def _get_index(self, collection_name: str, field_name: str) -> _BuiltIndex:
+        """Get the index over the records of a collection for the given
+        vector field, building it if it does not exist yet and swapping in
+        the rebuilt index once a background rebuild finished."""
+        key = (collection_name, field_name)
+        rebuild = self._rebuilds.get(key)
+        if rebuild is not None and rebuild.done():
+            del self._rebuilds[key]
+            self._indexes[key] = rebuild.result()
+            # the records inserted while the index was rebuilt are not in it
+            self._maybe_start_rebuild(key)
+        if key not in self._indexes:
+            self._indexes[key] = self._index_builder(
+                collection_name, field_name
+            )()
+        return self._indexes[key]
+
+    def _update_indexes(self, collection_name: str, rows: np.ndarray) -> None:
+        """Add the inserted `rows` to the indexes of a collection or, for
+        backends that can't add vectors, start rebuilding the indexes once
+        enough records were inserted"""
+        store = self.records[collection_name]
+        ids = store.column("id")
+        for key, index in self._indexes.items():
+            if key[0] != collection_name:
+                continue
+            if index.backend._SUPPORTS_UPDATES:
+                index.backend.add(ids[rows], store.vector_matrix(key[1])[rows])
+                index.max_id = int(ids[rows[-1]])
+                index.size += len(rows)
+                continue
+            self._maybe_start_rebuild(key)
+
+    def _get_store(self, collection_class: Type[Collection]) -> ColumnStore:
+        collection_name = collection_class.__name__
+        if collection_name not in self.records:
+            self.records[collection_name] = ColumnStore(collection_class)
+        if collection_name not in self.collection_name_to_field_to_metric:
+            self.register_collection(collection_class)
+        return self.records[collection_name]
 
     def build_collection_id_counter(self):
         # maybe pickle this too on save?
         self.collection_id_counter: dict[str, int] = defaultdict(int)
-        for k, recs in self.records.items():
-            if len(recs) > 0:
-                self.collection_id_counter[k] = max([r.id for r in recs])
+        for k, store in self.records.items():
+            if len(store) > 0:
+                self.collection_id_counter[k] = int(store.column("id").max())
+
+    def _save_indexes(self, directory: Path) -> dict[str, dict]:
+        """Saves all built indexes into subdirectories of `directory`.
+
+        Returns
+        -------
+        dict[str, dict]
+            maps the name of the subdirectory of each index to information
+            about the index, used for validating it when loading
+        """
+        ret = {}
+        for (collection_name, field), index in self._indexes.items():
+            name = f"{collection_name}.{field}"
+            (directory / name).mkdir()
+            index.backend.save(directory / name)
+            ret[name] = {
+                "collection": collection_name,
+                "field": field,
+                "backend": type(index.backend).__name__,
+                "dim": self.records[collection_name].vectors[field].shape[1],
+                "metric": Metric(
+                    self.collection_name_to_field_to_metric[collection_name][
+                        field
+                    ]
+                ).value,
+                "max_id": index.max_id,
+                "size": index.size,
+            }
+        return ret
+
+    def _load_indexes(
+        self,
+        directory: Path,
+        indexes: dict[str, dict],
+        mmap_mode: str | None = None,
+    ) -> None:
+        """Loads indexes saved with `_save_indexes`. Indexes that were built
+        with a different type of backend than this engine's, or by a version
+        that identified vectors by row position rather than record id, are
+        skipped (and get rebuilt lazily)."""
+        self._indexes = {}
+        self._rebuilds = {}
+        backend_name = self.backend.__class__.__name__
+        for name, info in indexes.items():
+            if info["backend"] != backend_name or "max_id" not in info:
+                continue
+            collection_name, field = info["collection"], info["field"]
+            store = self.records.get(collection_name)
+            if store is None or field not in store.vectors:
+                raise ValueError(
+                    f"Saved index {name} does not match any vector field"
+                )
+            dim = store.vectors[field].shape[1]
+            metric = Metric(
+                self.collection_name_to_field_to_metric[collection_name][field]
+            )
+            if info["dim"] != dim or info["metric"] != metric.value:
+                raise ValueError(
+                    f"Saved index {name} has dimension {info['dim']} and "
+                    f"metric {info['metric']} but the collection field has "
+                    f"dimension {dim} and metric {metric.value}"
+                )
+            backend = self._new_backend()
+            backend.load(directory / name, mmap_mode)
+            self._indexes[(collection_name, field)] = _BuiltIndex(
+                backend, info["max_id"], info["size"]
+            )
+
+    def save_directory(self, path: str | Path) -> None:
+        """Save the engine into a new directory, in a format that can be memory
+        mapped by `load_directory`.
+
+        The directory contains a `manifest.json` (format version, collection
+        classes, id counters, metrics and index information), a subdirectory
+        per collection with the vectors, ids and metadata columns as `.npy`
+        files and a subdirectory per built index.
+
+        Parameters
+        ----------
+        path
+            the directory to create
+        """
+        path = Path(path)
+        path.mkdir(parents=True)
+        collections = {}
+        for collection_name, store in self.records.items():
+            info = store.save(path / "collections" / collection_name)
+            info["class"] = (
+                f"{store.collection_class.__module__}:"
+                f"{store.collection_class.__qualname__}"
+            )
+            info["id_counter"] = self.collection_id_counter[collection_name]
+            info["metrics"] = {
+                field: Metric(metric).value
+                for field, metric in self.collection_name_to_field_to_metric[
+                    collection_name
+                ].items()
+            }
+            collections[collection_name] = info
+        (path / "indexes").mkdir()
+        manifest = {
+            "format_version": _DIRECTORY_FORMAT_VERSION,
+            "collections": collections,
+            "indexes": self._save_indexes(path / "indexes"),
+        }
+        with open(path / "manifest.json", "w") as f:
+            json.dump(manifest, f, indent=2)
+
+    def load_directory(self, path: str | Path, mmap: bool = True) -> None:
+        """Load an engine saved with `save_directory`.
+
+        Parameters
+        ----------
+        path
+            the directory the engine was saved to
+        mmap
+            whether to memory map the vectors, ids and numeric metadata
+            columns instead of reading them into memory. this makes loading
+            instant and lets multiple processes share the same pages.
+        """
+        path = Path(path)
+        with open(path / "manifest.json") as f:
+            manifest = json.load(f)
+        if manifest["format_version"] != _DIRECTORY_FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported format version {manifest['format_version']}"
+            )
+
+        self.records = {}
+        self.collection_id_counter = defaultdict(int)
+        for collection_name, info in manifest["collections"].items():
+            module_name, qualname = info["class"].split(":")
+            collection_class = importlib.import_module(module_name)
+            for attr in qualname.split("."):
+                collection_class = getattr(collection_class, attr)
+            self.records[collection_name] = ColumnStore.load(
+                path / "collections" / collection_name,
+                collection_class,
+                info,
+                mmap_mode="r" if mmap else None,
+            )
+            self.collection_id_counter[collection_name] = info["id_counter"]
+            self.collection_name_to_field_to_metric[collection_name] = {
+                field: Metric(metric)
+                for field, metric in info["metrics"].items()
+            }
+        self._load_indexes(
+            path / "indexes",
+            manifest["indexes"],
+            mmap_mode="r" if mmap else None,
+        )
 
     def load(self, fp: str | Path | BinaryIO) -> None:
-        self.records: dict[str, list[Collection]] = defaultdict(list)
         if isinstance(fp, (str, Path)):
             with open(fp, "rb") as f:
-                self.records = pickle.load(f)
+                data = pickle.load(f)
         else:
-            self.records = pickle.load(fp)
+            data = pickle.load(fp)
+        if "records" not in data:
+            # files saved by older versions only contain the records
+            data = {"records": _records_from_lists(data), "indexes": {}}
+
+        self.records = data["records"]
+        for store in self.records.values():
+            self.register_collection(store.collection_class)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for name, index_files in data["indexes"].items():
+                _write_files(Path(tmpdir) / name, index_files["files"])
+            self._load_indexes(
+                Path(tmpdir),
+                {
+                    name: index_files["info"]
+                    for name, index_files in data["indexes"].items()
+                },
+            )
         self.build_collection_id_counter()
 
     def save(self, fp: str | Path | BinaryIO = None) -> None:
+        """Save the records and the built indexes of the engine.
+
+        Parameters
+        ----------
+        fp
+            path or file object to write to
+        """
         fp = fp or self.fp
+        with tempfile.TemporaryDirectory() as tmpdir:
+            indexes = self._save_indexes(Path(tmpdir))
+            data = {
+                "records": self.records,
+                "indexes": {
+                    name: {
+                        "info": info,
+                        "files": _read_files(Path(tmpdir) / name),
+                    }
+                    for name, info in indexes.items()
+                },
+            }
         if isinstance(fp, (str, Path)):
             with open(fp, "wb") as f:
-                pickle.dump(self.records, f)
+                pickle.dump(data, f)
         else:
             fp.seek(0)
-            pickle.dump(self.records, fp)  # don't close, handle it outside
+            pickle.dump(data, fp)  # don't close, handle it outside
 
     def _query(
         self,
@@ -233,31 +2342,371 @@ class LocalEngine(Engine):
         with_vectors: bool = True,
         similarity: Similarity | None = None,
         limit: int | None = None,
+        score_threshold: float | None = None,
     ) -> list[Collection]:
         if not with_vectors:
             warnings.warn("with_vectors=False has no effect in LocalEngine")
-        records = self.records[filter_set.collection]
-        records = apply_filters_to_records(filter_set.filters, records)
+        store = self.records.get(filter_set.collection)
+        if store is None:
+            return []
+        rows = self._filter(filter_set, store)
         if similarity is None:
-            if limit is None:
-                return records
-            return records[:limit]
-
-        data = build_data_matrix(similarity.field, records)
-        q = similarity.get_array()
-        metric = self.collection_name_to_field_to_metric[
-            filter_set.collection
-        ][similarity.field]
-        self.backend.create_index(data, metric)
-        neighbors = self.backend.query(q, limit)
-        return [records[i] for i in neighbors]
+            self.last_query_plan = QueryPlan(
+                strategy="scan",
+                num_records=store.num_live,
+                num_candidates=len(rows),
+            )
+            return self._materialize(filter_set, store, [rows[:limit]])[0]
+
+        if len(rows) == 0:
+            return []
+        limit = len(rows) if limit is None else min(limit, len(rows))
+        neighbors, self.last_query_plan = self._similarity_search(
+            store,
+            filter_set.collection,
+            rows,
+            similarity.field,
+            similarity.get_array().reshape(1, -1),
+            limit,
+        )
+        return self._materialize_neighbors(
+            filter_set, store, neighbors, score_threshold
+        )[0]
+
+    def _filter(self, filter_set: FilterSet, store: ColumnStore) -> np.ndarray:
+        with self.tracer.span(
+            "filter",
+            collection=filter_set.collection,
+            num_filters=len(filter_set),
+        ):
+            rows = apply_filters_to_store(
+                filter_set.filters, store, self.tracer
+            )
+        self.tracer.count(
+            "candidates", len(rows), collection=filter_set.collection
+        )
+        return rows
+
+    def _materialize(
+        self,
+        filter_set: FilterSet,
+        store: ColumnStore,
+        rows: list[np.ndarray],
+    ) -> list[list[Collection]]:
+        with self.tracer.span("convert", collection=filter_set.collection):
+            ret = [store.materialize(r) for r in rows]
+        for records in ret:
+            count_records(
+                self.tracer, records, collection=filter_set.collection
+            )
+        return ret
+
+    def _materialize_neighbors(
+        self,
+        filter_set: FilterSet,
+        store: ColumnStore,
+        neighbors: list[tuple[np.ndarray, np.ndarray]],
+        score_threshold: float | None,
+    ) -> list[list[Collection]]:
+        """Create the records for the results of `_similarity_search`,
+        with their distances as scores"""
+        if score_threshold is not None:
+            masks = [
+                distances <= score_threshold for _, distances in neighbors
+            ]
+            neighbors = [
+                (rows[keep], distances[keep])
+                for (rows, distances), keep in zip(neighbors, masks)
+            ]
+        ret = self._materialize(filter_set, store, [r for r, _ in neighbors])
+        for records, (_, distances) in zip(ret, neighbors):
+            for record, distance in zip(records, distances.tolist()):
+                record.query_distance = distance
+        return ret
+
+    def _query_iter(
+        self,
+        filter_set: FilterSet,
+        with_vectors: bool = True,
+        batch_size: int = 1000,
+    ) -> Iterator[list[Collection]]:
+        # scan `batch_size` rows at a time, keeping the position as the last
+        # id seen (ids are sorted) so that inserting or deleting records
+        # between pages does not skip or repeat any records
+        last_id = None
+        while (store := self.records.get(filter_set.collection)) is not None:
+            ids = store.column("id")
+            start = (
+                0
+                if last_id is None
+                else int(np.searchsorted(ids, last_id, side="right"))
+            )
+            if start >= len(store):
+                return
+            rows = np.arange(start, min(start + batch_size, len(store)))
+            last_id = ids[rows[-1]]
+            rows = rows[~store.deleted[rows]]
+            with self.tracer.span("filter", collection=filter_set.collection):
+                rows = rows[
+                    compile_filter_mask(filter_set.filters, store, rows)
+                ]
+            if len(rows) > 0:
+                yield self._materialize(filter_set, store, [rows])[0]
+
+    def _query_batch(
+        self,
+        filter_set: FilterSet,
+        similarity: Similarity,
+        limit: int,
+        with_vectors: bool = True,
+        score_threshold: float | None = None,
+    ) -> list[list[Collection]]:
+        if not with_vectors:
+            warnings.warn("with_vectors=False has no effect in LocalEngine")
+        Q = similarity.get_batch_array()
+        store = self.records.get(filter_set.collection)
+        if store is None:
+            return [[] for _ in Q]
+        rows = self._filter(filter_set, store)
+        if len(rows) == 0:
+            return [[] for _ in Q]
+        neighbors, self.last_query_plan = self._similarity_search(
+            store,
+            filter_set.collection,
+            rows,
+            similarity.field,
+            Q,
+            min(limit, len(rows)),
+        )
+        return self._materialize_neighbors(
+            filter_set, store, neighbors, score_threshold
+        )
+
+    def _search_backend(
+        self, backend: LocalBackend, Q: np.ndarray, k: int
+    ) -> list[tuple[np.ndarray, np.ndarray]]:
+        with self.tracer.span(
+            "search",
+            backend=type(backend).__name__,
+            num_queries=len(Q),
+            k=k,
+        ):
+            if len(Q) == 1:
+                results = [backend.query(Q[0], k)]
+            else:
+                results = backend.query_batch(Q, k)
+        return [
+            (np.asarray(ids, dtype=np.int64), np.asarray(distances))
+            for ids, distances in results
+        ]
+
+    def _search_index(
+        self, store: ColumnStore, index: _BuiltIndex, Q: np.ndarray, k: int
+    ) -> list[tuple[np.ndarray, np.ndarray]]:
+        """Search `index` and turn the record ids it returns into row
+        positions, dropping the records that were deleted"""
+        ret = []
+        for ids, distances in self._search_backend(index.backend, Q, k):
+            rows = store.lookup_rows(ids)
+            found = rows >= 0
+            ret.append((rows[found], distances[found]))
+        return ret
+
+    def _exact_search(
+        self,
+        store: ColumnStore,
+        collection_name: str,
+        rows: np.ndarray,
+        field: str,
+        Q: np.ndarray,
+        limit: int,
+    ) -> list[tuple[np.ndarray, np.ndarray]]:
+        with self.tracer.span(
+            "build_data_matrix",
+            collection=collection_name,
+            field=field,
+            num_records=len(rows),
+        ):
+            data = store.vector_matrix(field)[rows]
+        exact = NumPyBackend()
+        exact.create_index(
+            data,
+            self.collection_name_to_field_to_metric[collection_name][field],
+        )
+        return [
+            (rows[idxs], distances)
+            for idxs, distances in self._search_backend(
+                exact, Q, min(limit, len(rows))
+            )
+        ]
+
+    def _similarity_search(
+        self,
+        store: ColumnStore,
+        collection_name: str,
+        rows: np.ndarray,
+        field: str,
+        Q: np.ndarray,
+        limit: int,
+    ) -> tuple[list[tuple[np.ndarray, np.ndarray]], QueryPlan]:
+        """Finds the `limit` nearest neighbors among `rows` (the rows that
+        match the filters of the query) for each query vector in `Q`, choosing
+        between searching the persistent index and doing an exact search over
+        `rows`.
+
+        Returns
+        -------
+        tuple[list[tuple[np.ndarray, np.ndarray]], QueryPlan]
+            the row positions of the nearest neighbors of each query vector
+            and their distances, and the plan that was used to find them
+        """
+        plan = QueryPlan(
+            strategy="index",
+            num_records=store.num_live,
+            num_candidates=len(rows),
+        )
+        if limit == 0:
+            # not every backend can be asked for zero neighbors
+            empty = (np.zeros(0, dtype=np.int64), np.zeros(0))
+            return [empty] * len(Q), plan
+        selectivity = len(rows) / len(store)
+        if len(rows) < len(store) and (
+            # if only deleted records are excluded, filtering the results of
+            # an exact index is exact too and saves copying the vectors
+            (self.backend._IS_BRUTE_FORCE and len(rows) < store.num_live)
+            or selectivity <= self.brute_force_selectivity
+            or len(rows) <= limit * self.overfetch_factor
+        ):
+            # searching the index is not going to be cheaper than an exact
+            # search over the records that match the filters
+            plan.strategy = "brute_force"
+            return (
+                self._exact_search(
+                    store, collection_name, rows, field, Q, limit
+                ),
+                plan,
+            )
+
+        index = self._get_index(collection_name, field)
+        # rows are sorted by id, so the records that were inserted after the
+        # index was built (and are not in it) come last
+        split = int(
+            np.searchsorted(
+                store.column("id")[rows], index.max_id, side="right"
+            )
+        )
+        rows, unindexed = rows[:split], rows[split:]
+        plan.num_unindexed = len(unindexed)
+        if len(unindexed) > 0:
+            unindexed_results = self._exact_search(
+                store, collection_name, unindexed, field, Q, limit
+            )
+        if len(rows) == 0:
+            return unindexed_results, plan
+
+        mask = None
+        fetch_size = min(limit, index.size)
+        if len(rows) < index.size:
+            # some of the records in the index don't match the filters (or
+            # were deleted)
+            plan.strategy = "post_filter"
+            mask = np.zeros(len(store), dtype=bool)
+            mask[rows] = True
+            fetch_size = min(
+                index.size,
+                max(
+                    limit * self.overfetch_factor,
+                    math.ceil(limit * index.size / len(rows)),
+                ),
+            )
+        num_needed = min(limit, len(rows))
+        ret: list[tuple[np.ndarray, np.ndarray] | None] = [None] * len(Q)
+        # indices (into `Q`) of the queries that don't have enough neighbors yet
+        pending = np.arange(len(Q))
+        while len(pending) > 0:
+            plan.fetch_size = fetch_size
+            plan.num_index_queries += 1
+            still_pending = []
+            for i, (neighbors, distances) in zip(
+                pending,
+                self._search_index(store, index, Q[pending], fetch_size),
+            ):
+                if mask is not None:
+                    keep = mask[neighbors]
+                    neighbors, distances = neighbors[keep], distances[keep]
+                if len(neighbors) >= num_needed or fetch_size >= index.size:
+                    ret[i] = (neighbors[:limit], distances[:limit])
+                else:
+                    still_pending.append(i)
+            pending = np.array(still_pending, dtype=np.int64)
+            fetch_size = min(index.size, fetch_size * self.overfetch_factor)
+
+        if len(unindexed) == 0:
+            return ret, plan
+        # merge the neighbors from the index with those of the new records
+        merged = []
+        for (a, a_distances), (b, b_distances) in zip(ret, unindexed_results):
+            neighbors = np.concatenate([a, b])
+            distances = np.concatenate([a_distances, b_distances])
+            order = np.argsort(distances, kind="stable")[:limit]
+            merged.append((neighbors[order], distances[order]))
+        return merged, plan
 
     def insert(self, record: Collection) -> int:
-        record.id = self.collection_id_counter[record.__class__.__name__] + 1
-        self.records[record.__class__.__name__].append(record)
-        self.collection_id_counter[record.__class__.__name__] = record.id
+        return self._insert_batch(record.__class__, [record])[0]
+
+    def _insert_batch(
+        self, collection_class: Type[Collection], records: list[Collection]
+    ) -> list[int]:
+        collection_name = collection_class.__name__
+        store = self._get_store(collection_class)
+        start = self.collection_id_counter[collection_name] + 1
+        ids = list(range(start, start + len(records)))
+        store.append(records, ids)
+        for record, id_ in zip(records, ids):
+            record.id = id_
+        if len(ids) > 0:
+            self.collection_id_counter[collection_name] = ids[-1]
+            self._update_indexes(
+                collection_name,
+                np.arange(len(store) - len(ids), len(store)),
+            )
+
+        return ids
+
+    def create_metadata_index(
+        self,
+        collection_class: Type[Collection],
+        field: str,
+        kind: Literal["hash", "sorted"] = "hash",
+    ) -> None:
+        """Create a secondary index over a metadata field, which is used to
+        speed up filtered queries. The index is kept up to date on inserts and
+        deletes.
+
+        Parameters
+        ----------
+        collection_class
+            the collection the field belongs to
+        field
+            the name of the metadata field
+        kind
+            "hash" for an index that answers equality filters or "sorted" for
+            one that answers range filters (as well as equality filters)
+        """
+        self._get_store(collection_class).create_metadata_index(field, kind)
+
+    def _prepare_batch(
+        self, collection_class: Type[Collection], records: list[Collection]
+    ) -> None:
+        # the store is not thread-safe, so the whole insert happens in the
+        # (single-threaded) preparation stage of the ingestion pipeline
+        self._insert_batch(collection_class, records)
 
-        return record.id
+    def _send_batch(
+        self, collection_class: Type[Collection], payload: None
+    ) -> None:
+        pass
 
     def register_collection(self, collection_class: Type[Collection]) -> None:
         self.collection_name_to_field_to_metric[collection_class.__name__] = {
@@ -265,22 +2714,108 @@ class LocalEngine(Engine):
             for field_name, _, metric in collection_class.get_vector_fields()
         }
 
+    def _delete_rows(self, collection_name: str, rows: np.ndarray) -> None:
+        store = self.records[collection_name]
+        rows = np.unique(np.asarray(rows, dtype=np.int64))
+        rows = rows[~store.deleted[rows]]
+        for key, index in self._indexes.items():
+            if key[0] == collection_name and index.backend._SUPPORTS_UPDATES:
+                index.backend.remove(store.ids[rows])
+                index.size -= len(rows)
+        store.mark_deleted(rows)
+        if store.num_deleted > self.compaction_threshold * len(store):
+            self.compact(store.collection_class)
+
+    def compact(
+        self, collection_class: Type[Collection] | None = None
+    ) -> None:
+        """Remove the records marked as deleted (and rebuild the indexes).
+        This happens automatically once enough records were deleted, see
+        `compaction_threshold`.
+
+        Parameters
+        ----------
+        collection_class
+            the collection to compact. compacts all collections if not given
+        """
+        names = (
+            list(self.records)
+            if collection_class is None
+            else [collection_class.__name__]
+        )
+        for name in names:
+            store = self.records.get(name)
+            if store is not None and store.num_deleted > 0:
+                store.compact()
+                self._invalidate_indexes(name)
+
     def _delete_by_id(self, collection: Type[Collection], id: str) -> None:
         collection_name = collection.__name__
-        for r in self.records[collection_name]:
-            if r.id == id:
-                self.records[collection_name].remove(r)
-                return
-        raise ValueError(
-            f"Record with id {id} not found in collection {collection_name}"
-        )
+        store = self.records.get(collection_name)
+        rows = [] if store is None else store.find_rows([id])
+        if len(rows) == 0:
+            raise ValueError(
+                f"Record with id {id} not found in collection {collection_name}"
+            )
+        self._delete_rows(collection_name, rows)
+
+    def _delete_by_ids(
+        self, collection: Type[Collection], ids: list[int]
+    ) -> None:
+        store = self.records.get(collection.__name__)
+        if store is not None:
+            self._delete_rows(collection.__name__, store.find_rows(ids))
+
+    def _delete_where(self, filter_set: FilterSet) -> None:
+        store = self.records.get(filter_set.collection)
+        if store is not None:
+            self._delete_rows(
+                filter_set.collection,
+                apply_filters_to_store(filter_set.filters, store),
+            )
 
     def get_elements_by_ids(
         self, collection: type, ids: list[int]
     ) -> list[Collection]:
-        return [r for r in self.records[collection.__name__] if r.id in ids]
+        store = self.records.get(collection.__name__)
+        if store is None:
+            return []
+        return store.materialize(store.find_rows(ids))
 
     def query(
         self, collection_class: Type[Collection], with_vectors: bool = True
     ) -> QueryObject:
         return super().query(collection_class, with_vectors=with_vectors)
+
+
+class AsyncLocalEngine(ExecutorAsyncEngine):
+    """Async version of `LocalEngine`. Since `LocalEngine` is not thread-safe,
+    the calls are run one at a time on a dedicated thread, which keeps the
+    event loop free while a query is being computed.
+
+    Parameters
+    ----------
+    engine
+        the `LocalEngine` to wrap. if not provided, one is created from
+        `kwargs`
+    executor
+        executor to run the calls in. defaults to a single-threaded executor
+    kwargs
+        passed to `LocalEngine` if `engine` is not provided
+    """
+
+    def __init__(
+        self,
+        engine: LocalEngine | None = None,
+        executor: Executor | None = None,
+        **kwargs,
+    ) -> None:
+        super().__init__(
+            engine or LocalEngine(**kwargs),
+            executor or ThreadPoolExecutor(1),
+        )
+
+    def query(
+        self, collection_class: Type[Collection], with_vectors: bool = True
+    ) -> AsyncQueryObject:
+        return super().query(collection_class, with_vectors=with_vectors)
@@ -1,9 +1,12 @@
 import os
+import time
 import uuid
-from typing import Any, Dict, Type
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, Type
 
 from pinecone import Index, Pinecone, PodSpec, ScoredVector, ServerlessSpec
 from pinecone import Vector as PineconeVector
+from pinecone.exceptions import PineconeApiException, PineconeProtocolError
 
 from affine.collection import (
     Collection,
@@ -13,7 +16,13 @@ from affine.collection import (
     Similarity,
     Vector,
 )
-from affine.engine import Engine
+from affine.engine import AsyncEngine, Engine, ExecutorAsyncEngine
+from affine.engine.base import (
+    _apply_score_threshold,
+    _chunks,
+    _order_by_ids,
+)
+from affine.tracing import count_records, count_vector_bytes_sent
 
 
 def create_uuid() -> str:
@@ -35,7 +44,30 @@ def _convert_filters_to_pinecone(
     return ret
 
 
+def _score_to_distance(score: float, metric: Metric) -> float:
+    """Turns a pinecone score into the distance `Collection.query_distance`
+    holds.
+    pinecone scores cosine indexes by similarity and euclidean ones by
+    squared distance"""
+    if metric == Metric.COSINE:
+        return 1 - score
+    return max(score, 0.0) ** 0.5
+
+
 class PineconeEngine(Engine):
+
+    # the client has no batch vector search, so batches of similarity queries
+    # are sent as concurrent requests
+    _MAX_CONCURRENT_QUERIES = 16
+    # pinecone recommends upserting at most 100 vectors per request
+    _INSERT_BATCH_SIZE = 100
+    # maximum number of ids fetched or deleted in one request (fetched ids
+    # are sent as query parameters, so long lists would exceed the URL length
+    # limit)
+    _FETCH_BATCH_SIZE = 1000
+    # seconds between checks of the number of vectors in `wait_for_records`
+    _POLL_INTERVAL = 1.0
+
     def __init__(
         self, api_key: str = None, spec: ServerlessSpec | PodSpec | None = None
     ):
@@ -124,15 +156,35 @@ class PineconeEngine(Engine):
     def _get_index(self, collection_name: str) -> Index:
         return self.client.Index(collection_name.lower())
 
+    def wait_for_records(
+        self,
+        collection_class: Type[Collection],
+        count: int,
+        timeout: float = 60.0,
+    ) -> None:
+        # pinecone is eventually consistent, upserted vectors only show up in
+        # queries (and in the index stats) after a while
+        index = self._get_index(collection_class.__name__)
+        deadline = time.monotonic() + timeout
+        while index.describe_index_stats().total_vector_count < count:
+            if time.monotonic() >= deadline:
+                raise TimeoutError(
+                    f"Fewer than {count} records of {collection_class.__name__}"
+                    f" are visible after {timeout} seconds"
+                )
+            time.sleep(self._POLL_INTERVAL)
+
     def get_elements_by_ids(
         self, collection: Type[Collection], ids: list[int]
     ) -> list[Collection]:
         index = self._get_index(collection.__name__)
 
-        return [
+        records = [
             self._convert_pinecone_to_collection(r, collection)
-            for r in index.fetch(ids).vectors.values()
+            for chunk in _chunks(ids, self._FETCH_BATCH_SIZE)
+            for r in index.fetch(chunk).vectors.values()
         ]
+        return _order_by_ids(records, ids)
 
     def _query(
         self,
@@ -140,6 +192,7 @@ class PineconeEngine(Engine):
         with_vectors: bool = False,
         similarity: Similarity | None = None,
         limit: int | None = None,
+        score_threshold: float | None = None,
     ) -> list[Collection]:
         filter_ = _convert_filters_to_pinecone(filter_set.filters)
         index = self._get_index(filter_set.collection)
@@ -152,39 +205,197 @@ class PineconeEngine(Engine):
         else:
             vector = similarity.get_array().tolist()
 
-        ret = index.query(
-            top_k=limit,
-            vector=vector,
-            filter=filter_,
-            include_metadata=True,
-            include_values=with_vectors,
-        ).matches
+        count_vector_bytes_sent(
+            self.tracer,
+            similarity,
+            batch=False,
+            collection=filter_set.collection,
+        )
+        with self.tracer.span(
+            "request", collection=filter_set.collection, operation="query"
+        ):
+            ret = index.query(
+                top_k=limit,
+                vector=vector,
+                filter=filter_,
+                include_metadata=True,
+                include_values=with_vectors,
+            ).matches
+
+        # pinecone has no score threshold, so it is applied to the results
+        return _apply_score_threshold(
+            self._convert_results(
+                ret,
+                self.collection_classes[filter_set.collection.lower()],
+                scored=True,
+            ),
+            score_threshold,
+        )
 
-        return [
-            self._convert_pinecone_to_collection(
-                r, self.collection_classes[filter_set.collection.lower()]
-            )
-            for r in ret
+    def _convert_results(
+        self,
+        pc_records: list[ScoredVector | PineconeVector],
+        collection_class: Type[Collection],
+        scored: bool = False,
+    ) -> list[Collection]:
+        """Converts query results (`ScoredVector`s with scores if `scored`),
+        reporting the conversion to the tracer"""
+        collection_name = collection_class.__name__
+        with self.tracer.span("convert", collection=collection_name):
+            ret = [
+                self._convert_pinecone_to_collection(r, collection_class)
+                for r in pc_records
+            ]
+            if scored:
+                _, _, metric = (
+                    self._get_collections_vector_field_name_dim_and_metric(
+                        collection_class
+                    )
+                )
+                for record, r in zip(ret, pc_records):
+                    record.query_distance = _score_to_distance(r.score, metric)
+        count_records(
+            self.tracer, ret, received=True, collection=collection_name
+        )
+        return ret
+
+    def _query_iter(
+        self,
+        filter_set: FilterSet,
+        with_vectors: bool = False,
+        batch_size: int = 1000,
+    ) -> Iterator[list[Collection]]:
+        """Pages of the records of a collection. Pinecone can only list the
+        ids of a (serverless) index page by page, at most 100 at a time, and
+        does not support filtering them, so `batch_size` is capped at 100
+        and filtered queries are not supported. The records of each page are
+        then fetched by id, which always returns their vectors: with
+        `with_vectors=False` the vector field is set to `None`, but the
+        vectors are still transferred."""
+        if filter_set.filters:
+            raise ValueError("Pinecone cannot iterate over filtered queries")
+        index = self._get_index(filter_set.collection)
+        collection_class = self.collection_classes[
+            filter_set.collection.lower()
         ]
+        vf_name, _, _ = self._get_collections_vector_field_name_dim_and_metric(
+            collection_class
+        )
+        for ids in index.list(limit=min(batch_size, 100)):
+            with self.tracer.span(
+                "request", collection=filter_set.collection, operation="fetch"
+            ):
+                vectors = index.fetch(ids).vectors
+            records = self._convert_results(
+                list(vectors.values()), collection_class
+            )
+            if not with_vectors:
+                for record in records:
+                    setattr(record, vf_name, None)
+            yield records
 
     def _delete_by_id(self, collection: Collection, id: str) -> None:
         index = self._get_index(collection.__name__)
         index.delete([id])
 
+    def _delete_by_ids(
+        self, collection: Type[Collection], ids: list[str]
+    ) -> None:
+        index = self._get_index(collection.__name__)
+        for chunk in _chunks(ids, self._FETCH_BATCH_SIZE):
+            index.delete(ids=chunk)
+
+    def _delete_where(self, filter_set: FilterSet) -> None:
+        # note that serverless indexes do not support deleting by metadata
+        # filter, only pod-based indexes do
+        self._get_index(filter_set.collection).delete(
+            filter=_convert_filters_to_pinecone(filter_set.filters)
+        )
+
     def insert(self, record: Collection) -> str:
-        index = self._get_index(record.__class__.__name__)
+        return self._insert_batch(record.__class__, [record])[0]
+
+    def _insert_batch(
+        self, collection_class: Type[Collection], records: list[Collection]
+    ) -> list[str]:
+        self._send_batch(
+            collection_class, self._prepare_batch(collection_class, records)
+        )
+        return [record.id for record in records]
 
+    def _prepare_batch(
+        self, collection_class: Type[Collection], records: list[Collection]
+    ) -> list[PineconeVector]:
         vf_name, _, _ = self._get_collections_vector_field_name_dim_and_metric(
-            record.__class__
+            collection_class
         )
-        uid = create_uuid()
-        index.upsert(
-            [
-                PineconeVector(
-                    id=uid,
-                    values=getattr(record, vf_name).array.tolist(),
-                    metadata=record.get_non_vector_dict(),
-                )
-            ]
+        for record in records:
+            record.id = create_uuid()
+        return [
+            PineconeVector(
+                id=record.id,
+                values=getattr(record, vf_name).array.tolist(),
+                metadata=record.get_non_vector_dict(),
+            )
+            for record in records
+        ]
+
+    def _send_batch(
+        self, collection_class: Type[Collection], payload: list[PineconeVector]
+    ) -> None:
+        self._get_index(collection_class.__name__).upsert(payload)
+
+    def _is_transient_error(self, exc: Exception) -> bool:
+        if isinstance(exc, PineconeApiException):
+            return exc.status == 429 or (exc.status or 0) >= 500
+        return isinstance(exc, PineconeProtocolError) or (
+            super()._is_transient_error(exc)
+        )
+
+
+class AsyncPineconeEngine(ExecutorAsyncEngine):
+    """Async version of `PineconeEngine`. The Pinecone client has no asyncio
+    API, so requests are sent from a pool of threads (the client is
+    thread-safe), allowing many queries to be in flight at once.
+
+    Parameters
+    ----------
+    api_key
+        see `PineconeEngine`
+    spec
+        see `PineconeEngine`
+    max_concurrent_requests
+        maximum number of requests in flight at once
+    """
+
+    def __init__(
+        self,
+        api_key: str = None,
+        spec: ServerlessSpec | PodSpec | None = None,
+        max_concurrent_requests: int = 64,
+    ):
+        super().__init__(
+            PineconeEngine(api_key=api_key, spec=spec),
+            ThreadPoolExecutor(max_concurrent_requests),
+        )
+        # let batches of queries use the whole thread pool
+        self._MAX_CONCURRENT_REQUESTS = max_concurrent_requests
+
+    async def _query_batch(
+        self,
+        filter_set: FilterSet,
+        similarity: Similarity,
+        limit: int,
+        with_vectors: bool = False,
+        score_threshold: float | None = None,
+    ) -> list[list[Collection]]:
+        # send each query separately so they share the whole thread pool
+        # instead of the sync engine's own concurrency limit
+        return await AsyncEngine._query_batch(
+            self,
+            filter_set,
+            similarity,
+            limit,
+            with_vectors=with_vectors,
+            score_threshold=score_threshold,
         )
-        return uid
@@ -1,10 +1,22 @@
 import uuid
-from typing import Dict, List, Optional, Type, Union, get_origin
+from typing import (
+    AsyncIterator,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Type,
+    Union,
+    get_origin,
+)
 
 import numpy as np
-from qdrant_client import QdrantClient
+from qdrant_client import AsyncQdrantClient, QdrantClient
 from qdrant_client.http import models
-from qdrant_client.http.exceptions import UnexpectedResponse
+from qdrant_client.http.exceptions import (
+    ResponseHandlingException,
+    UnexpectedResponse,
+)
 
 from affine.collection import (
     Collection,
@@ -14,7 +26,14 @@ from affine.collection import (
     Similarity,
     Vector,
 )
-from affine.engine import Engine
+from affine.engine import AsyncEngine, Engine
+from affine.engine.base import (
+    _chunks,
+    _gather_limited,
+    _order_by_ids,
+    _similarity_metric,
+)
+from affine.tracing import Tracer, count_records, count_vector_bytes_sent
 
 
 def create_uuid() -> str:
@@ -51,14 +70,155 @@ def _convert_filters_to_qdrant(
     return models.Filter(must=qdrant_conditions) if qdrant_conditions else None
 
 
+_QDRANT_DISTS = {
+    Metric.EUCLIDEAN: models.Distance.EUCLID,
+    Metric.COSINE: models.Distance.COSINE,
+}
+
+
+def _score_to_distance(score: float, metric: Metric) -> float:
+    """Turns a qdrant score into the distance `Collection.query_distance`
+    holds.
+    qdrant scores cosine fields by similarity (larger is closer) and
+    euclidean ones by distance"""
+    return 1 - score if metric == Metric.COSINE else score
+
+
+def _qdrant_score_threshold(
+    score_threshold: float | None, metric: Metric
+) -> float | None:
+    """The qdrant `score_threshold` that keeps the records with a distance of
+    at most `score_threshold`"""
+    if score_threshold is None:
+        return None
+    return _score_to_distance(score_threshold, metric)
+
+
+def _vectors_config(
+    collection_class: Type[Collection],
+) -> dict[str, models.VectorParams]:
+    dtypes = collection_class.get_vector_dtypes()
+    return {
+        name: models.VectorParams(
+            size=size,
+            distance=_QDRANT_DISTS[distance],
+            # qdrant stores vectors as float32 unless told otherwise
+            datatype=(
+                models.Datatype.FLOAT16 if dtypes[name] == np.float16 else None
+            ),
+        )
+        for name, size, distance in collection_class.get_vector_fields()
+    }
+
+
+def _convert_collection_to_payload(record: Collection) -> dict:
+    return {
+        f.name: getattr(record, f.name)
+        for f in type(record).__dataclass_fields__.values()
+        if get_origin(f.type) != Vector
+    }
+
+
+def _convert_collection_to_point(record: Collection) -> models.PointStruct:
+    """Converts a record to a point, assigning it a new id"""
+    record.id = create_uuid()
+    return models.PointStruct(
+        id=record.id,
+        vector={
+            name: getattr(record, name).array
+            for name, _, _ in record.get_vector_fields()
+        },
+        payload=_convert_collection_to_payload(record),
+    )
+
+
+def _convert_qdrant_point_to_collection(
+    point: Union[models.ScoredPoint, models.Record],
+    collection_class: Type[Collection],
+    metric: Metric | None = None,
+) -> Collection:
+    kwargs = point.payload.copy() if point.payload else {}
+    for name, _, _ in collection_class.get_vector_fields():
+        if point.vector is None or name not in point.vector:
+            kwargs[name] = None
+        else:
+            kwargs[name] = Vector(np.array(point.vector[name]))
+
+    ret = collection_class(**kwargs)
+    ret.id = point.id
+    if metric is not None:
+        ret.query_distance = _score_to_distance(point.score, metric)
+    return ret
+
+
+def _convert_qdrant_results(
+    tracer: Tracer,
+    results: list[list[Union[models.ScoredPoint, models.Record]]],
+    collection_class: Type[Collection],
+    metric: Metric | None = None,
+) -> list[list[Collection]]:
+    """Converts the points returned for each query, reporting the
+    conversion to `tracer`. `metric` is that of the searched vector field
+    if the points are the results of a similarity search"""
+    collection_name = collection_class.__name__
+    with tracer.span("convert", collection=collection_name):
+        ret = [
+            [
+                _convert_qdrant_point_to_collection(
+                    point, collection_class, metric
+                )
+                for point in points
+            ]
+            for points in results
+        ]
+    for records in ret:
+        count_records(
+            tracer, records, received=True, collection=collection_name
+        )
+    return ret
+
+
+def _search_requests(
+    filter_set: FilterSet,
+    similarity: Similarity,
+    limit: int,
+    with_vectors: bool,
+    metric: Metric,
+    score_threshold: float | None = None,
+) -> list[models.SearchRequest]:
+    """One search request per row of `similarity.get_batch_array()`"""
+    qdrant_filters = _convert_filters_to_qdrant(filter_set.filters)
+    search_params = models.SearchParams(hnsw_ef=128, exact=False)
+    return [
+        models.SearchRequest(
+            vector=models.NamedVector(
+                name=similarity.field, vector=vector.tolist()
+            ),
+            filter=qdrant_filters,
+            limit=limit,
+            with_vector=with_vectors,
+            with_payload=True,
+            params=search_params,
+            score_threshold=_qdrant_score_threshold(score_threshold, metric),
+        )
+        for vector in similarity.get_batch_array()
+    ]
+
+
+def _is_transient_qdrant_error(exc: Exception) -> bool:
+    if isinstance(exc, UnexpectedResponse):
+        return exc.status_code == 429 or (exc.status_code or 0) >= 500
+    return isinstance(exc, ResponseHandlingException)
+
+
 class QdrantEngine(Engine):
 
     _RETURNS_NORMALIZED_FOR_COSINE = True
+    _INSERT_BATCH_SIZE = 256
+    # maximum number of points retrieved or deleted in one request
+    _FETCH_BATCH_SIZE = 1000
 
-    qdrant_dists = {
-        Metric.EUCLIDEAN: models.Distance.EUCLID,
-        Metric.COSINE: models.Distance.COSINE,
-    }
+    qdrant_dists = _QDRANT_DISTS
 
     def __init__(self, host: str, port: int):
         self.client = QdrantClient(host=host, port=port)
@@ -66,27 +226,36 @@ class QdrantEngine(Engine):
         self.collection_classes: Dict[str, Type[Collection]] = {}
 
     def insert(self, record: Collection) -> str:
-        collection_class = type(record)
-        collection_name = collection_class.__name__
-        self.register_collection(collection_class)
-        self._ensure_collection_exists(collection_class)
+        return self._insert_batch(type(record), [record])[0]
 
-        record.id = create_uuid()
+    def _insert_batch(
+        self, collection_class: Type[Collection], records: list[Collection]
+    ) -> list[str]:
+        self._send_batch(
+            collection_class, self._prepare_batch(collection_class, records)
+        )
+        return [record.id for record in records]
 
-        vector = {
-            name: getattr(record, name).array
-            for name, _, _ in record.get_vector_fields()
-        }
+    def _prepare_batch(
+        self, collection_class: Type[Collection], records: list[Collection]
+    ) -> list[models.PointStruct]:
+        self.register_collection(collection_class)
+        self._ensure_collection_exists(collection_class)
+        return [_convert_collection_to_point(record) for record in records]
 
-        point = models.PointStruct(
-            id=record.id,
-            vector=vector,
-            payload=self._convert_collection_to_payload(record),
+    def _send_batch(
+        self,
+        collection_class: Type[Collection],
+        payload: list[models.PointStruct],
+    ) -> None:
+        self.client.upsert(
+            collection_name=collection_class.__name__, points=payload
         )
 
-        self.client.upsert(collection_name=collection_name, points=[point])
-
-        return record.id
+    def _is_transient_error(self, exc: Exception) -> bool:
+        return _is_transient_qdrant_error(exc) or (
+            super()._is_transient_error(exc)
+        )
 
     def _ensure_collection_exists(self, collection_class: Type[Collection]):
         collection_name = collection_class.__name__
@@ -94,18 +263,9 @@ class QdrantEngine(Engine):
             try:
                 self.client.get_collection(collection_name)
             except UnexpectedResponse:
-                vf_info = collection_class.get_vector_fields()
-                vectors_config = {
-                    name: models.VectorParams(
-                        size=size,
-                        distance=self.qdrant_dists[distance],
-                    )
-                    for name, size, distance in vf_info
-                }
-
                 self.client.create_collection(
                     collection_name=collection_name,
-                    vectors_config=vectors_config,
+                    vectors_config=_vectors_config(collection_class),
                 )
             self.created_collections.add(collection_name)
 
@@ -119,92 +279,423 @@ class QdrantEngine(Engine):
             return 0
         return vector_fields[0].type.__args__[0]
 
-    def _convert_collection_to_payload(self, record: Collection) -> dict:
-        return {
-            f.name: getattr(record, f.name)
-            for f in type(record).__dataclass_fields__.values()
-            if get_origin(f.type) != Vector
-        }
-
     def register_collection(self, collection_class: Type[Collection]) -> None:
         self.collection_classes[collection_class.__name__] = collection_class
 
+    def _get_registered_collection_class(
+        self, collection_name: str
+    ) -> Type[Collection]:
+        collection_class = self.collection_classes.get(collection_name)
+        if not collection_class:
+            raise ValueError(f"Collection {collection_name} not registered")
+
+        self._ensure_collection_exists(collection_class)
+        return collection_class
+
     def _query(
         self,
         filter_set: FilterSet,
         similarity: Similarity | None = None,
         limit: int | None = None,
         with_vectors: bool = False,
+        score_threshold: float | None = None,
     ) -> list[Collection]:
         collection_name = filter_set.collection
-        collection_class = self.collection_classes.get(collection_name)
-        if not collection_class:
-            raise ValueError(f"Collection {collection_name} not registered")
-
-        self._ensure_collection_exists(collection_class)
+        collection_class = self._get_registered_collection_class(
+            collection_name
+        )
 
         qdrant_filters = _convert_filters_to_qdrant(filter_set.filters)
 
         search_params = models.SearchParams(hnsw_ef=128, exact=False)
+        metric = None
         if similarity:
-            results = self.client.search(
-                collection_name=collection_name,
-                query_vector=models.NamedVector(
-                    name=similarity.field, vector=similarity.get_list()
-                ),
-                query_filter=qdrant_filters,
-                limit=limit,
-                with_vectors=with_vectors,
-                search_params=search_params,
+            metric = _similarity_metric(collection_class, similarity)
+            count_vector_bytes_sent(
+                self.tracer,
+                similarity,
+                batch=False,
+                collection=collection_name,
             )
+            with self.tracer.span(
+                "request", collection=collection_name, operation="search"
+            ):
+                results = self.client.search(
+                    collection_name=collection_name,
+                    query_vector=models.NamedVector(
+                        name=similarity.field, vector=similarity.get_list()
+                    ),
+                    query_filter=qdrant_filters,
+                    limit=limit,
+                    with_vectors=with_vectors,
+                    score_threshold=_qdrant_score_threshold(
+                        score_threshold, metric
+                    ),
+                    search_params=search_params,
+                )
+        elif limit is None:
+            # page through all of the matching points
+            return [
+                record
+                for page in self._query_iter(
+                    filter_set, with_vectors=with_vectors
+                )
+                for record in page
+            ]
         else:
-            results = self.client.scroll(
+            with self.tracer.span(
+                "request", collection=collection_name, operation="scroll"
+            ):
+                results = self.client.scroll(
+                    collection_name=collection_name,
+                    scroll_filter=qdrant_filters,
+                    limit=limit,
+                    with_vectors=with_vectors,
+                )[
+                    0
+                ]  # scroll returns a tuple (points, next_page_offset)
+
+        return _convert_qdrant_results(
+            self.tracer, [results], collection_class, metric
+        )[0]
+
+    def _query_iter(
+        self,
+        filter_set: FilterSet,
+        with_vectors: bool = False,
+        batch_size: int = 1000,
+    ) -> Iterator[list[Collection]]:
+        collection_class = self._get_registered_collection_class(
+            filter_set.collection
+        )
+        qdrant_filters = _convert_filters_to_qdrant(filter_set.filters)
+        offset = None
+        while True:
+            with self.tracer.span(
+                "request",
+                collection=filter_set.collection,
+                operation="scroll",
+            ):
+                points, offset = self.client.scroll(
+                    collection_name=filter_set.collection,
+                    scroll_filter=qdrant_filters,
+                    limit=batch_size,
+                    offset=offset,
+                    with_vectors=with_vectors,
+                )
+            if points:
+                yield _convert_qdrant_results(
+                    self.tracer, [points], collection_class
+                )[0]
+            if offset is None:
+                return
+
+    def _query_batch(
+        self,
+        filter_set: FilterSet,
+        similarity: Similarity,
+        limit: int,
+        with_vectors: bool = False,
+        score_threshold: float | None = None,
+    ) -> list[list[Collection]]:
+        collection_name = filter_set.collection
+        collection_class = self._get_registered_collection_class(
+            collection_name
+        )
+
+        metric = _similarity_metric(collection_class, similarity)
+        count_vector_bytes_sent(
+            self.tracer, similarity, batch=True, collection=collection_name
+        )
+        with self.tracer.span(
+            "request", collection=collection_name, operation="search_batch"
+        ):
+            results = self.client.search_batch(
                 collection_name=collection_name,
-                scroll_filter=qdrant_filters,
-                limit=limit,
-                with_vectors=with_vectors,
-            )[
-                0
-            ]  # scroll returns a tuple (points, next_page_offset)
-
-        return [
-            self._convert_qdrant_point_to_collection(point, collection_class)
-            for point in results
-        ]
+                requests=_search_requests(
+                    filter_set,
+                    similarity,
+                    limit,
+                    with_vectors,
+                    metric,
+                    score_threshold=score_threshold,
+                ),
+            )
+        return _convert_qdrant_results(
+            self.tracer, results, collection_class, metric
+        )
 
     def _delete_by_id(self, collection: Type[Collection], id: str) -> None:
-        collection_name = collection.__name__
+        self._delete_by_ids(collection, [id])
+
+    def _delete_by_ids(
+        self, collection: Type[Collection], ids: list[str]
+    ) -> None:
         self.register_collection(collection)
         self._ensure_collection_exists(collection)
+        for chunk in _chunks(ids, self._FETCH_BATCH_SIZE):
+            self.client.delete(
+                collection_name=collection.__name__,
+                points_selector=models.PointIdsList(points=chunk),
+            )
+
+    def _delete_where(self, filter_set: FilterSet) -> None:
+        self._get_registered_collection_class(filter_set.collection)
         self.client.delete(
-            collection_name=collection_name,
-            points_selector=models.PointIdsList(points=[id]),
+            collection_name=filter_set.collection,
+            points_selector=models.FilterSelector(
+                filter=_convert_filters_to_qdrant(filter_set.filters)
+            ),
+        )
+
+    def get_elements_by_ids(
+        self, collection: Type, ids: List[int]
+    ) -> List[Collection]:
+        # handle id filter separately uysing client.retrieve
+        records = [
+            _convert_qdrant_point_to_collection(point, collection)
+            for chunk in _chunks(ids, self._FETCH_BATCH_SIZE)
+            for point in self.client.retrieve(
+                collection_name=collection.__name__, ids=chunk
+            )
+        ]
+        return _order_by_ids(records, ids)
+
+
+class AsyncQdrantEngine(AsyncEngine):
+    """Async version of `QdrantEngine`, using Qdrant's asyncio client"""
+
+    _RETURNS_NORMALIZED_FOR_COSINE = True
+    _INSERT_BATCH_SIZE = 256
+    # maximum number of points retrieved or deleted in one request
+    _FETCH_BATCH_SIZE = 1000
+
+    def __init__(self, host: str, port: int):
+        self.client = AsyncQdrantClient(host=host, port=port)
+        self.created_collections = set()
+        self.collection_classes: Dict[str, Type[Collection]] = {}
+
+    async def close(self) -> None:
+        await self.client.close()
+
+    async def insert(self, record: Collection) -> str:
+        return (await self._insert_batch(type(record), [record]))[0]
+
+    async def _insert_batch(
+        self, collection_class: Type[Collection], records: list[Collection]
+    ) -> list[str]:
+        await self.register_collection(collection_class)
+        await self._ensure_collection_exists(collection_class)
+        await self.client.upsert(
+            collection_name=collection_class.__name__,
+            points=[
+                _convert_collection_to_point(record) for record in records
+            ],
         )
+        return [record.id for record in records]
 
-    def _convert_qdrant_point_to_collection(
+    async def _ensure_collection_exists(
+        self, collection_class: Type[Collection]
+    ) -> None:
+        collection_name = collection_class.__name__
+        if collection_name not in self.created_collections:
+            if not await self.client.collection_exists(collection_name):
+                await self.client.create_collection(
+                    collection_name=collection_name,
+                    vectors_config=_vectors_config(collection_class),
+                )
+            self.created_collections.add(collection_name)
+
+    async def register_collection(
+        self, collection_class: Type[Collection]
+    ) -> None:
+        self.collection_classes[collection_class.__name__] = collection_class
+
+    async def _get_registered_collection_class(
+        self, collection_name: str
+    ) -> Type[Collection]:
+        collection_class = self.collection_classes.get(collection_name)
+        if not collection_class:
+            raise ValueError(f"Collection {collection_name} not registered")
+
+        await self._ensure_collection_exists(collection_class)
+        return collection_class
+
+    async def _query(
         self,
-        point: Union[models.ScoredPoint, models.Record],
-        collection_class: Type[Collection],
-    ) -> Collection:
-        kwargs = point.payload.copy() if point.payload else {}
-        for name, _, _ in collection_class.get_vector_fields():
-            if point.vector is None or name not in point.vector:
-                kwargs[name] = None
-            else:
-                kwargs[name] = Vector(np.array(point.vector[name]))
+        filter_set: FilterSet,
+        similarity: Similarity | None = None,
+        limit: int | None = None,
+        with_vectors: bool = False,
+        score_threshold: float | None = None,
+    ) -> list[Collection]:
+        collection_name = filter_set.collection
+        collection_class = await self._get_registered_collection_class(
+            collection_name
+        )
 
-        ret = collection_class(**kwargs)
-        ret.id = point.id
-        return ret
+        qdrant_filters = _convert_filters_to_qdrant(filter_set.filters)
 
-    def get_elements_by_ids(
+        metric = None
+        if similarity:
+            metric = _similarity_metric(collection_class, similarity)
+            count_vector_bytes_sent(
+                self.tracer,
+                similarity,
+                batch=False,
+                collection=collection_name,
+            )
+            with self.tracer.span(
+                "request", collection=collection_name, operation="search"
+            ):
+                results = await self.client.search(
+                    collection_name=collection_name,
+                    query_vector=models.NamedVector(
+                        name=similarity.field, vector=similarity.get_list()
+                    ),
+                    query_filter=qdrant_filters,
+                    limit=limit,
+                    with_vectors=with_vectors,
+                    score_threshold=_qdrant_score_threshold(
+                        score_threshold, metric
+                    ),
+                    search_params=models.SearchParams(
+                        hnsw_ef=128, exact=False
+                    ),
+                )
+        elif limit is None:
+            return [
+                record
+                async for page in self._query_iter(
+                    filter_set, with_vectors=with_vectors
+                )
+                for record in page
+            ]
+        else:
+            with self.tracer.span(
+                "request", collection=collection_name, operation="scroll"
+            ):
+                results, _ = await self.client.scroll(
+                    collection_name=collection_name,
+                    scroll_filter=qdrant_filters,
+                    limit=limit,
+                    with_vectors=with_vectors,
+                )
+
+        return _convert_qdrant_results(
+            self.tracer, [results], collection_class, metric
+        )[0]
+
+    async def _query_iter(
+        self,
+        filter_set: FilterSet,
+        with_vectors: bool = False,
+        batch_size: int = 1000,
+    ) -> AsyncIterator[list[Collection]]:
+        collection_class = await self._get_registered_collection_class(
+            filter_set.collection
+        )
+        qdrant_filters = _convert_filters_to_qdrant(filter_set.filters)
+        offset = None
+        while True:
+            with self.tracer.span(
+                "request",
+                collection=filter_set.collection,
+                operation="scroll",
+            ):
+                points, offset = await self.client.scroll(
+                    collection_name=filter_set.collection,
+                    scroll_filter=qdrant_filters,
+                    limit=batch_size,
+                    offset=offset,
+                    with_vectors=with_vectors,
+                )
+            if points:
+                yield _convert_qdrant_results(
+                    self.tracer, [points], collection_class
+                )[0]
+            if offset is None:
+                return
+
+    async def _query_batch(
+        self,
+        filter_set: FilterSet,
+        similarity: Similarity,
+        limit: int,
+        with_vectors: bool = False,
+        score_threshold: float | None = None,
+    ) -> list[list[Collection]]:
+        collection_name = filter_set.collection
+        collection_class = await self._get_registered_collection_class(
+            collection_name
+        )
+        metric = _similarity_metric(collection_class, similarity)
+        count_vector_bytes_sent(
+            self.tracer, similarity, batch=True, collection=collection_name
+        )
+        with self.tracer.span(
+            "request", collection=collection_name, operation="search_batch"
+        ):
+            results = await self.client.search_batch(
+                collection_name=collection_name,
+                requests=_search_requests(
+                    filter_set,
+                    similarity,
+                    limit,
+                    with_vectors,
+                    metric,
+                    score_threshold=score_threshold,
+                ),
+            )
+        return _convert_qdrant_results(
+            self.tracer, results, collection_class, metric
+        )
+
+    async def _delete_by_id(
+        self, collection: Type[Collection], id: str
+    ) -> None:
+        await self._delete_by_ids(collection, [id])
+
+    async def _delete_by_ids(
+        self, collection: Type[Collection], ids: list[str]
+    ) -> None:
+        await self.register_collection(collection)
+        await self._ensure_collection_exists(collection)
+        await _gather_limited(
+            (
+                self.client.delete(
+                    collection_name=collection.__name__,
+                    points_selector=models.PointIdsList(points=chunk),
+                )
+                for chunk in _chunks(ids, self._FETCH_BATCH_SIZE)
+            ),
+            self._MAX_CONCURRENT_REQUESTS,
+        )
+
+    async def _delete_where(self, filter_set: FilterSet) -> None:
+        await self._get_registered_collection_class(filter_set.collection)
+        await self.client.delete(
+            collection_name=filter_set.collection,
+            points_selector=models.FilterSelector(
+                filter=_convert_filters_to_qdrant(filter_set.filters)
+            ),
+        )
+
+    async def get_elements_by_ids(
         self, collection: Type, ids: List[int]
     ) -> List[Collection]:
-        # handle id filter separately uysing client.retrieve
-        results = self.client.retrieve(
-            collection_name=collection.__name__, ids=ids
+        results = await _gather_limited(
+            (
+                self.client.retrieve(
+                    collection_name=collection.__name__, ids=chunk
+                )
+                for chunk in _chunks(ids, self._FETCH_BATCH_SIZE)
+            ),
+            self._MAX_CONCURRENT_REQUESTS,
         )
-        return [
-            self._convert_qdrant_point_to_collection(point, collection)
-            for point in results
+        records = [
+            _convert_qdrant_point_to_collection(point, collection)
+            for points in results
+            for point in points
         ]
+        return _order_by_ids(records, ids)
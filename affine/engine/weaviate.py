@@ -1,4 +1,5 @@
-from typing import Dict, List, Type, get_origin
+import uuid
+from typing import AsyncIterator, Dict, Iterator, List, Type, get_origin
 
 import weaviate
 from weaviate.classes import query
@@ -8,9 +9,16 @@ from weaviate.classes.config import (
     Property,
     VectorDistances,
 )
+from weaviate.classes.data import DataObject
 from weaviate.collections import Collection as WeaviateCollection
 from weaviate.collections.classes.filters import _FilterValue
 from weaviate.collections.classes.internal import Object
+from weaviate.exceptions import (
+    UnexpectedStatusCodeError,
+    WeaviateConnectionError,
+    WeaviateGRPCUnavailableError,
+    WeaviateTimeoutError,
+)
 
 from affine.collection import (
     Collection,
@@ -20,7 +28,14 @@ from affine.collection import (
     Similarity,
     Vector,
 )
-from affine.engine import Engine
+from affine.engine import AsyncEngine, Engine
+from affine.engine.base import (
+    _chunks,
+    _gather_limited,
+    _order_by_ids,
+    _similarity_metric,
+)
+from affine.tracing import Tracer, count_records, count_vector_bytes_sent
 
 
 def _build_where_filter(filters: List[Filter]) -> _FilterValue:
@@ -51,8 +66,27 @@ def _build_where_filter(filters: List[Filter]) -> _FilterValue:
     return ret
 
 
+def _weaviate_distance_to_score(distance: float, metric: Metric) -> float:
+    """Turns a weaviate distance into the distance
+    `Collection.query_distance` holds.
+    euclidean fields use squared distances in weaviate"""
+    if metric == Metric.EUCLIDEAN:
+        return max(distance, 0.0) ** 0.5
+    return distance
+
+
+def _weaviate_distance_threshold(
+    score_threshold: float | None, metric: Metric
+) -> float | None:
+    """The weaviate `distance` that keeps the records with a score of at
+    most `score_threshold`"""
+    if score_threshold is None or metric != Metric.EUCLIDEAN:
+        return score_threshold
+    return score_threshold**2
+
+
 def weaviate_object_to_collection_object(
-    obj: Object, collection_cls: Type[Collection]
+    obj: Object, collection_cls: Type[Collection], metric: Metric | None = None
 ) -> Collection:
     kwargs = obj.properties.copy()
 
@@ -65,15 +99,149 @@ def weaviate_object_to_collection_object(
 
     ret = collection_cls(**kwargs)
     ret.id = str(obj.uuid)
+    if metric is not None:
+        ret.query_distance = _weaviate_distance_to_score(
+            obj.metadata.distance, metric
+        )
     return ret
 
 
+def _convert_weaviate_objects(
+    tracer: Tracer,
+    objects: list[Object],
+    collection_cls: Type[Collection],
+    metric: Metric | None = None,
+) -> list[Collection]:
+    """Converts query results, reporting the conversion to `tracer`.
+    `metric` is that of the searched vector field if the objects are the
+    results of a similarity search (and have their distance)"""
+    collection_name = collection_cls.__name__
+    with tracer.span("convert", collection=collection_name):
+        ret = [
+            weaviate_object_to_collection_object(obj, collection_cls, metric)
+            for obj in objects
+        ]
+    count_records(tracer, ret, received=True, collection=collection_name)
+    return ret
+
+
+_WEAVIATE_DISTS = {
+    Metric.EUCLIDEAN: VectorDistances.L2_SQUARED,
+    Metric.COSINE: VectorDistances.COSINE,
+}
+
+
+def _collection_schema(
+    collection_class: Type[Collection],
+) -> tuple[list[Property], list | None]:
+    """The properties and vectorizer config for creating a Weaviate
+    collection that stores `collection_class`"""
+    properties = []
+    for field_name, field in collection_class.__dataclass_fields__.items():
+        if field_name != "id":
+            if get_origin(field.type) != Vector:
+                data_type = (
+                    DataType.TEXT if field.type == str else DataType.NUMBER
+                )
+                properties.append(
+                    Property(name=field_name, data_type=data_type)
+                )
+    if len(collection_class.get_vector_fields()) > 0:
+        vectorizer_config = [
+            Configure.NamedVectors.none(
+                name,
+                vector_index_config=Configure.VectorIndex.hnsw(
+                    distance_metric=_WEAVIATE_DISTS[dist]
+                ),
+            )
+            for name, _, dist in collection_class.get_vector_fields()
+        ]
+    else:
+        vectorizer_config = None
+    return properties, vectorizer_config
+
+
+def _convert_collection_to_data_object(
+    collection_class: Type[Collection], record: Collection
+) -> DataObject:
+    """Converts a record to a `DataObject`, assigning it a new id"""
+    data_object = {}
+    vector = {}
+    for field_name, field in collection_class.__dataclass_fields__.items():
+        if field_name != "id":
+            value = getattr(record, field_name)
+            if get_origin(field.type) == Vector:
+                vector[field_name] = value.array.tolist()
+            else:
+                data_object[field_name] = value
+    # generate the uuids here instead of relying on the batch result,
+    # which only keeps a limited number of them
+    record.id = str(uuid.uuid4())
+    return DataObject(properties=data_object, uuid=record.id, vector=vector)
+
+
+def _is_transient_weaviate_error(exc: Exception) -> bool:
+    if isinstance(exc, UnexpectedStatusCodeError):
+        return exc.status_code == 429 or exc.status_code >= 500
+    return isinstance(
+        exc,
+        (
+            WeaviateConnectionError,
+            WeaviateGRPCUnavailableError,
+            WeaviateTimeoutError,
+        ),
+    )
+
+
+def _page_kwargs(
+    where_filter: _FilterValue | None,
+    batch_size: int,
+    previous_page: list[Object] | None,
+    offset: int,
+) -> dict:
+    """Arguments to `fetch_objects` for the page after `previous_page`.
+    Unfiltered queries use a cursor, but since Weaviate does not support
+    combining cursors with filters, filtered queries page by offset
+    instead (which is capped by the server's `QUERY_MAXIMUM_RESULTS`)."""
+    if where_filter is None:
+        return {
+            "limit": batch_size,
+            "after": previous_page[-1].uuid if previous_page else None,
+        }
+    return {"filters": where_filter, "limit": batch_size, "offset": offset}
+
+
+# maximum number of objects fetched or deleted by id in one request, which
+# must stay below the server's `QUERY_MAXIMUM_RESULTS` (10,000 by default)
+_FETCH_BATCH_SIZE = 1000
+
+
+def _ids_filter(ids: list[str]) -> _FilterValue:
+    return query.Filter.by_id().contains_any(ids)
+
+
+def _raise_for_delete_errors(collection_name: str, result) -> None:
+    if result.failed > 0:
+        raise RuntimeError(
+            f"Failed to delete {result.failed} records from {collection_name}"
+        )
+
+
+def _raise_for_insert_errors(collection_name: str, result) -> None:
+    if result.has_errors:
+        raise RuntimeError(
+            f"Failed to insert {len(result.errors)} records into "
+            f"{collection_name}: {list(result.errors.values())[0].message}"
+        )
+
+
 class WeaviateEngine(Engine):
 
-    weaviate_dists = {
-        Metric.EUCLIDEAN: VectorDistances.L2_SQUARED,
-        Metric.COSINE: VectorDistances.COSINE,
-    }
+    # the client has no batch vector search, so batches of similarity queries
+    # are sent as concurrent requests
+    _MAX_CONCURRENT_QUERIES = 16
+
+    weaviate_dists = _WEAVIATE_DISTS
 
     def __init__(self, host: str, port: int):
         self.client = weaviate.connect_to_local(host=host, port=port)
@@ -85,34 +253,9 @@ class WeaviateEngine(Engine):
 
         # Check if the class already exists in Weaviate
         if not self.client.collections.exists(collection_name):
-            properties = []
-            for (
-                field_name,
-                field,
-            ) in collection_class.__dataclass_fields__.items():
-                if field_name != "id":
-                    if get_origin(field.type) != Vector:
-                        data_type = (
-                            DataType.TEXT
-                            if field.type == str
-                            else DataType.NUMBER
-                        )
-                        properties.append(
-                            Property(name=field_name, data_type=data_type)
-                        )
-            if len(collection_class.get_vector_fields()) > 0:
-                vectorizer_config = [
-                    Configure.NamedVectors.none(
-                        name,
-                        vector_index_config=Configure.VectorIndex.hnsw(
-                            distance_metric=self.weaviate_dists[dist]
-                        ),
-                    )
-                    for name, _, dist in collection_class.get_vector_fields()
-                ]
-            else:
-                vectorizer_config = None
-
+            properties, vectorizer_config = _collection_schema(
+                collection_class
+            )
             self.client.collections.create(
                 name=collection_name,
                 properties=properties,
@@ -122,27 +265,40 @@ class WeaviateEngine(Engine):
             print(f"Class {collection_name} already exists in Weaviate")
 
     def insert(self, record: Collection) -> str:
-        collection_class = type(record)
-        collection_name = collection_class.__name__
+        return self._insert_batch(type(record), [record])[0]
 
-        if collection_name not in self.collection_classes:
-            self.register_collection(collection_class)
+    def _insert_batch(
+        self, collection_class: Type[Collection], records: list[Collection]
+    ) -> list[str]:
+        self._send_batch(
+            collection_class, self._prepare_batch(collection_class, records)
+        )
+        return [record.id for record in records]
 
-        col = self.client.collections.get(collection_name)
+    def _prepare_batch(
+        self, collection_class: Type[Collection], records: list[Collection]
+    ) -> list[DataObject]:
+        if collection_class.__name__ not in self.collection_classes:
+            self.register_collection(collection_class)
 
-        data_object = {}
-        vector = {}
-        for field_name, field in collection_class.__dataclass_fields__.items():
-            if field_name != "id":
-                value = getattr(record, field_name)
-                if get_origin(field.type) == Vector:
-                    vector[field_name] = value.array
-                else:
-                    data_object[field_name] = value
+        return [
+            _convert_collection_to_data_object(collection_class, record)
+            for record in records
+        ]
 
-        record.id = str(col.data.insert(data_object, vector=vector))
+    def _send_batch(
+        self, collection_class: Type[Collection], payload: list[DataObject]
+    ) -> None:
+        collection_name = collection_class.__name__
+        col = self.client.collections.get(collection_name)
+        _raise_for_insert_errors(
+            collection_name, col.data.insert_many(payload)
+        )
 
-        return record.id
+    def _is_transient_error(self, exc: Exception) -> bool:
+        return _is_transient_weaviate_error(exc) or (
+            super()._is_transient_error(exc)
+        )
 
     def get_weaviate_collection_and_affine_collection_class(
         self, collection_name: str
@@ -159,6 +315,7 @@ class WeaviateEngine(Engine):
         with_vectors: bool = False,
         similarity: Similarity | None = None,
         limit: int | None = None,
+        score_threshold: float | None = None,
     ) -> list[Collection]:
         (
             col,
@@ -168,23 +325,86 @@ class WeaviateEngine(Engine):
         )
 
         where_filter = _build_where_filter(filter_set.filters)
+        metric = None
         if similarity:
-            result = col.query.near_vector(
-                similarity.get_list(),
-                target_vector=similarity.field,
-                filters=where_filter,
-                include_vector=with_vectors,
-                limit=limit,
-            ).objects
+            metric = _similarity_metric(collection_class, similarity)
+            count_vector_bytes_sent(
+                self.tracer,
+                similarity,
+                batch=False,
+                collection=filter_set.collection,
+            )
+            with self.tracer.span(
+                "request",
+                collection=filter_set.collection,
+                operation="near_vector",
+            ):
+                result = col.query.near_vector(
+                    similarity.get_list(),
+                    target_vector=similarity.field,
+                    filters=where_filter,
+                    include_vector=with_vectors,
+                    limit=limit,
+                    distance=_weaviate_distance_threshold(
+                        score_threshold, metric
+                    ),
+                    return_metadata=query.MetadataQuery(distance=True),
+                ).objects
+        elif limit is None:
+            return [
+                record
+                for page in self._query_iter(
+                    filter_set, with_vectors=with_vectors
+                )
+                for record in page
+            ]
         else:
-            result = col.query.fetch_objects(
-                filters=where_filter, include_vector=with_vectors
-            ).objects
+            with self.tracer.span(
+                "request",
+                collection=filter_set.collection,
+                operation="fetch_objects",
+            ):
+                result = col.query.fetch_objects(
+                    filters=where_filter,
+                    include_vector=with_vectors,
+                    limit=limit,
+                ).objects
+
+        return _convert_weaviate_objects(
+            self.tracer, result, collection_class, metric
+        )
 
-        return [
-            weaviate_object_to_collection_object(obj, collection_class)
-            for obj in result
-        ]
+    def _query_iter(
+        self,
+        filter_set: FilterSet,
+        with_vectors: bool = False,
+        batch_size: int = 1000,
+    ) -> Iterator[list[Collection]]:
+        (
+            col,
+            collection_class,
+        ) = self.get_weaviate_collection_and_affine_collection_class(
+            filter_set.collection
+        )
+        where_filter = _build_where_filter(filter_set.filters)
+        objects, offset = None, 0
+        while True:
+            with self.tracer.span(
+                "request",
+                collection=filter_set.collection,
+                operation="fetch_objects",
+            ):
+                objects = col.query.fetch_objects(
+                    include_vector=with_vectors,
+                    **_page_kwargs(where_filter, batch_size, objects, offset),
+                ).objects
+            if objects:
+                yield _convert_weaviate_objects(
+                    self.tracer, objects, collection_class
+                )
+            if len(objects) < batch_size:
+                return
+            offset += len(objects)
 
     def _delete_by_id(self, collection: Type[Collection], id: str) -> None:
         col, _ = self.get_weaviate_collection_and_affine_collection_class(
@@ -192,6 +412,31 @@ class WeaviateEngine(Engine):
         )
         col.data.delete_by_id(id)
 
+    def _delete_by_ids(
+        self, collection: Type[Collection], ids: list[str]
+    ) -> None:
+        col, _ = self.get_weaviate_collection_and_affine_collection_class(
+            collection.__name__
+        )
+        for chunk in _chunks(ids, _FETCH_BATCH_SIZE):
+            _raise_for_delete_errors(
+                collection.__name__,
+                col.data.delete_many(where=_ids_filter(chunk)),
+            )
+
+    def _delete_where(self, filter_set: FilterSet) -> None:
+        col, _ = self.get_weaviate_collection_and_affine_collection_class(
+            filter_set.collection
+        )
+        where_filter = _build_where_filter(filter_set.filters)
+        # a single request deletes at most the server's
+        # `QUERY_MAXIMUM_RESULTS` objects, so repeat until nothing matches
+        while True:
+            result = col.data.delete_many(where=where_filter)
+            _raise_for_delete_errors(filter_set.collection, result)
+            if result.matches == 0 or result.successful == 0:
+                return
+
     def get_elements_by_ids(
         self, collection: Type[Collection], ids: List[str]
     ) -> List[Collection]:
@@ -202,9 +447,217 @@ class WeaviateEngine(Engine):
             collection.__name__
         )
 
-        return [
-            weaviate_object_to_collection_object(
-                col.query.fetch_object_by_id(id_), collection_class
+        records = [
+            weaviate_object_to_collection_object(obj, collection_class)
+            for chunk in _chunks(ids, _FETCH_BATCH_SIZE)
+            for obj in col.query.fetch_objects(
+                filters=_ids_filter(chunk), limit=len(chunk)
+            ).objects
+        ]
+        return _order_by_ids(records, ids)
+
+
+class AsyncWeaviateEngine(AsyncEngine):
+    """Async version of `WeaviateEngine`, using Weaviate's asyncio client.
+    The client connects on first use, and should be closed with `close`."""
+
+    def __init__(self, host: str, port: int):
+        self.client = weaviate.use_async_with_local(host=host, port=port)
+        self.collection_classes: Dict[str, Type[Collection]] = {}
+
+    async def _connect(self) -> None:
+        if not self.client.is_connected():
+            await self.client.connect()
+
+    async def close(self) -> None:
+        await self.client.close()
+
+    async def register_collection(
+        self, collection_class: Type[Collection]
+    ) -> None:
+        await self._connect()
+        collection_name = collection_class.__name__
+        self.collection_classes[collection_name] = collection_class
+
+        if not await self.client.collections.exists(collection_name):
+            properties, vectorizer_config = _collection_schema(
+                collection_class
+            )
+            await self.client.collections.create(
+                name=collection_name,
+                properties=properties,
+                vectorizer_config=vectorizer_config,
+            )
+
+    async def _get_collection(
+        self, collection_name: str
+    ) -> tuple[WeaviateCollection, Type[Collection]]:
+        await self._connect()
+        collection_class = self.collection_classes.get(collection_name)
+        if not collection_class:
+            raise ValueError(f"Collection {collection_name} not registered")
+        return self.client.collections.get(collection_name), collection_class
+
+    async def insert(self, record: Collection) -> str:
+        return (await self._insert_batch(type(record), [record]))[0]
+
+    async def _insert_batch(
+        self, collection_class: Type[Collection], records: list[Collection]
+    ) -> list[str]:
+        collection_name = collection_class.__name__
+        if collection_name not in self.collection_classes:
+            await self.register_collection(collection_class)
+        col, _ = await self._get_collection(collection_name)
+        _raise_for_insert_errors(
+            collection_name,
+            await col.data.insert_many(
+                [
+                    _convert_collection_to_data_object(
+                        collection_class, record
+                    )
+                    for record in records
+                ]
+            ),
+        )
+        return [record.id for record in records]
+
+    async def _query(
+        self,
+        filter_set: FilterSet,
+        with_vectors: bool = False,
+        similarity: Similarity | None = None,
+        limit: int | None = None,
+        score_threshold: float | None = None,
+    ) -> list[Collection]:
+        col, collection_class = await self._get_collection(
+            filter_set.collection
+        )
+
+        where_filter = _build_where_filter(filter_set.filters)
+        metric = None
+        if similarity:
+            metric = _similarity_metric(collection_class, similarity)
+            count_vector_bytes_sent(
+                self.tracer,
+                similarity,
+                batch=False,
+                collection=filter_set.collection,
             )
-            for id_ in ids
+            with self.tracer.span(
+                "request",
+                collection=filter_set.collection,
+                operation="near_vector",
+            ):
+                response = await col.query.near_vector(
+                    similarity.get_list(),
+                    target_vector=similarity.field,
+                    filters=where_filter,
+                    include_vector=with_vectors,
+                    limit=limit,
+                    distance=_weaviate_distance_threshold(
+                        score_threshold, metric
+                    ),
+                    return_metadata=query.MetadataQuery(distance=True),
+                )
+        elif limit is None:
+            return [
+                record
+                async for page in self._query_iter(
+                    filter_set, with_vectors=with_vectors
+                )
+                for record in page
+            ]
+        else:
+            with self.tracer.span(
+                "request",
+                collection=filter_set.collection,
+                operation="fetch_objects",
+            ):
+                response = await col.query.fetch_objects(
+                    filters=where_filter,
+                    include_vector=with_vectors,
+                    limit=limit,
+                )
+
+        return _convert_weaviate_objects(
+            self.tracer, response.objects, collection_class, metric
+        )
+
+    async def _query_iter(
+        self,
+        filter_set: FilterSet,
+        with_vectors: bool = False,
+        batch_size: int = 1000,
+    ) -> AsyncIterator[list[Collection]]:
+        col, collection_class = await self._get_collection(
+            filter_set.collection
+        )
+        where_filter = _build_where_filter(filter_set.filters)
+        objects, offset = None, 0
+        while True:
+            with self.tracer.span(
+                "request",
+                collection=filter_set.collection,
+                operation="fetch_objects",
+            ):
+                response = await col.query.fetch_objects(
+                    include_vector=with_vectors,
+                    **_page_kwargs(where_filter, batch_size, objects, offset),
+                )
+            objects = response.objects
+            if objects:
+                yield _convert_weaviate_objects(
+                    self.tracer, objects, collection_class
+                )
+            if len(objects) < batch_size:
+                return
+            offset += len(objects)
+
+    async def _delete_by_id(
+        self, collection: Type[Collection], id: str
+    ) -> None:
+        col, _ = await self._get_collection(collection.__name__)
+        await col.data.delete_by_id(id)
+
+    async def _delete_by_ids(
+        self, collection: Type[Collection], ids: list[str]
+    ) -> None:
+        col, _ = await self._get_collection(collection.__name__)
+        results = await _gather_limited(
+            (
+                col.data.delete_many(where=_ids_filter(chunk))
+                for chunk in _chunks(ids, _FETCH_BATCH_SIZE)
+            ),
+            self._MAX_CONCURRENT_REQUESTS,
+        )
+        for result in results:
+            _raise_for_delete_errors(collection.__name__, result)
+
+    async def _delete_where(self, filter_set: FilterSet) -> None:
+        col, _ = await self._get_collection(filter_set.collection)
+        where_filter = _build_where_filter(filter_set.filters)
+        while True:
+            result = await col.data.delete_many(where=where_filter)
+            _raise_for_delete_errors(filter_set.collection, result)
+            if result.matches == 0 or result.successful == 0:
+                return
+
+    async def get_elements_by_ids(
+        self, collection: Type[Collection], ids: List[str]
+    ) -> List[Collection]:
+        col, collection_class = await self._get_collection(collection.__name__)
+        responses = await _gather_limited(
+            (
+                col.query.fetch_objects(
+                    filters=_ids_filter(chunk), limit=len(chunk)
+                )
+                for chunk in _chunks(ids, _FETCH_BATCH_SIZE)
+            ),
+            self._MAX_CONCURRENT_REQUESTS,
+        )
+        records = [
+            weaviate_object_to_collection_object(obj, collection_class)
+            for response in responses
+            for obj in response.objects
         ]
+        return _order_by_ids(records, ids)
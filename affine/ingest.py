@@ -0,0 +1,154 @@
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Iterator, Type
+
+from affine.collection import Collection
+
+if TYPE_CHECKING:
+    from affine.engine import Engine
+
+
+@dataclass
+class IngestStats:
+    num_records: int = 0
+    num_batches: int = 0
+    num_retries: int = 0
+    elapsed_seconds: float = 0.0
+
+    @property
+    def records_per_second(self) -> float:
+        if self.elapsed_seconds == 0:
+            return 0.0
+        return self.num_records / self.elapsed_seconds
+
+
+def _batches(
+    records: Iterable[Collection], batch_size: int
+) -> Iterator[tuple[Type[Collection], list[Collection]]]:
+    """Groups a stream of records into batches of records from the
+    same collection"""
+    pending: dict[Type[Collection], list[Collection]] = defaultdict(list)
+    for record in records:
+        batch = pending[type(record)]
+        batch.append(record)
+        if len(batch) == batch_size:
+            yield type(record), pending.pop(type(record))
+    for collection_class, batch in pending.items():
+        yield collection_class, batch
+
+
+def ingest(
+    engine: "Engine",
+    records: Iterable[Collection],
+    batch_size: int | None = None,
+    n_workers: int = 4,
+    max_pending_batches: int | None = None,
+    max_retries: int = 3,
+    backoff: float = 0.5,
+    is_transient_error: Callable[[Exception], bool] | None = None,
+    on_progress: Callable[[IngestStats], None] | None = None,
+) -> IngestStats:
+    """Insert a (possibly very long) stream of records with a pipeline: the
+    calling thread groups the records into batches and converts them to the
+    database's wire format while `n_workers` threads send the batches.
+
+    Parameters
+    ----------
+    engine
+        the engine to insert into
+    records
+        the records to insert. this can be any iterable, e.g. a generator
+        reading from a file, and is consumed lazily
+    batch_size
+        number of records per request. defaults to the engine's bulk insert
+        batch size, or 1000 if it doesn't have one
+    n_workers
+        number of batches sent concurrently
+    max_pending_batches
+        maximum number of converted batches waiting to be (or being) sent. the
+        conversion stage blocks once this is reached, which bounds memory use.
+        defaults to `2 * n_workers`
+    max_retries
+        how often a batch is retried after failing with a transient error
+    backoff
+        seconds to wait before the first retry, doubled for every further
+        retry of the same batch
+    is_transient_error
+        decides whether a failed batch should be retried. defaults to the
+        engine's notion of transient errors (connection errors, timeouts,
+        rate limiting and server errors)
+    on_progress
+        called with a snapshot of the statistics after every sent batch (from
+        the worker threads)
+
+    Returns
+    -------
+    IngestStats
+        number of records, batches, retries and elapsed time
+
+    Raises
+    ------
+    Exception
+        the error of the first batch that fails with a non-transient error
+        or runs out of retries. batches that were already sent are not
+        rolled back.
+    """
+    batch_size = batch_size or engine._INSERT_BATCH_SIZE or 1000
+    max_pending_batches = max_pending_batches or 2 * n_workers
+    is_transient_error = is_transient_error or engine._is_transient_error
+
+    stats = IngestStats()
+    lock = threading.Lock()
+    slots = threading.BoundedSemaphore(max_pending_batches)
+    start = time.perf_counter()
+
+    def send(collection_class: Type[Collection], payload: Any, n: int):
+        try:
+            for attempt in range(max_retries + 1):
+                try:
+                    engine._send_batch(collection_class, payload)
+                    break
+                except Exception as e:
+                    if attempt == max_retries or not is_transient_error(e):
+                        raise
+                    with lock:
+                        stats.num_retries += 1
+                    time.sleep(backoff * 2**attempt)
+            with lock:
+                stats.num_records += n
+                stats.num_batches += 1
+                stats.elapsed_seconds = time.perf_counter() - start
+                snapshot = replace(stats)
+            if on_progress is not None:
+                on_progress(snapshot)
+        finally:
+            slots.release()
+
+    futures: list[Future] = []
+    with ThreadPoolExecutor(n_workers) as executor:
+        try:
+            for collection_class, batch in _batches(records, batch_size):
+                payload = engine._prepare_batch(collection_class, batch)
+                slots.acquire()
+                futures.append(
+                    executor.submit(
+                        send, collection_class, payload, len(batch)
+                    )
+                )
+                # stop early if a batch failed and drop finished futures
+                for f in futures:
+                    if f.done():
+                        f.result()
+                futures = [f for f in futures if not f.done()]
+        except BaseException:
+            for f in futures:
+                f.cancel()
+            raise
+        for f in futures:
+            f.result()
+
+    stats.elapsed_seconds = time.perf_counter() - start
+    return stats
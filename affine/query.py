@@ -1,9 +1,15 @@
-from typing import TYPE_CHECKING, Type
+from typing import (
+    TYPE_CHECKING,
+    AsyncIterator,
+    ContextManager,
+    Iterator,
+    Type,
+)
 
 from affine.collection import Collection, Filter, FilterSet, Similarity
 
 if TYPE_CHECKING:
-    from affine.engine import Engine
+    from affine.engine import AsyncEngine, Engine
 
 
 class QueryObject:
@@ -20,6 +26,7 @@ class QueryObject:
             filters=[], collection=collection_class.__name__
         )
         self._similarity = None
+        self._similarity_batch = None
 
     def filter(self, filter_set: FilterSet | Filter) -> "QueryObject":
         """Filter the result of a query by specified filters
@@ -50,9 +57,47 @@ class QueryObject:
         list[Collection]
             all of the matching records for the query
         """
+        with self._span("all"):
+            return self._all()
+
+    def _all(self):
         return self.db._query(self._filter_set, with_vectors=self.with_vectors)
 
-    def limit(self, n: int) -> list[Collection]:
+    def iter(self, batch_size: int = 1000) -> Iterator[Collection]:
+        """Lazily iterate over the results of a query (the same records as
+        `all`), fetching `batch_size` records from the database at a time.
+        This keeps memory use constant when e.g. exporting a whole collection:
+
+        ```python
+        for record in db.query(C).iter(batch_size=10_000):
+            ...
+        ```
+
+        Parameters
+        ----------
+        batch_size
+            how many records to fetch per request. some engines fetch fewer
+            at a time: `PineconeEngine` fetches at most 100 per request
+            (and always receives their vectors, even if the query was made
+            with `with_vectors=False`)
+
+        Returns
+        -------
+        Iterator[Collection]
+            iterator over the matching records
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be positive")
+        pages = self.db._query_iter(
+            self._filter_set,
+            with_vectors=self.with_vectors,
+            batch_size=batch_size,
+        )
+        return (record for page in pages for record in page)
+
+    def limit(
+        self, n: int, score_threshold: float | None = None
+    ) -> list[Collection] | list[list[Collection]]:
         """Returns a fixed number of results of a query.
 
         Parameters
@@ -60,19 +105,128 @@ class QueryObject:
         n
             how many records to retrieve. in the case of a similarity search query
             this will be the `n`-closest neighbors
+        score_threshold
+            only for similarity search queries: the largest distance to the
+            query vector (see `Collection.query_distance`) a returned record
+            may have. engines that support it apply the threshold in the database,
+            so the records beyond it are not sent back at all
 
         Returns
         -------
-        list[Collection]
+        list[Collection] | list[list[Collection]]
+            the resulting records or, if the query was set up with `similarity_batch`,
+            a list containing the resulting records for each of the query vectors.
+            the records of a similarity search query have their `query_distance` set
         """
+        with self._span("limit", limit=n, score_threshold=score_threshold):
+            return self._limit(n, score_threshold)
+
+    def _limit(self, n: int, score_threshold: float | None = None):
+        if self._similarity_batch is not None:
+            return self.db._query_batch(
+                self._filter_set,
+                with_vectors=self.with_vectors,
+                limit=n,
+                similarity=self._similarity_batch,
+                score_threshold=score_threshold,
+            )
+        if self._similarity is None:
+            if score_threshold is not None:
+                raise ValueError(
+                    "score_threshold requires a similarity search query"
+                )
+            return self.db._query(
+                self._filter_set, with_vectors=self.with_vectors, limit=n
+            )
         return self.db._query(
             self._filter_set,
             with_vectors=self.with_vectors,
             limit=n,
             similarity=self._similarity,
+            score_threshold=score_threshold,
+        )
+
+    def _span(self, operation: str, **attributes) -> ContextManager:
+        """The root span of the query, reported to the engine's tracer"""
+        tracer = self.db.tracer
+        if not tracer.enabled:
+            return tracer.span("query")
+        return tracer.span(
+            "query",
+            engine=type(self.db).__name__,
+            collection=self.collection_class.__name__,
+            operation=operation,
+            similarity=self._similarity is not None,
+            batch_size=(
+                None
+                if self._similarity_batch is None
+                else len(self._similarity_batch.get_batch_array())
+            ),
+            num_filters=len(self._filter_set),
+            **attributes,
         )
 
     def similarity(self, similarity: Similarity) -> "QueryObject":
         """Apply a similarity search to the query"""
         self._similarity = similarity
+        self._similarity_batch = None
         return self
+
+    def similarity_batch(self, similarity: Similarity) -> "QueryObject":
+        """Apply a similarity search for multiple query vectors at once. The
+        query will then return a list of results per query vector, e.g.
+
+        ```python
+        db.query(C).similarity_batch(C.embedding == matrix).limit(k)
+        ```
+
+        Parameters
+        ----------
+        similarity
+            similarity whose value is a 2D array (or list) of query vectors,
+            with one query vector per row
+        """
+        similarity.get_batch_array()  # validate the shape early
+        self._similarity_batch = similarity
+        self._similarity = None
+        return self
+
+
+class AsyncQueryObject(QueryObject):
+    """`QueryObject` for an `AsyncEngine`: building the query works the same,
+    but `all` and `limit` are coroutines, e.g.
+
+    ```python
+    await db.query(C).similarity(C.embedding == v).limit(10)
+    ```
+    """
+
+    db: "AsyncEngine"
+
+    async def all(self) -> list[Collection]:
+        # the engine's `_query` is a coroutine function, so `_all` returns
+        # an awaitable
+        with self._span("all"):
+            return await self._all()
+
+    def iter(self, batch_size: int = 1000) -> AsyncIterator[Collection]:
+        """Asynchronous version of `QueryObject.iter`, to be used with
+        `async for`"""
+        if batch_size < 1:
+            raise ValueError("batch_size must be positive")
+        return self._iter_pages(batch_size)
+
+    async def _iter_pages(self, batch_size: int) -> AsyncIterator[Collection]:
+        async for page in self.db._query_iter(
+            self._filter_set,
+            with_vectors=self.with_vectors,
+            batch_size=batch_size,
+        ):
+            for record in page:
+                yield record
+
+    async def limit(
+        self, n: int, score_threshold: float | None = None
+    ) -> list[Collection] | list[list[Collection]]:
+        with self._span("limit", limit=n, score_threshold=score_threshold):
+            return await self._limit(n, score_threshold)
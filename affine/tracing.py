@@ -0,0 +1,237 @@
+"""Hooks for tracing and measuring what engines spend their time on.
+
+Every engine has a `tracer` attribute (a `Tracer` that does nothing by
+default) to which it reports the phases of a query as spans and sizes as
+counters:
+
+```python
+from affine.tracing import StatsTracer
+
+db.tracer = StatsTracer()
+db.query(C).similarity(C.embedding == v).limit(10)
+print(db.tracer.summary())
+```
+
+The spans are
+
+- "query": the whole query, opened by the query object
+- "filter": evaluating the filters (`LocalEngine`)
+- "build_data_matrix": gathering the vectors of the records that match the
+  filters for an exact search (`LocalEngine`)
+- "create_index": building a nearest neighbor index (`LocalEngine`)
+- "search": searching a nearest neighbor index (`LocalEngine`)
+- "request": a request to a vector database, including the network round
+  trip (remote engines)
+- "convert": turning the results into `Collection` objects
+
+and the counters
+
+- "rows_scanned": number of records the filters were evaluated on
+- "candidates": number of records that match the filters
+- "records_returned": number of records returned
+- "vector_bytes_sent": size of the query vectors sent to a vector database
+- "vector_bytes_received": size of the vectors received from a vector
+  database
+- "cache_hits" and "cache_misses": lookups of `CachingEngine`
+
+(the sizes count 4 bytes per vector component, which is how the vector
+databases represent them; the payloads are not counted).
+"""
+
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+from typing import Any, ContextManager, Iterator, Protocol
+
+from affine.collection import Collection, Similarity, Vector
+
+
+class Span(Protocol):
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+
+class _NoOpSpan:
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+
+_NO_OP_SPAN_CONTEXT = nullcontext(_NoOpSpan())
+
+
+class Tracer:
+    """Receives the spans and counters of an engine. This base class
+    ignores them and is what engines use by default."""
+
+    # whether the tracer records anything. engines skip computing counter
+    # values that are expensive to get if it doesn't
+    enabled = False
+
+    def span(self, name: str, **attributes: Any) -> ContextManager[Span]:
+        """Context manager timing a phase of an operation
+
+        Parameters
+        ----------
+        name
+            name of the phase
+        attributes
+            additional information about the phase, such as the collection
+            name
+        """
+        return _NO_OP_SPAN_CONTEXT
+
+    def count(self, name: str, value: int | float, **attributes: Any) -> None:
+        """Add `value` to the counter `name`"""
+
+
+@dataclass
+class SpanStats:
+    count: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+
+    @property
+    def mean_seconds(self) -> float:
+        return self.total_seconds / self.count if self.count > 0 else 0.0
+
+
+class StatsTracer(Tracer):
+    """Aggregates the spans (number, total and maximum duration per span
+    name) and counters (sum per counter name) in memory. Attributes are
+    ignored."""
+
+    enabled = True
+
+    def __init__(self) -> None:
+        self.spans: dict[str, SpanStats] = {}
+        self.counters: dict[str, int | float] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Span]:
+        start = time.perf_counter()
+        try:
+            yield _NoOpSpan()
+        finally:
+            duration = time.perf_counter() - start
+            with self._lock:
+                stats = self.spans.setdefault(name, SpanStats())
+                stats.count += 1
+                stats.total_seconds += duration
+                stats.max_seconds = max(stats.max_seconds, duration)
+
+    def count(self, name: str, value: int | float, **attributes: Any) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def reset(self) -> None:
+        with self._lock:
+            self.spans.clear()
+            self.counters.clear()
+
+    def summary(self) -> str:
+        """A plain text table of the aggregated spans and counters"""
+        with self._lock:
+            lines = [
+                f"{'span':<24}{'count':>8}{'total ms':>12}{'mean ms':>10}"
+                f"{'max ms':>10}"
+            ]
+            for name, s in sorted(
+                self.spans.items(), key=lambda x: -x[1].total_seconds
+            ):
+                lines.append(
+                    f"{name:<24}{s.count:>8}{s.total_seconds * 1000:>12.3f}"
+                    f"{s.mean_seconds * 1000:>10.3f}"
+                    f"{s.max_seconds * 1000:>10.3f}"
+                )
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"{name:<24}{value:>8}")
+        return "\n".join(lines)
+
+
+def _otel_attributes(attributes: dict[str, Any]) -> dict[str, Any]:
+    # OpenTelemetry only accepts primitive attribute values
+    return {
+        k: v if isinstance(v, (str, bool, int, float)) else str(v)
+        for k, v in attributes.items()
+        if v is not None
+    }
+
+
+class OpenTelemetryTracer(Tracer):
+    """Reports the spans as OpenTelemetry spans and the counters as
+    OpenTelemetry counters, all prefixed with "affine.". Requires the
+    `opentelemetry-api` package; exporting is configured through the
+    OpenTelemetry SDK as usual.
+
+    Parameters
+    ----------
+    tracer_provider
+        the tracer provider to use. defaults to the global one
+    meter_provider
+        the meter provider to use. defaults to the global one
+    """
+
+    enabled = True
+
+    def __init__(self, tracer_provider=None, meter_provider=None):
+        try:
+            from opentelemetry import metrics, trace
+        except ModuleNotFoundError:
+            raise RuntimeError(
+                "OpenTelemetryTracer requires the opentelemetry-api package"
+            )
+        self._tracer = trace.get_tracer(
+            "affine", tracer_provider=tracer_provider
+        )
+        self._meter = metrics.get_meter(
+            "affine", meter_provider=meter_provider
+        )
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def span(self, name: str, **attributes: Any) -> ContextManager[Span]:
+        return self._tracer.start_as_current_span(
+            f"affine.{name}", attributes=_otel_attributes(attributes)
+        )
+
+    def count(self, name: str, value: int | float, **attributes: Any) -> None:
+        with self._lock:
+            if name not in self._counters:
+                self._counters[name] = self._meter.create_counter(
+                    f"affine.{name}"
+                )
+        self._counters[name].add(value, _otel_attributes(attributes))
+
+
+def count_records(
+    tracer: Tracer,
+    records: list[Collection],
+    received: bool = False,
+    **attributes: Any,
+) -> None:
+    """Report the number of returned records and, if they were `received`
+    from a vector database, the size of their vectors"""
+    tracer.count("records_returned", len(records), **attributes)
+    if not received or not tracer.enabled or len(records) == 0:
+        return
+    names = [name for name, _, _ in type(records[0]).get_vector_fields()]
+    num_components = 0
+    for record in records:
+        for name in names:
+            value = getattr(record, name)
+            if isinstance(value, Vector):
+                num_components += len(value)
+    tracer.count("vector_bytes_received", 4 * num_components, **attributes)
+
+
+def count_vector_bytes_sent(
+    tracer: Tracer, similarity: Similarity, batch: bool, **attributes: Any
+) -> None:
+    """Report the size of the query vectors of `similarity` (a batched
+    similarity if `batch`) sent to a vector database"""
+    if not tracer.enabled:
+        return
+    Q = similarity.get_batch_array() if batch else similarity.get_array()
+    tracer.count("vector_bytes_sent", 4 * Q.size, **attributes)
@@ -98,9 +98,31 @@ def _test_engine(db: Engine):
     assert len(q6) == 1
     assert q6[0].name == "Jane"
 
+    # iterating gives the same records as `all`, one page at a time
+    assert sorted(p.name for p in db.query(Person).iter(batch_size=1)) == [
+        "Jane",
+        "John",
+    ]
+    assert [
+        p.name
+        for p in db.query(Person).filter(Person.age >= 25).iter(batch_size=1)
+    ] == ["Jane"]
+
     q7 = db.query(Person).similarity(Person.embedding == [1.8, 2.3]).limit(1)
     assert len(q7) == 1
     assert q7[0].name == "Jane"
+    # the score is the distance to the query vector
+    assert q7[0].query_distance == pytest.approx(0.73**0.5, rel=1e-4)
+
+    # John is at a distance of about 2.59
+    q7 = (
+        db.query(Person)
+        .similarity(Person.embedding == [1.8, 2.3])
+        .limit(2, score_threshold=1.0)
+    )
+    assert [p.name for p in q7] == ["Jane"]
+    with pytest.raises(ValueError):
+        db.query(Person).limit(1, score_threshold=1.0)
 
     q8 = db.query(Person).similarity(Person.embedding == [1.8, 2.3]).all()
     assert len(q8) == 2
@@ -108,6 +130,7 @@ def _test_engine(db: Engine):
     q9 = db.query(Product).all()
     assert len(q9) == 1
     assert q9[0].name == "Apple"
+    assert q9[0].query_distance is None
 
     # check we can query by id
     assert db.get_element_by_id(Product, q9[0].id).name == "Apple"
@@ -165,6 +188,34 @@ def _test_euclidean_similarity(db: Engine) -> list:
             idx = i + j
             if idx >= 0 and idx < 100:
                 assert records[i + j] in q
+        # neighboring vectors differ by 1 in each of the 100 components
+        assert [r.query_distance for r in q[:2]] == pytest.approx(
+            [0, 10], abs=1e-3
+        )
+
+    # batched queries should give the same neighbors
+    qs = (
+        db.query(TestCol, with_vectors=True)
+        .similarity_batch(TestCol.b == [r.b for r in records])
+        .limit(3)
+    )
+    assert len(qs) == 100
+    for i, q in enumerate(qs):
+        assert len(q) == 3
+        for j in [-1, 0, 1]:
+            idx = i + j
+            if idx >= 0 and idx < 100:
+                assert records[i + j] in q
+
+    # the threshold leaves out the neighbors of the first and last vector
+    # that don't exist
+    qs = (
+        db.query(TestCol)
+        .similarity_batch(TestCol.b == [r.b for r in records])
+        .limit(4, score_threshold=10.5)
+    )
+    assert [len(q) for q in qs] == [2] + [3] * 98 + [2]
+    assert all(r.query_distance <= 10.5 for q in qs for r in q)
 
     return created_ids
 
@@ -203,6 +254,10 @@ def _test_cosine_similarity(db: Engine):
         assert len(q) == 3
         # all the vectors should have even index
         assert all([int(r.a) % 2 == 0 for r in q])
+        # ... and point in the same direction as the query vector
+        assert [r.query_distance for r in q] == pytest.approx(
+            [0, 0, 0], abs=1e-4
+        )
 
     return created_ids
 
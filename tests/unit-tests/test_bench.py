@@ -0,0 +1,131 @@
+import csv
+import json
+
+import numpy as np
+import pytest
+
+from affine.bench import (
+    gaussian_dataset,
+    load_fvecs_dataset,
+    load_hdf5_dataset,
+    main,
+    read_fvecs,
+    run_benchmark,
+    write_csv,
+    write_json,
+)
+from affine.collection import Metric
+from affine.engine import LocalEngine
+
+
+def _write_vecs(path, array: np.ndarray) -> None:
+    dim = np.full((len(array), 1), array.shape[1], dtype=np.int32)
+    np.hstack([dim, array.view(np.int32)]).tofile(path)
+
+
+def test_run_benchmark(tmp_path):
+    dataset = gaussian_dataset(n=300, n_queries=20, dim=8, num_groups=3)
+    engine = LocalEngine()
+    results = run_benchmark(engine, dataset, k=5, batch_size=8)
+
+    assert [r.workload for r in results] == ["unfiltered", "filtered"]
+    for r in results:
+        assert r.recall == 1.0
+        assert r.num_records == 300 and r.num_queries == 20
+        assert r.qps > 0
+        assert 0 < r.latency_p50_ms <= r.latency_p99_ms
+    assert results[0].batch_qps > 0
+    # the records are deleted again
+    assert engine.query(dataset.collection_class()).all() == []
+
+    write_json(results, tmp_path / "results.json")
+    with open(tmp_path / "results.json") as f:
+        assert json.load(f)[1]["workload"] == "filtered"
+    write_csv(results, tmp_path / "results.csv")
+    with open(tmp_path / "results.csv") as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 2 and float(rows[0]["recall"]) == 1.0
+
+
+def test_run_benchmark_waits_for_records():
+    calls = []
+
+    class Engine(LocalEngine):
+        def register_collection(self, collection_class):
+            calls.append("register_collection")
+            super().register_collection(collection_class)
+
+        def insert_many(self, records):
+            calls.append("insert_many")
+            return super().insert_many(records)
+
+        def wait_for_records(self, collection_class, count, timeout=60.0):
+            calls.append(("wait_for_records", count))
+
+    dataset = gaussian_dataset(n=50, n_queries=5, dim=4, num_groups=2)
+    run_benchmark(Engine(), dataset, k=3, filtered=False)
+    assert calls[:3] == [
+        "register_collection",
+        "insert_many",
+        ("wait_for_records", 50),
+    ]
+
+
+def test_fvecs_dataset(tmp_path):
+    rng = np.random.default_rng(0)
+    train = rng.normal(size=(50, 4)).astype(np.float32)
+    test = rng.normal(size=(5, 4)).astype(np.float32)
+    neighbors = rng.integers(0, 50, size=(5, 3)).astype(np.int32)
+    _write_vecs(tmp_path / "base.fvecs", train)
+    _write_vecs(tmp_path / "query.fvecs", test)
+    _write_vecs(tmp_path / "gt.ivecs", neighbors.view(np.float32))
+
+    np.testing.assert_array_equal(read_fvecs(tmp_path / "base.fvecs"), train)
+    dataset = load_fvecs_dataset(
+        tmp_path / "base.fvecs",
+        tmp_path / "query.fvecs",
+        tmp_path / "gt.ivecs",
+    )
+    np.testing.assert_array_equal(dataset.test, test)
+    np.testing.assert_array_equal(dataset.neighbors, neighbors)
+    assert dataset.name == "base" and len(dataset.groups) == 50
+
+
+def test_hdf5_dataset(tmp_path):
+    h5py = pytest.importorskip("h5py")
+    dataset = gaussian_dataset(n=100, n_queries=5, dim=4)
+    with h5py.File(tmp_path / "data.hdf5", "w") as f:
+        f.attrs["distance"] = "angular"
+        f["train"] = dataset.train
+        f["test"] = dataset.test
+        f["neighbors"] = np.zeros((5, 10), dtype=np.int32)
+
+    loaded = load_hdf5_dataset(tmp_path / "data.hdf5")
+    assert loaded.metric == Metric.COSINE
+    np.testing.assert_array_equal(loaded.train, dataset.train)
+    assert loaded.neighbors.shape == (5, 10)
+
+
+def test_main(tmp_path, capsys):
+    results = main(
+        [
+            "--n=200",
+            "--n-queries=10",
+            "--dim=4",
+            "--metric=cosine",
+            "--backends",
+            "numpy",
+            "kdtree",
+            "--no-filtered",
+            f"--json={tmp_path / 'results.json'}",
+            f"--csv={tmp_path / 'results.csv'}",
+        ]
+    )
+    assert [r.name for r in results] == [
+        "LocalEngine[numpy]",
+        "LocalEngine[kdtree]",
+    ]
+    assert all(r.recall == 1.0 for r in results)
+    assert "LocalEngine[kdtree]" in capsys.readouterr().out
+    assert (tmp_path / "results.json").exists()
+    assert (tmp_path / "results.csv").exists()
@@ -0,0 +1,164 @@
+from typing import Type
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from affine.collection import Collection, Vector
+from affine.engine import CachingEngine, LocalEngine
+
+
+class CountingEngine(LocalEngine):
+    def __init__(self):
+        super().__init__()
+        self.num_queries = 0
+        self.num_batch_queries = 0
+
+    def _query(self, *args, **kwargs):
+        self.num_queries += 1
+        return super()._query(*args, **kwargs)
+
+    def _query_batch(self, *args, **kwargs):
+        self.num_batch_queries += 1
+        return super()._query_batch(*args, **kwargs)
+
+
+def test_caching_engine(
+    PersonCollection: Type[Collection], data: list[Collection]
+):
+    engine = CountingEngine()
+    db = CachingEngine(engine)
+    db.insert_many(data)
+
+    def query(v: list[float], k: int = 1, **filters):
+        q = db.query(PersonCollection).similarity(
+            PersonCollection.embedding == v
+        )
+        for name, value in filters.items():
+            q = q.filter(getattr(PersonCollection, name) == value)
+        return [p.name for p in q.limit(k)]
+
+    assert query([1.8, 2.3]) == ["Jane"]
+    assert query([1.8, 2.3]) == ["Jane"]
+    assert query(np.array([1.8, 2.3])) == ["Jane"]
+    assert engine.num_queries == 1
+    assert db.stats.hits == 2 and db.stats.misses == 1
+
+    # anything that changes the query is a different key
+    assert query([1.8, 2.4]) == ["Jane"]
+    assert query([1.8, 2.3], k=2) == ["Jane", "John"]
+    assert query([1.8, 2.3], name="John") == ["John"]
+    assert engine.num_queries == 4
+    assert db.stats.num_entries == 4
+    assert db.stats.num_bytes > 0
+
+    # modifying the returned records does not affect the cache
+    q = db.query(PersonCollection).similarity(
+        PersonCollection.embedding == [1.8, 2.3]
+    )
+    q.limit(1)[0].name = "Changed"
+    assert q.limit(1)[0].name == "Jane"
+    # ... including their vectors
+    q.limit(1)[0].embedding.array[:] = 0.0
+    assert q.limit(1)[0].embedding == Vector([1.0, 2.0])
+
+    # writes invalidate the collection's entries
+    db.insert(
+        PersonCollection(
+            name="Jill",
+            age=40,
+            embedding=Vector([1.8, 2.3]),
+            other_embedding=Vector([0.0, 1.0, 0.0]),
+        )
+    )
+    assert db.stats.num_entries == 0
+    assert query([1.8, 2.3]) == ["Jill"]
+    db.delete(collection=PersonCollection, id=3)
+    assert query([1.8, 2.3]) == ["Jane"]
+    db.delete_where(PersonCollection.name == "Jane")
+    assert query([1.8, 2.3]) == ["John"]
+    assert db.stats.invalidations == 6
+
+
+def test_caching_engine_scores(PersonCollection: Type[Collection], data):
+    engine = CountingEngine()
+    db = CachingEngine(engine)
+    db.insert_many(data)
+
+    q = db.query(PersonCollection).similarity(
+        PersonCollection.embedding == [1.8, 2.3]
+    )
+    assert [p.name for p in q.limit(2)] == ["Jane", "John"]
+    # the threshold is part of the key
+    assert [p.name for p in q.limit(2, score_threshold=1.0)] == ["Jane"]
+    assert engine.num_queries == db.stats.num_entries == 2
+    # the cached records keep their scores
+    assert q.limit(2, score_threshold=1.0)[0].query_distance == pytest.approx(
+        0.73**0.5
+    )
+    assert engine.num_queries == 2
+
+
+def test_caching_engine_batches(PersonCollection: Type[Collection], data):
+    engine = CountingEngine()
+    db = CachingEngine(engine)
+    db.insert_many(data)
+
+    def batch(vectors):
+        return [
+            [p.name for p in r]
+            for r in db.query(PersonCollection)
+            .similarity_batch(PersonCollection.embedding == vectors)
+            .limit(1)
+        ]
+
+    assert batch([[1.8, 2.3], [3.0, 0.0]]) == [["Jane"], ["John"]]
+    # only the new query vector is sent to the engine
+    assert batch([[3.0, 0.0], [1.0, 1.5], [1.8, 2.3]]) == [
+        ["John"],
+        ["Jane"],
+        ["Jane"],
+    ]
+    assert engine.num_batch_queries == 2
+    assert db.stats.hits == 2 and db.stats.misses == 3
+    assert batch([[3.0, 0.0], [1.0, 1.5]]) == [["John"], ["Jane"]]
+    assert engine.num_batch_queries == 2
+
+
+def test_caching_engine_eviction(PersonCollection: Type[Collection], data):
+    engine = CountingEngine()
+    engine.insert_many(data)
+
+    def query(db, x: float):
+        return (
+            db.query(PersonCollection)
+            .similarity(PersonCollection.embedding == [x, 0.0])
+            .limit(2)
+        )
+
+    db = CachingEngine(engine, max_entries=2)
+    query(db, 0.0), query(db, 1.0), query(db, 0.0), query(db, 2.0)
+    # 1.0 was the least recently used
+    assert db.stats.evictions == 1
+    query(db, 0.0)
+    assert db.stats.hits == 2
+    query(db, 1.0)
+    assert db.stats.misses == 4
+
+    size = db.stats.num_bytes // 2
+    db = CachingEngine(engine, max_bytes=int(size * 2.5))
+    for x in range(5):
+        query(db, float(x))
+    assert db.stats.num_entries == 2
+    assert db.stats.num_bytes <= size * 2.5
+
+    db = CachingEngine(engine, ttl=10)
+    with patch("affine.engine.cache.time.monotonic", return_value=0.0):
+        query(db, 0.0)
+    with patch("affine.engine.cache.time.monotonic", return_value=5.0):
+        query(db, 0.0)
+    assert db.stats.hits == 1
+    with patch("affine.engine.cache.time.monotonic", return_value=11.0):
+        query(db, 0.0)
+    assert db.stats.misses == 2
+    assert db.stats.invalidations == 1
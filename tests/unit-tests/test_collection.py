@@ -2,6 +2,7 @@ import numpy as np
 import pytest
 
 from affine.collection import Collection, Metric, Vector
+from affine.engine import LocalEngine
 
 
 def test_vector_validation():
@@ -49,6 +50,35 @@ def test_collection_equality():
     assert c3 != c4
 
 
+def test_score_field():
+    # a field named `score` is the user's own data, not the query distance
+    class C(Collection):
+        score: float
+        v: Vector[2, Metric.EUCLIDEAN]
+
+    class D(Collection):
+        v: Vector[2, Metric.EUCLIDEAN]
+        score: float
+
+    for cls in [C, D]:
+        record = cls(v=[1.0, 2.0], score=3.5)
+        assert record.score == 3.5 and record.query_distance is None
+
+        db = LocalEngine()
+        db.insert(record)
+        (ret,) = db.query(cls).similarity(cls.v == [1.0, 0.0]).limit(1)
+        assert ret.score == 3.5
+        assert ret.query_distance == pytest.approx(2.0)
+
+    with pytest.raises(TypeError) as exc_info:
+
+        class E(Collection):
+            v: Vector[2, Metric.EUCLIDEAN]
+            query_distance: float
+
+    assert "query_distance" in str(exc_info.value)
+
+
 def test_vector_normalize():
     v = Vector([1, 2, -4])
     normalized = v.normalize()
@@ -63,5 +93,46 @@ def test_vector_normalize():
 
 
 def test_vector_repr():
+    # values are stored as floats
     v = Vector([1, 2, -4])
-    assert repr(v) == "<Vector: [ 1  2 -4]>"
+    assert repr(v) == "<Vector: [ 1.  2. -4.]>"
+
+
+def test_vector_dtype():
+    assert Vector([1.0, 2.0]).array.dtype == np.float32
+    assert Vector(np.array([1, 2])).array.dtype == np.float32
+    assert Vector(np.zeros(2, dtype=np.float64)).array.dtype == np.float64
+    assert Vector([1.0, 2.0], dtype="float16").array.dtype == np.float16
+    with pytest.raises(ValueError):
+        Vector([1.0, 2.0], dtype=np.int8)
+
+    class C(Collection):
+        x: Vector[2, Metric.EUCLIDEAN]
+        y: Vector[2, Metric.COSINE, np.float16]
+        z: Vector[2, Metric.COSINE, np.float64]
+
+    assert C.get_vector_dtypes() == {
+        "x": np.float32,
+        "y": np.float16,
+        "z": np.float64,
+    }
+    assert set(C.get_vector_fields()) == {
+        ("x", 2, Metric.EUCLIDEAN),
+        ("y", 2, Metric.COSINE),
+        ("z", 2, Metric.COSINE),
+    }
+    # vectors are converted to the dtype of their field
+    c = C(
+        x=Vector(np.array([1.0, 2.0])),
+        y=Vector([1.0, 2.0]),
+        z=[1.0, 2.0],
+    )
+    assert c.x.array.dtype == np.float32
+    assert c.y.array.dtype == np.float16
+    assert c.z.array.dtype == np.float64
+    assert c.y.normalize().array.dtype == np.float16
+
+    with pytest.raises(ValueError):
+
+        class D(Collection):
+            x: Vector[2, Metric.EUCLIDEAN, np.int32]
@@ -1,15 +1,31 @@
+import asyncio
+import copy
 import io
+import json
+import pickle
+import threading
 from typing import Type
+from unittest.mock import patch
 
+import numpy as np
 import pytest
 
-from affine.collection import Collection
-from affine.engine import LocalEngine
+from affine.collection import Collection, Filter, FilterSet, Metric, Vector
+from affine.engine import AsyncEngine, AsyncLocalEngine, LocalEngine
 from affine.engine.local import (
     AnnoyBackend,
+    ColumnStore,
     FAISSBackend,
+    HNSWBackend,
+    IVFBackend,
     KDTreeBackend,
+    NumPyBackend,
+    ProductQuantizedBackend,
     PyNNDescentBackend,
+    ScalarQuantizedBackend,
+    compile_filter_mask,
+    kmeans,
+    top_k_smallest,
 )
 
 
@@ -80,6 +96,58 @@ def test_cosine_similarity_faiss_backend(generic_test_cosine_similarity):
     generic_test_cosine_similarity(db)
 
 
+def test_euclidean_similarity_ivf_backend(generic_test_euclidean_similarity):
+    db = LocalEngine(backend=IVFBackend())
+    generic_test_euclidean_similarity(db)
+
+
+def test_cosine_similarity_ivf_backend(generic_test_cosine_similarity):
+    db = LocalEngine(backend=IVFBackend())
+    generic_test_cosine_similarity(db)
+
+
+def test_euclidean_similarity_hnsw_backend(
+    generic_test_euclidean_similarity,
+):
+    db = LocalEngine(backend=HNSWBackend())
+    generic_test_euclidean_similarity(db)
+
+
+def test_cosine_similarity_hnsw_backend(generic_test_cosine_similarity):
+    db = LocalEngine(backend=HNSWBackend())
+    generic_test_cosine_similarity(db)
+
+
+@pytest.mark.parametrize(
+    "backend",
+    [
+        ScalarQuantizedBackend(rerank_factor=4),
+        ProductQuantizedBackend(rerank_factor=4),
+    ],
+    ids=type,
+)
+def test_euclidean_similarity_quantized_backends(
+    backend, generic_test_euclidean_similarity
+):
+    db = LocalEngine(backend=backend)
+    generic_test_euclidean_similarity(db)
+
+
+@pytest.mark.parametrize(
+    "backend",
+    [
+        ScalarQuantizedBackend(rerank_factor=4),
+        ProductQuantizedBackend(rerank_factor=4),
+    ],
+    ids=type,
+)
+def test_cosine_similarity_quantized_backends(
+    backend, generic_test_cosine_similarity
+):
+    db = LocalEngine(backend=backend)
+    generic_test_cosine_similarity(db)
+
+
 def test_local_engine_save_load(
     PersonCollection: Type[Collection],
     ProductCollection: Type[Collection],
@@ -129,3 +197,1153 @@ def test_save_load_from_buffer(
     db2.load(f)
     assert len(db2.query(PersonCollection).all()) == 2
     assert len(db2.query(ProductCollection).all()) == 1
+
+
+def test_local_engine_reuses_index(PersonCollection: Type[Collection]):
+    class CountingBackend(NumPyBackend):
+        n_builds = 0
+
+        def create_index(self, data, metric, ids=None):
+            CountingBackend.n_builds += 1
+            super().create_index(data, metric, ids)
+
+    db = LocalEngine(backend=CountingBackend(), rebuild_threshold=1.0)
+    db.register_collection(PersonCollection)
+    db.insert(
+        PersonCollection(
+            name="John",
+            age=20,
+            embedding=Vector([3.0, 0.0]),
+            other_embedding=Vector([-1.0, 7.0, 0.0]),
+        )
+    )
+
+    for _ in range(3):
+        q = db.query(PersonCollection).similarity(
+            PersonCollection.embedding == [1.8, 2.3]
+        )
+        assert q.limit(1)[0].name == "John"
+    assert CountingBackend.n_builds == 1
+
+    # inserted records are searched exactly until there are enough of them
+    # for the index to be rebuilt in the background
+    db.insert(
+        PersonCollection(
+            name="Jane",
+            age=30,
+            embedding=Vector([1.0, 2.0]),
+            other_embedding=Vector([10.7, 0.1, -5.0]),
+        )
+    )
+    q = db.query(PersonCollection).similarity(
+        PersonCollection.embedding == [1.8, 2.3]
+    )
+    assert q.limit(1)[0].name == "Jane"
+    assert db.last_query_plan.num_unindexed == 1
+    assert CountingBackend.n_builds == 1
+    db.insert(
+        PersonCollection(
+            name="Jim",
+            age=40,
+            embedding=Vector([-5.0, 0.0]),
+            other_embedding=Vector([0.0, 0.0, 1.0]),
+        )
+    )
+    db.wait_for_rebuilds()
+    assert CountingBackend.n_builds == 2
+    assert [p.name for p in q.limit(3)] == ["Jane", "John", "Jim"]
+    assert db.last_query_plan.num_unindexed == 0
+
+    # deleting enough records compacts the collection, which rebuilds the
+    # index
+    db.delete(record=q.limit(1)[0])
+    db.delete_many(PersonCollection, [3])
+    assert q.limit(1)[0].name == "John"
+    assert CountingBackend.n_builds == 3
+
+
+def test_local_engine_indexes_records_inserted_during_rebuild():
+    class BlockingBackend(NumPyBackend):
+        building = threading.Event()
+        release = threading.Event()
+
+        def create_index(self, data, metric, ids=None):
+            if threading.current_thread() is not threading.main_thread():
+                BlockingBackend.building.set()
+                assert BlockingBackend.release.wait(10)
+            super().create_index(data, metric, ids)
+
+    class Point(Collection):
+        v: Vector[2, Metric.EUCLIDEAN]
+
+    def insert(n: int) -> None:
+        db.insert_many([Point(v=Vector([float(i), 0.0])) for i in range(n)])
+
+    db = LocalEngine(backend=BlockingBackend(), rebuild_threshold=0.1)
+    insert(10)
+    q = db.query(Point).similarity(Point.v == [0.0, 0.0])
+    assert len(q.limit(3)) == 3
+    # enough inserts to start a rebuild in the background ...
+    insert(2)
+    assert BlockingBackend.building.wait(10)
+    # ... and more while it is running, which it does not see
+    insert(300)
+    BlockingBackend.release.set()
+    db.wait_for_rebuilds()
+    assert len(q.limit(3)) == 3
+    assert db.last_query_plan.num_unindexed == 0
+
+
+def test_column_store(PersonCollection: Type[Collection]):
+    store = ColumnStore(PersonCollection, capacity=1)
+    people = [
+        PersonCollection(
+            name=f"person{i}",
+            age=i,
+            embedding=Vector([float(i), 0.0]),
+            other_embedding=Vector([1.0, 2.0, float(i)]),
+        )
+        for i in range(5)
+    ]
+    store.append(people[:2], [1, 2])
+    store.append(people[2:], [3, 4, 5])
+
+    assert len(store) == 5
+    assert store.vector_matrix("embedding").dtype == np.float32
+    assert store.vector_matrix("embedding").shape == (5, 2)
+    assert store.column("age").dtype == np.int64
+    assert store.column("id").tolist() == [1, 2, 3, 4, 5]
+
+    store.delete_rows(np.array([0, 3]))
+    assert store.column("id").tolist() == [2, 3, 5]
+    assert store.column("name").tolist() == ["person1", "person2", "person4"]
+
+    records = store.materialize([2, 0])
+    assert records == [people[4], people[1]]
+    assert [r.id for r in records] == [5, 2]
+    assert isinstance(records[0].age, int)
+
+    # values that don't fit the column type should not get mangled
+    store.append(
+        [
+            PersonCollection(
+                name="Bob",
+                age=None,
+                embedding=Vector([0.0, 0.0]),
+                other_embedding=Vector([1.0, 0.0, 0.0]),
+            )
+        ],
+        [6],
+    )
+    assert store.column("age").tolist() == [1, 2, 4, None]
+
+
+def test_compile_filter_mask(
+    PersonCollection: Type[Collection], data: list[Collection]
+):
+    store = ColumnStore(PersonCollection)
+    store.append(data[:2], [1, 2])
+
+    assert compile_filter_mask([], store).tolist() == [True, True]
+    assert compile_filter_mask(
+        [PersonCollection.name == "Jane"], store
+    ).tolist() == [False, True]
+    assert compile_filter_mask(
+        [PersonCollection.age > 20, PersonCollection.age <= 30], store
+    ).tolist() == [False, True]
+    assert compile_filter_mask(
+        [PersonCollection.age >= 20, PersonCollection.name == "John"], store
+    ).tolist() == [True, False]
+    assert compile_filter_mask(
+        [Filter(collection="Person", field="id", operation="lt", value=2)],
+        store,
+    ).tolist() == [True, False]
+
+    with pytest.raises(ValueError) as exc_info:
+        compile_filter_mask(
+            [
+                Filter(
+                    collection="Person", field="age", operation="ne", value=1
+                )
+            ],
+            store,
+        )
+    assert "Operation ne not supported" in str(exc_info)
+
+
+def test_metadata_indexes():
+    class Event(Collection):
+        tenant: str
+        timestamp: int
+        embedding: Vector[2, Metric.EUCLIDEAN]
+
+    rng = np.random.default_rng(0)
+    db, indexed_db = LocalEngine(), LocalEngine()
+    indexed_db.create_metadata_index(Event, "tenant", kind="hash")
+    indexed_db.create_metadata_index(Event, "timestamp", kind="sorted")
+    for i in range(200):
+        timestamp, embedding = int(rng.integers(0, 50)), rng.normal(size=2)
+        for engine in [db, indexed_db]:
+            engine.insert(
+                Event(
+                    tenant=f"tenant{i % 7}",
+                    timestamp=timestamp,
+                    embedding=Vector(embedding),
+                )
+            )
+    for id_ in range(1, 200, 3):
+        db.delete(collection=Event, id=id_)
+        indexed_db.delete(collection=Event, id=id_)
+
+    filter_sets = [
+        Event.tenant == "tenant3",
+        Event.timestamp < 10,
+        Event.timestamp >= 45,
+        (Event.timestamp > 10) & (Event.timestamp <= 20),
+        (Event.tenant == "tenant1") & (Event.timestamp <= 30),
+        Event.tenant == "tenant10",
+        Event.timestamp == 7,
+    ]
+    for filter_set in filter_sets:
+        expected = [r.id for r in db.query(Event).filter(filter_set).all()]
+        assert [
+            r.id for r in indexed_db.query(Event).filter(filter_set).all()
+        ] == expected
+
+    with pytest.raises(ValueError) as exc_info:
+        indexed_db.create_metadata_index(Event, "timestamp", kind="btree")
+    assert "Unknown metadata index kind btree" in str(exc_info)
+
+
+def test_local_engine_query_plans():
+    class C(Collection):
+        group: int
+        embedding: Vector[8, Metric.EUCLIDEAN]
+
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(500, 8))
+    db, exact_db = LocalEngine(backend=AnnoyBackend(n_trees=10)), LocalEngine()
+    for i, v in enumerate(data):
+        db.insert(C(group=i % 20, embedding=Vector(v)))
+        exact_db.insert(C(group=i % 20, embedding=Vector(v)))
+
+    def query(engine, filter_=None):
+        q = engine.query(C).similarity(C.embedding == data[0])
+        if filter_ is not None:
+            q = q.filter(filter_)
+        return [r.id for r in q.limit(5)]
+
+    assert query(db)[0] == 1
+    assert db.last_query_plan.strategy == "index"
+    assert db.last_query_plan.num_candidates == 500
+
+    # half of the records match so the index gets searched
+    assert query(db, C.group < 10)[0] == 1
+    assert db.last_query_plan.strategy == "post_filter"
+    assert db.last_query_plan.num_candidates == 250
+    assert db.last_query_plan.fetch_size >= 10
+
+    # only 5% of the records match so exact search over them is cheaper
+    assert query(db, C.group == 0) == query(exact_db, C.group == 0)
+    assert db.last_query_plan.strategy == "brute_force"
+    assert db.last_query_plan.num_candidates == 25
+
+    # the numpy backend always does an exact search over the candidates
+    query(exact_db, C.group < 10)
+    assert exact_db.last_query_plan.strategy == "brute_force"
+
+    db.query(C).filter(C.group == 1).all()
+    assert db.last_query_plan.strategy == "scan"
+
+
+def test_local_engine_overfetch_factor():
+    # post filtered queries would never fetch more neighbors
+    for overfetch_factor in [0, 1]:
+        with pytest.raises(ValueError):
+            LocalEngine(overfetch_factor=overfetch_factor)
+
+    class C(Collection):
+        group: int
+        embedding: Vector[8, Metric.EUCLIDEAN]
+
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(500, 8))
+    db = LocalEngine(backend=FAISSBackend("Flat"), overfetch_factor=2)
+    exact_db = LocalEngine()
+    for engine in [db, exact_db]:
+        engine.insert_many(
+            [C(group=i % 2, embedding=Vector(v)) for i, v in enumerate(data)]
+        )
+
+    def query(engine):
+        return [
+            r.id
+            for r in engine.query(C)
+            .filter(C.group == 0)
+            .similarity(C.embedding == data[1])
+            .limit(50)
+        ]
+
+    assert query(db) == query(exact_db)
+    assert db.last_query_plan.strategy == "post_filter"
+
+
+@pytest.mark.parametrize(
+    "backend",
+    [
+        NumPyBackend(),
+        KDTreeBackend(),
+        AnnoyBackend(n_trees=10),
+        FAISSBackend("Flat"),
+        ScalarQuantizedBackend(),
+        ProductQuantizedBackend(rerank_factor=2),
+        IVFBackend(nprobe=2),
+        HNSWBackend(M=8),
+    ],
+)
+@pytest.mark.parametrize("metric", [Metric.EUCLIDEAN, Metric.COSINE])
+def test_similarity_batch(backend, metric):
+    class C(Collection):
+        group: int
+        embedding: Vector[8, metric]
+
+    rng = np.random.default_rng(0)
+    db = LocalEngine(backend=backend)
+    for i, v in enumerate(rng.normal(size=(300, 8))):
+        db.insert(C(group=i % 3, embedding=Vector(v)))
+
+    queries = rng.normal(size=(10, 8))
+    for filter_ in [None, C.group < 2, C.group == 0]:
+        q = db.query(C)
+        if filter_ is not None:
+            q = q.filter(filter_)
+        results = q.similarity_batch(C.embedding == queries).limit(4)
+        assert len(results) == len(queries)
+        for query, result in zip(queries, results):
+            assert [r.id for r in result] == [
+                r.id for r in q.similarity(C.embedding == query).limit(4)
+            ]
+        assert q.similarity(C.embedding == queries[0]).limit(0) == []
+        assert q.similarity_batch(C.embedding == queries).limit(0) == [
+            [] for _ in queries
+        ]
+
+    with pytest.raises(ValueError) as exc_info:
+        db.query(C).similarity_batch(C.embedding == queries[0])
+    assert "Expected a 2D array of query vectors" in str(exc_info)
+
+
+def _neighbor_ids(results) -> list[list[int]]:
+    """The ids of `LocalBackend.query_batch` results"""
+    return [ids.tolist() for ids, _ in results]
+
+
+def test_top_k_smallest():
+    scores = np.array([[5.0, 1.0, 4.0, 2.0, 3.0], [0.0, 9.0, 8.0, 7.0, 1.0]])
+    assert top_k_smallest(scores, 2).tolist() == [[1, 3], [0, 4]]
+    assert top_k_smallest(scores[0], 3).tolist() == [1, 3, 4]
+    assert top_k_smallest(scores[0], 10).tolist() == [1, 3, 4, 2, 0]
+
+
+@pytest.mark.parametrize("metric", [Metric.EUCLIDEAN, Metric.COSINE])
+def test_numpy_backend_matches_naive_search(metric):
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(1000, 16)).astype(np.float32)
+    queries = rng.normal(size=(5, 16))
+
+    backend = NumPyBackend()
+    ids = np.arange(1000) * 2 + 5
+    backend.create_index(data, metric, ids)
+    for q, batch_result in zip(queries, backend.query_batch(queries, 10)):
+        if metric == Metric.COSINE:
+            dists = 1 - (data @ q) / np.linalg.norm(
+                data, axis=1
+            ) / np.linalg.norm(q)
+        else:
+            dists = np.linalg.norm(data - q, axis=1)
+        expected = np.argsort(dists)[:10]
+        for result_ids, distances in [backend.query(q, 10), batch_result]:
+            assert result_ids.tolist() == ids[expected].tolist()
+            np.testing.assert_allclose(distances, dists[expected], rtol=1e-4)
+
+
+@pytest.mark.parametrize("n_threads", [1, 4])
+@pytest.mark.parametrize("metric", [Metric.EUCLIDEAN, Metric.COSINE])
+def test_numpy_backend_chunked_search(metric, n_threads):
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(1000, 16)).astype(np.float32)
+    queries = rng.normal(size=(5, 16))
+
+    backend = NumPyBackend()
+    backend.create_index(data, metric)
+    chunked_backend = NumPyBackend(chunk_size=64, n_threads=n_threads)
+    chunked_backend.create_index(data, metric)
+
+    assert _neighbor_ids(
+        chunked_backend.query_batch(queries, 10)
+    ) == _neighbor_ids(backend.query_batch(queries, 10))
+    assert _neighbor_ids([chunked_backend.query(queries[0], 10)]) == (
+        _neighbor_ids([backend.query(queries[0], 10)])
+    )
+    # k larger than a chunk
+    assert _neighbor_ids([chunked_backend.query(queries[0], 100)]) == (
+        _neighbor_ids([backend.query(queries[0], 100)])
+    )
+
+
+@pytest.mark.parametrize(
+    "backend",
+    [
+        NumPyBackend(),
+        KDTreeBackend(),
+        AnnoyBackend(n_trees=10),
+        FAISSBackend("Flat"),
+        ScalarQuantizedBackend(rerank_factor=2),
+        ProductQuantizedBackend(),
+        IVFBackend(nprobe=2),
+        HNSWBackend(M=8),
+    ],
+)
+def test_save_load_indexes(backend, PersonCollection: Type[Collection], data):
+    db = LocalEngine(backend=backend)
+    for rec in data:
+        db.insert(rec)
+    q = db.query(PersonCollection).similarity(
+        PersonCollection.other_embedding == [10.0, 0.0, -4.0]
+    )
+    assert q.limit(1)[0].name == "Jane"
+
+    f = io.BytesIO()
+    db.save(f)
+    f.seek(0)
+
+    db2 = LocalEngine(backend=copy.deepcopy(backend))
+    db2.load(f)
+    assert set(db2._indexes) == {("Person", "other_embedding")}
+    loaded_index = db2._indexes[("Person", "other_embedding")]
+    q = db2.query(PersonCollection).similarity(
+        PersonCollection.other_embedding == [10.0, 0.0, -4.0]
+    )
+    assert q.limit(1)[0].name == "Jane"
+    # check the loaded index was used instead of building a new one
+    assert db2._indexes[("Person", "other_embedding")] is loaded_index
+
+    # indexes from a different type of backend are ignored
+    f.seek(0)
+    db3 = LocalEngine(backend=PyNNDescentBackend())
+    db3.load(f)
+    assert db3._indexes == {}
+
+
+def test_load_validates_indexes(data):
+    db = LocalEngine()
+    for rec in data:
+        db.insert(rec)
+    db.query(data[0].__class__).similarity(
+        data[0].__class__.embedding == [1.0, 1.0]
+    ).limit(1)
+    f = io.BytesIO()
+    db.save(f)
+
+    saved = pickle.loads(f.getvalue())
+    saved["indexes"]["Person.embedding"]["info"]["dim"] = 3
+    with pytest.raises(ValueError) as exc_info:
+        LocalEngine().load(io.BytesIO(pickle.dumps(saved)))
+    assert "Saved index Person.embedding has dimension 3" in str(exc_info)
+
+
+def test_load_legacy_format(PersonCollection: Type[Collection], data):
+    records = {"Person": data[:2], "Product": data[2:]}
+    for i, rec in enumerate(data):
+        rec.id = i + 1
+
+    db = LocalEngine()
+    db.load(io.BytesIO(pickle.dumps(records)))
+    assert [r.name for r in db.query(PersonCollection).all()] == [
+        "John",
+        "Jane",
+    ]
+    assert db.insert(data[0]) == 3
+
+
+def test_save_load_directory(
+    PersonCollection: Type[Collection],
+    ProductCollection: Type[Collection],
+    data: list[Collection],
+    tmp_path,
+):
+    db = LocalEngine(backend=AnnoyBackend(n_trees=10))
+    db.create_metadata_index(PersonCollection, "age", kind="sorted")
+    for rec in data:
+        db.insert(rec)
+    # delete the record with the highest id, which should not be reused
+    product_id = db.insert(ProductCollection(name="Banana", price=2.0))
+    db.delete(collection=ProductCollection, id=product_id)
+    q = db.query(PersonCollection).similarity(
+        PersonCollection.embedding == [1.8, 2.3]
+    )
+    assert q.limit(1)[0].name == "Jane"
+
+    db.save_directory(tmp_path / "db")
+    manifest = json.loads((tmp_path / "db" / "manifest.json").read_text())
+    assert manifest["format_version"] == 1
+    assert set(manifest["indexes"]) == {"Person.embedding"}
+
+    db2 = LocalEngine(backend=AnnoyBackend(n_trees=10))
+    db2.load_directory(tmp_path / "db")
+    store = db2.records["Person"]
+    assert isinstance(store.vector_matrix("embedding"), np.memmap)
+    assert ("Person", "embedding") in db2._indexes
+
+    q = db2.query(PersonCollection).similarity(
+        PersonCollection.embedding == [1.8, 2.3]
+    )
+    assert q.limit(1)[0].name == "Jane"
+    assert [
+        p.name
+        for p in db2.query(PersonCollection)
+        .filter(PersonCollection.age > 25)
+        .all()
+    ] == ["Jane"]
+    assert db2.records["Person"].metadata_indexes.keys() == {"age"}
+
+    # check the engine can still be written to
+    assert db2.insert(ProductCollection(name="Cherry", price=3.0)) == 3
+    assert [p.name for p in db2.query(ProductCollection).all()] == [
+        "Apple",
+        "Cherry",
+    ]
+    db2.delete(record=q.limit(1)[0])
+    assert [p.name for p in db2.query(PersonCollection).all()] == ["John"]
+
+    # the saved files should not have been modified
+    db3 = LocalEngine()
+    db3.load_directory(tmp_path / "db", mmap=False)
+    assert len(db3.query(PersonCollection).all()) == 2
+    assert len(db3.query(ProductCollection).all()) == 1
+
+
+def test_save_load_directory_memory_maps_numpy_index(
+    PersonCollection: Type[Collection], data: list[Collection], tmp_path
+):
+    db = LocalEngine(backend=NumPyBackend())
+    db.insert_many(data)
+    q = db.query(PersonCollection).similarity(
+        PersonCollection.embedding == [1.8, 2.3]
+    )
+    assert q.limit(1)[0].name == "Jane"
+    db.save_directory(tmp_path / "db")
+
+    # the vectors are not pickled along with the rest of the backend
+    with open(
+        tmp_path / "db" / "indexes" / "Person.embedding" / "backend.pkl", "rb"
+    ) as f:
+        assert "_index" not in pickle.load(f)
+
+    db2 = LocalEngine(backend=NumPyBackend())
+    db2.load_directory(tmp_path / "db")
+    index = db2._indexes[("Person", "embedding")]
+    assert isinstance(index.backend._index, np.memmap)
+    q = db2.query(PersonCollection).similarity(
+        PersonCollection.embedding == [1.8, 2.3]
+    )
+    assert q.limit(1)[0].name == "Jane"
+
+    db3 = LocalEngine(backend=NumPyBackend())
+    db3.load_directory(tmp_path / "db", mmap=False)
+    index = db3._indexes[("Person", "embedding")]
+    assert not isinstance(index.backend._index, np.memmap)
+
+
+def test_insert_many(
+    PersonCollection: Type[Collection],
+    ProductCollection: Type[Collection],
+    data: list[Collection],
+):
+    db = LocalEngine()
+    db.insert(data[2])
+    ids = db.insert_many(data + [ProductCollection(name="Banana", price=2.0)])
+    assert ids == [1, 2, 2, 3]
+    assert [r.id for r in data] == [1, 2, 2]
+
+    assert [p.name for p in db.query(PersonCollection).all()] == [
+        "John",
+        "Jane",
+    ]
+    assert [p.name for p in db.query(ProductCollection).all()] == [
+        "Apple",
+        "Apple",
+        "Banana",
+    ]
+    assert db.insert_many([]) == []
+
+
+def test_async_engine_query_batch_bounds_requests():
+    class C(Collection):
+        embedding: Vector[2, Metric.EUCLIDEAN]
+
+    class Engine(AsyncEngine):
+        in_flight = []
+        num_running = 0
+
+        async def _query(self, filter_set, similarity=None, **kwargs):
+            Engine.num_running += 1
+            Engine.in_flight.append(Engine.num_running)
+            await asyncio.sleep(0.001)
+            Engine.num_running -= 1
+            return [C(embedding=Vector(similarity.get_array()))]
+
+        async def insert(self, record):
+            raise NotImplementedError
+
+        async def _delete_by_id(self, collection, id):
+            raise NotImplementedError
+
+        async def get_elements_by_ids(self, collection, ids):
+            raise NotImplementedError
+
+        async def register_collection(self, collection_class):
+            pass
+
+    vectors = [[float(i), 0.0] for i in range(50)]
+    results = asyncio.run(
+        Engine().query(C).similarity_batch(C.embedding == vectors).limit(1)
+    )
+    assert [r[0].embedding.array.tolist() for r in results] == vectors
+    assert len(Engine.in_flight) == 50
+    assert max(Engine.in_flight) == Engine._MAX_CONCURRENT_REQUESTS
+
+
+def test_async_local_engine(
+    PersonCollection: Type[Collection],
+    ProductCollection: Type[Collection],
+    data: list[Collection],
+):
+    async def run(db: AsyncLocalEngine):
+        await db.register_collection(PersonCollection)
+        assert await db.query(PersonCollection).all() == []
+        ids = await db.insert_many(data)
+        assert ids == [1, 2, 1]
+        assert await db.insert(ProductCollection(name="Pear", price=3.0)) == 2
+
+        q = db.query(PersonCollection).filter(PersonCollection.age > 25)
+        assert [p.name for p in await q.all()] == ["Jane"]
+
+        # many queries in flight at once
+        queries = [
+            db.query(PersonCollection)
+            .similarity(PersonCollection.embedding == [float(i), 0.0])
+            .limit(1)
+            for i in range(20)
+        ]
+        results = await asyncio.gather(*queries)
+        assert [r[0].name for r in results] == ["Jane"] + ["John"] * 19
+
+        batch = await (
+            db.query(PersonCollection)
+            .similarity_batch(
+                PersonCollection.embedding == [[0.0, 0.0], [4.0, 0.0]]
+            )
+            .limit(2)
+        )
+        assert [[p.name for p in r] for r in batch] == [
+            ["Jane", "John"],
+            ["John", "Jane"],
+        ]
+
+        assert (await db.get_element_by_id(PersonCollection, 2)).name == "Jane"
+        await db.delete(collection=PersonCollection, id=2)
+        assert len(await db.query(PersonCollection).all()) == 1
+        with pytest.raises(ValueError):
+            await db.delete(collection=PersonCollection)
+
+    db = AsyncLocalEngine()
+    asyncio.run(run(db))
+
+    async def iterate(db: AsyncLocalEngine):
+        return [p.name async for p in db.query(PersonCollection).iter(1)]
+
+    assert asyncio.run(iterate(db)) == ["John"]
+    # the wrapped engine is still usable synchronously
+    assert len(db.engine.query(ProductCollection).all()) == 2
+
+
+def test_query_iter():
+    class C(Collection):
+        a: int
+        b: Vector[2, Metric.EUCLIDEAN]
+
+    db = LocalEngine()
+    db.insert_many([C(a=i, b=Vector([float(i), 0.0])) for i in range(25)])
+
+    assert [c.a for c in db.query(C).iter(batch_size=10)] == list(range(25))
+    assert [
+        c.a for c in db.query(C).filter(C.a >= 13).iter(batch_size=4)
+    ] == list(range(13, 25))
+    # pages are at most `batch_size` records
+    pages = list(db._query_iter(db.query(C)._filter_set, batch_size=10))
+    assert [len(p) for p in pages] == [10, 10, 5]
+
+    # records deleted or inserted while iterating are skipped or included
+    it = db.query(C).iter(batch_size=10)
+    first = [next(it).a for _ in range(10)]
+    db.delete(collection=C, id=15)
+    db.delete(collection=C, id=3)
+    db.insert(C(a=25, b=Vector([0.0, 0.0])))
+    rest = [c.a for c in it]
+    assert first == list(range(10))
+    assert rest == [i for i in range(10, 26) if i != 14]
+
+    with pytest.raises(ValueError):
+        db.query(C).iter(batch_size=0)
+
+
+def test_get_elements_by_ids():
+    class C(Collection):
+        a: int
+        b: Vector[2, Metric.EUCLIDEAN]
+
+    db = LocalEngine()
+    db.insert_many([C(a=i, b=Vector([float(i), 0.0])) for i in range(10)])
+    db.delete(collection=C, id=4)
+
+    store = db.records["C"]
+    np.testing.assert_array_equal(store.find_rows([8, 1, 4, 11, 0]), [7, 0])
+    assert len(store.find_rows(["x", 2])) == 1
+    np.testing.assert_array_equal(store.find_rows(np.array([8, 1])), [7, 0])
+    # only integers are ids, even if they could be converted to one
+    assert len(store.find_rows(["1", True, 1.9, 2**70, np.float64(2)])) == 0
+    assert db.get_elements_by_ids(C, ["1", True, 2.0]) == []
+    db.delete_many(C, ["1", True, 3.5])
+    assert len(db.query(C).all()) == 9
+
+    # results come back in the order of the requested ids
+    assert [r.id for r in db.get_elements_by_ids(C, [9, 2, 4, 5])] == [
+        9,
+        2,
+        5,
+    ]
+    assert db.get_elements_by_ids(C, []) == []
+    with pytest.raises(ValueError):
+        db.get_element_by_id(C, 4)
+
+
+class GroupedCollection(Collection):
+    group: int
+    embedding: Vector[2, Metric.EUCLIDEAN]
+
+
+@pytest.mark.parametrize(
+    "backend", [NumPyBackend(), AnnoyBackend(n_trees=10)], ids=type
+)
+def test_delete_many_and_delete_where(backend, tmp_path):
+    class CountingBackend(type(backend)):
+        n_builds = 0
+
+        def create_index(self, data, metric, ids=None):
+            CountingBackend.n_builds += 1
+            super().create_index(data, metric, ids)
+
+    C = GroupedCollection
+    counting_backend = copy.copy(backend)
+    counting_backend.__class__ = CountingBackend
+    db = LocalEngine(backend=counting_backend, compaction_threshold=0.5)
+    db.insert_many(
+        [
+            C(group=i % 10, embedding=Vector([float(i), 0.0]))
+            for i in range(100)
+        ]
+    )
+    db.create_metadata_index(C, "group")
+
+    def nearest(x: float, k: int = 3, filter_=None) -> list[int]:
+        q = db.query(C).similarity(C.embedding == [x, 0.0])
+        if filter_ is not None:
+            q = q.filter(filter_)
+        return [r.id for r in q.limit(k)]
+
+    assert nearest(0.0) == [1, 2, 3]
+    assert CountingBackend.n_builds == 1
+
+    # deleted records are skipped without rebuilding the index, ids that
+    # don't exist are ignored
+    db.delete_many(C, [1, 3, 1000])
+    assert nearest(0.0) == [2, 4, 5]
+    assert len(db.query(C).all()) == 98
+    assert CountingBackend.n_builds == 1
+    assert db.get_elements_by_ids(C, [1, 2]) == db.get_elements_by_ids(C, [2])
+
+    db.delete_where(C.group == 1)  # ids 2, 12, ..., 92
+    assert nearest(0.0) == [4, 5, 6]
+    assert nearest(0.0, filter_=C.group <= 3) == [4, 11, 13]
+    assert [r.id for r in db.query(C).filter(C.group == 1).all()] == []
+    assert len(list(db.query(C).iter(batch_size=7))) == 88
+    assert CountingBackend.n_builds == 1
+    assert db.records["GroupedCollection"].num_deleted == 12
+
+    # tombstones survive saving and loading
+    db.save_directory(tmp_path / "db")
+    db2 = LocalEngine(backend=copy.copy(backend))
+    db2.load_directory(tmp_path / "db")
+    assert len(db2.query(C).all()) == 88
+    assert db2.query(C).filter(C.group == 1).all() == []
+    assert [
+        r.id
+        for r in db2.query(C).similarity(C.embedding == [0.0, 0.0]).limit(3)
+    ] == [4, 5, 6]
+    db2.delete_many(C, [4])
+    assert len(db2.query(C).all()) == 87
+
+    # once more than half of the records are deleted they get compacted
+    db.delete_where(C.group < 5)
+    store = db.records["GroupedCollection"]
+    assert len(store) == 100
+    db.delete_where(C.group == 5)
+    assert len(store) == 40
+    assert store.num_deleted == 0
+    assert nearest(0.0) == [7, 8, 9]
+    assert CountingBackend.n_builds == 2
+
+    with pytest.raises(ValueError):
+        db.delete_where(FilterSet(filters=[], collection="GroupedCollection"))
+
+
+class HalfPrecisionCollection(Collection):
+    group: int
+    embedding: Vector[8, Metric.COSINE, np.float16]
+
+
+@pytest.mark.parametrize(
+    "backend",
+    [
+        NumPyBackend(),
+        KDTreeBackend(),
+        FAISSBackend("Flat"),
+    ],
+    ids=type,
+)
+def test_half_precision_vectors(backend, tmp_path):
+    class SinglePrecisionCollection(Collection):
+        group: int
+        embedding: Vector[8, Metric.COSINE]
+
+    rng = np.random.default_rng(0)
+    # values that are exactly representable as float16
+    data = rng.normal(size=(300, 8)).astype(np.float16)
+    queries = rng.normal(size=(5, 8))
+    db, float32_db = LocalEngine(backend=backend), LocalEngine()
+    db.insert_many(
+        HalfPrecisionCollection(group=i % 3, embedding=Vector(v))
+        for i, v in enumerate(data)
+    )
+    float32_db.insert_many(
+        SinglePrecisionCollection(group=i % 3, embedding=Vector(v))
+        for i, v in enumerate(data)
+    )
+    store = db.records["HalfPrecisionCollection"]
+    assert store.vector_matrix("embedding").dtype == np.float16
+
+    def query(engine, C, q):
+        return [
+            r.id for r in engine.query(C).similarity(C.embedding == q).limit(5)
+        ]
+
+    for q in queries:
+        assert query(db, HalfPrecisionCollection, q) == query(
+            float32_db, SinglePrecisionCollection, q
+        )
+    result = db.query(HalfPrecisionCollection).limit(1)[0]
+    assert result.embedding.array.dtype == np.float16
+
+    db.save_directory(tmp_path / "db")
+    loaded = LocalEngine(backend=backend)
+    loaded.load_directory(tmp_path / "db")
+    assert (
+        loaded.records["HalfPrecisionCollection"]
+        .vector_matrix("embedding")
+        .dtype
+        == np.float16
+    )
+    assert query(loaded, HalfPrecisionCollection, queries[0]) == query(
+        db, HalfPrecisionCollection, queries[0]
+    )
+
+
+def test_kmeans():
+    rng = np.random.default_rng(0)
+    centers = np.array([[0.0, 0.0], [10.0, 0.0], [0.0, 10.0]])
+    X = np.concatenate([c + rng.normal(size=(100, 2)) for c in centers])
+    centroids = kmeans(X, 3)
+    assert centroids.shape == (3, 2)
+    assert np.allclose(
+        sorted(centroids.round().tolist()), sorted(centers.tolist())
+    )
+    # no more clusters than points
+    assert kmeans(X[:2], 3).shape == (2, 2)
+
+
+@pytest.mark.parametrize("metric", [Metric.EUCLIDEAN, Metric.COSINE])
+def test_quantized_backends(metric, tmp_path):
+    rng = np.random.default_rng(0)
+    centers = rng.normal(scale=3, size=(16, 32))
+    data = (
+        centers[rng.integers(0, 16, size=2000)] + rng.normal(size=(2000, 32))
+    ).astype(np.float32)
+    queries = centers[rng.integers(0, 16, size=20)] + rng.normal(size=(20, 32))
+    exact = NumPyBackend()
+    exact.create_index(data, metric)
+    expected = _neighbor_ids(exact.query_batch(queries, 10))
+
+    def recall(backend) -> float:
+        results = _neighbor_ids(backend.query_batch(queries, 10))
+        for q, result in zip(queries, results):
+            assert backend.query(q, 10)[0].tolist() == result
+        return np.mean(
+            [len(set(r) & set(e)) / 10 for r, e in zip(results, expected)]
+        )
+
+    sq = ScalarQuantizedBackend(chunk_size=256)
+    sq.create_index(data, metric)
+    assert sq._codes.nbytes == data.nbytes // 4
+    assert recall(sq) > 0.8
+
+    pq = ProductQuantizedBackend(n_subvectors=8, chunk_size=256)
+    pq.create_index(data, metric)
+    assert pq._codes.shape == (2000, 8) and pq._codes.dtype == np.uint8
+    assert pq._data is None
+    pq_recall = recall(pq)
+
+    reranked = ProductQuantizedBackend(
+        n_subvectors=8, rerank_factor=10, chunk_size=256
+    )
+    reranked.create_index(data, metric)
+    assert recall(reranked) > max(pq_recall, 0.8)
+
+    # the full precision vectors are saved for re-ranking and memory mapped
+    # when loading
+    (tmp_path / "index").mkdir()
+    reranked.save(tmp_path / "index")
+    loaded = ProductQuantizedBackend()
+    loaded.load(tmp_path / "index")
+    assert isinstance(loaded._data, np.memmap)
+    assert _neighbor_ids(loaded.query_batch(queries, 10)) == _neighbor_ids(
+        reranked.query_batch(queries, 10)
+    )
+
+    with pytest.raises(ValueError):
+        ProductQuantizedBackend(n_bits=9)
+    with pytest.raises(ValueError):
+        ProductQuantizedBackend(n_subvectors=64).create_index(data, metric)
+
+
+@pytest.mark.parametrize("metric", [Metric.EUCLIDEAN, Metric.COSINE])
+def test_ivf_backend(metric):
+    rng = np.random.default_rng(0)
+    centers = rng.normal(scale=5, size=(20, 16))
+    labels = rng.integers(0, 20, size=3000)
+    data = centers[labels] + rng.normal(size=(3000, 16))
+    queries = centers[:10] + rng.normal(size=(10, 16))
+
+    def recall(backend, data) -> float:
+        exact = NumPyBackend()
+        exact.create_index(data, metric)
+        results = _neighbor_ids(backend.query_batch(queries, 10))
+        for q, result in zip(queries, results):
+            assert backend.query(q, 10)[0].tolist() == result
+        expected = _neighbor_ids(exact.query_batch(queries, 10))
+        return np.mean(
+            [len(set(r) & set(e)) / 10 for r, e in zip(results, expected)]
+        )
+
+    backend = IVFBackend(n_lists=20, nprobe=2)
+    backend.create_index(data[:2000], metric)
+    assert len(backend._centroids) == 20
+    assert sum(len(ids) for ids in backend._list_ids) == 2000
+    assert recall(backend, data[:2000]) > 0.9
+
+    # vectors are added to the existing lists without retraining
+    centroids = backend._centroids.copy()
+    backend.add(np.arange(2000, 3000), data[2000:])
+    assert np.array_equal(backend._centroids, centroids)
+    assert sum(len(ids) for ids in backend._list_ids) == 3000
+    assert recall(backend, data) > 0.9
+
+    # lists are scanned until there are at least k vectors
+    tiny = IVFBackend(n_lists=100, nprobe=1)
+    tiny.create_index(data[:200], metric)
+    assert all(
+        len(r) == 50 for r in _neighbor_ids(tiny.query_batch(queries, 50))
+    )
+
+    # and removed again, only scanning the lists that hold them
+    list_size = next(len(ids) for ids in backend._list_ids if 0 in ids)
+    with patch("affine.engine.local.np.isin", wraps=np.isin) as isin:
+        backend.remove(np.array([0, 5000]))
+    assert sum(len(call.args[0]) for call in isin.call_args_list) == list_size
+    assert sum(len(ids) for ids in backend._list_ids) == 2999
+    backend.remove(np.arange(0, 3000, 2))
+    assert sum(len(ids) for ids in backend._list_ids) == 1500
+    assert all(
+        i % 2 == 1
+        for r in _neighbor_ids(backend.query_batch(queries, 10))
+        for i in r
+    )
+
+
+@pytest.mark.parametrize("metric", [Metric.EUCLIDEAN, Metric.COSINE])
+def test_hnsw_backend(metric):
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(1000, 8))
+    queries = rng.normal(size=(20, 8))
+
+    def check_recall(backend, ids: np.ndarray) -> None:
+        exact = NumPyBackend()
+        exact.create_index(data[ids], metric, ids)
+        expected = _neighbor_ids(exact.query_batch(queries, 10))
+        results = _neighbor_ids(backend.query_batch(queries, 10))
+        assert all(set(r) <= set(ids.tolist()) for r in results)
+        assert (
+            np.mean(
+                [len(set(r) & set(e)) / 10 for r, e in zip(results, expected)]
+            )
+            > 0.9
+        )
+
+    backend = HNSWBackend(M=8, ef_construction=50)
+    backend.create_index(data[:500], metric)
+    assert backend.num_vectors == 500
+    assert all(len(links) <= 16 for links, *_ in backend._links)
+    check_recall(backend, np.arange(500))
+
+    # vectors can be added and removed without rebuilding the index
+    backend.add(np.arange(500, 1000), data[500:])
+    check_recall(backend, np.arange(1000))
+    removed = np.arange(0, 1000, 2)
+    backend.remove(removed)
+    assert backend.num_vectors == 500
+    check_recall(backend, np.arange(1, 1000, 2))
+    # the links of the remaining nodes (mostly) bypass the removed ones.
+    # links are only repaired from the removed node's side, so one-way
+    # links to it are kept
+    live = np.flatnonzero(~backend._deleted[: len(backend._levels)])
+    links = [n for node in live for n in backend._links[node][0]]
+    assert np.mean(backend._deleted[links]) < 0.05
+
+    # re-adding ids replaces their vectors
+    backend.add(np.array([1, 2]), -queries[:2])
+    assert _neighbor_ids([backend.query(-queries[0], 1)]) == [[1]]
+    assert _neighbor_ids([backend.query(-queries[1], 1)]) == [[2]]
+    assert backend.num_vectors == 501
+
+    backend.remove(np.arange(1000))
+    assert backend.num_vectors == 0
+    assert _neighbor_ids([backend.query(queries[0], 5)]) == [[]]
+    backend.add(np.array([7]), data[:1])
+    assert _neighbor_ids([backend.query(queries[0], 5)]) == [[7]]
+
+
+@pytest.mark.parametrize(
+    # all lists are probed so that the results are exact
+    "backend",
+    [IVFBackend(n_lists=8, nprobe=8), HNSWBackend(M=8)],
+    ids=type,
+)
+def test_incremental_index_updates(backend, tmp_path):
+    class CountingBackend(type(backend)):
+        n_builds = 0
+
+        def create_index(self, data, metric, ids=None):
+            CountingBackend.n_builds += 1
+            super().create_index(data, metric, ids)
+
+    C = GroupedCollection
+    counting_backend = copy.copy(backend)
+    counting_backend.__class__ = CountingBackend
+    db = LocalEngine(backend=counting_backend, compaction_threshold=0.5)
+    exact_db = LocalEngine()
+    rng = np.random.default_rng(0)
+
+    def insert(n: int) -> None:
+        records = [
+            C(group=i % 10, embedding=Vector(v))
+            for i, v in enumerate(rng.normal(size=(n, 2)))
+        ]
+        db.insert_many(records)
+        exact_db.insert_many(copy.deepcopy(records))
+
+    def nearest(engine, x: float) -> list[int]:
+        q = engine.query(C).similarity(C.embedding == [x, 0.0])
+        return [r.id for r in q.limit(5)]
+
+    insert(200)
+    assert nearest(db, 0.0) == nearest(exact_db, 0.0)
+    index = db._indexes[("GroupedCollection", "embedding")]
+    assert index.size == 200
+
+    # inserts and deletes update the index in place
+    insert(50)
+    assert index.max_id == 250 and index.size == 250
+    assert nearest(db, 1.0) == nearest(exact_db, 1.0)
+    assert db.last_query_plan.num_unindexed == 0
+    nearest_ids = nearest(db, 1.0)
+    db.delete_many(C, nearest_ids[:2])
+    exact_db.delete_many(C, nearest_ids[:2])
+    assert index.size == 248
+    assert nearest(db, 1.0) == nearest(exact_db, 1.0)
+    assert db.last_query_plan.strategy == "index"
+    # as does compacting the collection
+    db.delete_where(C.group < 6)
+    exact_db.delete_where(C.group < 6)
+    assert db.records["GroupedCollection"].num_deleted == 0
+    assert nearest(db, -1.0) == nearest(exact_db, -1.0)
+    assert db._indexes[("GroupedCollection", "embedding")] is index
+    assert CountingBackend.n_builds == 1
+
+    db.save_directory(tmp_path / "db")
+    db2 = LocalEngine(backend=copy.copy(backend))
+    db2.load_directory(tmp_path / "db")
+    assert nearest(db2, -1.0) == nearest(exact_db, -1.0)
+    assert db2._indexes[("GroupedCollection", "embedding")].size == index.size
+
+
+@pytest.mark.parametrize(
+    "backend",
+    [
+        NumPyBackend(),
+        KDTreeBackend(),
+        AnnoyBackend(n_trees=10),
+        FAISSBackend("Flat"),
+        ScalarQuantizedBackend(),
+        ScalarQuantizedBackend(rerank_factor=2),
+        IVFBackend(),
+        HNSWBackend(),
+    ],
+    ids=lambda b: type(b).__name__,
+)
+@pytest.mark.parametrize("metric", [Metric.EUCLIDEAN, Metric.COSINE])
+def test_backend_ids_and_distances(backend, metric):
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(300, 8)).astype(np.float32)
+    queries = rng.normal(size=(5, 8))
+    ids = rng.permutation(10000)[:300]
+    backend.create_index(data, metric, ids)
+    tolerance = 0.1 if isinstance(backend, ScalarQuantizedBackend) else 1e-4
+
+    id_to_row = {id_: row for row, id_ in enumerate(ids)}
+    for q, (result_ids, distances) in zip(
+        queries, backend.query_batch(queries, 10)
+    ):
+        assert len(result_ids) == 10
+        assert np.all(np.diff(distances) >= -tolerance)
+        X = data[[id_to_row[i] for i in result_ids.tolist()]]
+        if metric == Metric.COSINE:
+            expected = 1 - X @ q / np.linalg.norm(X, axis=1) / np.linalg.norm(
+                q
+            )
+        else:
+            expected = np.linalg.norm(X - q, axis=1)
+        np.testing.assert_allclose(distances, expected, atol=tolerance)
+
+    if not backend._SUPPORTS_UPDATES:
+        with pytest.raises(NotImplementedError):
+            backend.add(np.array([10000]), data[:1])
@@ -0,0 +1,78 @@
+from unittest.mock import patch
+
+import pytest
+
+from affine.collection import Collection, Metric, Vector
+from affine.engine import LocalEngine
+from affine.engine.pinecone import PineconeEngine
+from affine.ingest import ingest
+
+
+class C(Collection):
+    a: int
+    embedding: Vector[2, Metric.EUCLIDEAN]
+
+
+class D(Collection):
+    b: str
+
+
+def _records(n: int):
+    for i in range(n):
+        yield C(a=i, embedding=Vector([float(i), 0.0]))
+        if i % 10 == 0:
+            yield D(b=str(i))
+
+
+def test_ingest_local_engine():
+    db = LocalEngine()
+    progress = []
+    stats = ingest(
+        db, _records(2500), batch_size=1000, on_progress=progress.append
+    )
+
+    assert stats.num_records == 2750
+    assert stats.num_batches == 4
+    assert stats.num_retries == 0
+    assert stats.records_per_second > 0
+    assert len(progress) == 4
+    assert [r.a for r in db.query(C).all()] == list(range(2500))
+    assert len(db.query(D).all()) == 250
+
+
+@patch.object(PineconeEngine, "_get_index")
+@patch("affine.engine.pinecone.Pinecone")
+def test_ingest_retries_transient_errors(_, mock_get_index):
+    engine = PineconeEngine()
+    mock_index = mock_get_index.return_value
+    failures = [ConnectionError("connection reset")]
+
+    def upsert(vectors):
+        if failures:
+            raise failures.pop()
+
+    mock_index.upsert.side_effect = upsert
+    records = [C(a=i, embedding=Vector([float(i), 0.0])) for i in range(250)]
+
+    stats = ingest(engine, records, n_workers=2, backoff=0)
+
+    assert stats.num_records == 250
+    assert stats.num_retries == 1
+    # 3 batches plus one retry
+    assert mock_index.upsert.call_count == 4
+    sent_ids = {
+        v.id for call in mock_index.upsert.call_args_list for v in call.args[0]
+    }
+    assert sent_ids == {r.id for r in records}
+
+
+@patch.object(PineconeEngine, "_get_index")
+@patch("affine.engine.pinecone.Pinecone")
+def test_ingest_raises_non_transient_errors(_, mock_get_index):
+    engine = PineconeEngine()
+    mock_get_index.return_value.upsert.side_effect = ValueError("bad vector")
+    records = [C(a=i, embedding=Vector([float(i), 0.0])) for i in range(250)]
+
+    with pytest.raises(ValueError) as exc_info:
+        ingest(engine, records, n_workers=2, backoff=0)
+    assert "bad vector" in str(exc_info)
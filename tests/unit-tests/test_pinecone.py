@@ -1,7 +1,9 @@
-from unittest.mock import patch
+import asyncio
+from unittest.mock import MagicMock, patch
 
 import pytest
 from pinecone import ScoredVector
+from pinecone import Vector as PineconeVector
 
 from affine.collection import (
     Collection,
@@ -12,6 +14,7 @@ from affine.collection import (
     Vector,
 )
 from affine.engine.pinecone import (
+    AsyncPineconeEngine,
     PineconeEngine,
     _convert_filters_to_pinecone,
     create_uuid,
@@ -151,3 +154,210 @@ def test_query(mock_get_index, engine):
     assert len(results) == 1
     assert results[0].id == "1"
     assert results[0].vector == Vector([1.0] * 128)
+    # pinecone's cosine similarity is turned into a distance
+    assert results[0].query_distance == pytest.approx(0.1)
+
+
+@patch.object(PineconeEngine, "_get_index")
+def test_query_score_threshold(mock_get_index, engine):
+    class C(Collection):
+        vector: Vector[2, Metric.EUCLIDEAN]
+        field1: str
+
+    mock_index = mock_get_index.return_value
+    # pinecone scores euclidean indexes by squared distance
+    mock_index.query.return_value.matches = [
+        ScoredVector(id=str(i), score=score, metadata={"field1": "a"})
+        for i, score in enumerate([1.0, 4.0, 9.0])
+    ]
+
+    with patch.object(engine, "collection_classes", {"c": C}):
+        results = (
+            engine.query(C)
+            .similarity(C.vector == [0.0, 0.0])
+            .limit(3, score_threshold=2.5)
+        )
+
+    assert [(r.id, r.query_distance) for r in results] == [
+        ("0", 1.0),
+        ("1", 2.0),
+    ]
+    assert mock_index.query.call_args.kwargs["top_k"] == 3
+
+
+@patch.object(PineconeEngine, "_get_index")
+def test_query_batch(mock_get_index, engine):
+    class C(Collection):
+        vector: Vector[2, Metric.COSINE]
+        field1: str
+
+    mock_index = mock_get_index.return_value
+    mock_index.query.side_effect = lambda vector, **kwargs: MagicMock(
+        matches=[
+            ScoredVector(
+                id=str(vector[0]), score=0.9, metadata={"field1": "value1"}
+            )
+        ]
+    )
+
+    filter_set = FilterSet(collection="C", filters=[])
+    similarity = Similarity(
+        collection="C", field="vector", value=[[1.0, 0.0], [2.0, 0.0]]
+    )
+
+    with patch.object(engine, "collection_classes", {"c": C}):
+        results = engine._query_batch(filter_set, similarity, limit=1)
+
+    assert mock_index.query.call_count == 2
+    assert [[r.id for r in result] for result in results] == [["1.0"], ["2.0"]]
+
+
+@patch.object(PineconeEngine, "_get_index")
+def test_insert_many(mock_get_index, engine):
+    class C(Collection):
+        field1: str
+        vector: Vector[2, Metric.COSINE]
+
+    mock_index = mock_get_index.return_value
+    records = [
+        C(vector=Vector([1.0, float(i)]), field1="a") for i in range(250)
+    ]
+
+    ids = engine.insert_many(records)
+
+    assert len(set(ids)) == 250
+    assert [r.id for r in records] == ids
+    assert [
+        len(call.args[0]) for call in mock_index.upsert.call_args_list
+    ] == [100, 100, 50]
+
+
+@patch.object(PineconeEngine, "_get_index")
+def test_async_engine(mock_get_index, mock_pinecone_client):
+    class C(Collection):
+        vector: Vector[2, Metric.COSINE]
+        field1: str
+
+    mock_index = mock_get_index.return_value
+    mock_index.query.side_effect = lambda vector, **kwargs: MagicMock(
+        matches=[
+            ScoredVector(
+                id=str(vector[0]), score=0.9, metadata={"field1": "value1"}
+            )
+        ]
+    )
+    engine = AsyncPineconeEngine()
+
+    async def run():
+        with patch.object(engine.engine, "collection_classes", {"c": C}):
+            single = await (
+                engine.query(C).similarity(C.vector == [3.0, 0.0]).limit(1)
+            )
+            batch = await (
+                engine.query(C)
+                .similarity_batch(C.vector == [[1.0, 0.0], [2.0, 0.0]])
+                .limit(1)
+            )
+        ids = await engine.insert_many(
+            [C(vector=Vector([1.0, 0.0]), field1="a")] * 3
+        )
+        return single, batch, ids
+
+    single, batch, ids = asyncio.run(run())
+    assert [r.id for r in single] == ["3.0"]
+    assert [[r.id for r in result] for result in batch] == [["1.0"], ["2.0"]]
+    assert len(ids) == 3
+    assert mock_index.upsert.call_count == 1
+
+
+@patch.object(PineconeEngine, "_get_index")
+def test_query_iter(mock_get_index, engine):
+    class C(Collection):
+        field1: str
+        vector: Vector[2, Metric.COSINE]
+
+    mock_index = mock_get_index.return_value
+    mock_index.list.return_value = iter([["1", "2"], ["3"]])
+    mock_index.fetch.side_effect = lambda ids: MagicMock(
+        vectors={
+            id_: PineconeVector(
+                id=id_, values=[1.0, 0.0], metadata={"field1": id_}
+            )
+            for id_ in ids
+        }
+    )
+
+    with patch.object(engine, "collection_classes", {"c": C}):
+        records = list(engine.query(C).iter(batch_size=2))
+        with pytest.raises(ValueError):
+            list(engine.query(C).filter(C.field1 == "1").iter())
+
+    mock_index.list.assert_called_once_with(limit=2)
+    assert [r.field1 for r in records] == ["1", "2", "3"]
+    assert all(r.vector is None for r in records)
+
+
+@patch.object(PineconeEngine, "_get_index")
+def test_get_elements_by_ids(mock_get_index, engine):
+    class C(Collection):
+        field1: str
+        vector: Vector[2, Metric.COSINE]
+
+    mock_index = mock_get_index.return_value
+    mock_index.fetch.side_effect = lambda ids: MagicMock(
+        vectors={
+            id_: PineconeVector(
+                id=id_, values=[1.0, 0.0], metadata={"field1": id_}
+            )
+            for id_ in sorted(ids)
+            if id_ != "missing"
+        }
+    )
+    ids = [str(i) for i in range(2500)] + ["missing"]
+
+    records = engine.get_elements_by_ids(C, ids)
+
+    assert [len(c.args[0]) for c in mock_index.fetch.call_args_list] == [
+        1000,
+        1000,
+        501,
+    ]
+    assert [r.id for r in records] == ids[:-1]
+
+
+@patch.object(PineconeEngine, "_get_index")
+def test_delete_many_and_delete_where(mock_get_index, engine):
+    class C(Collection):
+        field1: str
+        vector: Vector[2, Metric.COSINE]
+
+    mock_index = mock_get_index.return_value
+    engine.delete_many(C, [str(i) for i in range(2500)])
+    assert [
+        len(call.kwargs["ids"]) for call in mock_index.delete.call_args_list
+    ] == [1000, 1000, 500]
+
+    engine.delete_where(C.field1 == "a")
+    mock_index.delete.assert_called_with(filter={"field1": {"$eq": "a"}})
+
+
+@patch.object(PineconeEngine, "_POLL_INTERVAL", 0)
+@patch.object(PineconeEngine, "_get_index")
+def test_wait_for_records(mock_get_index, engine):
+    class C(Collection):
+        field1: str
+        vector: Vector[2, Metric.COSINE]
+
+    mock_index = mock_get_index.return_value
+    mock_index.describe_index_stats.side_effect = [
+        MagicMock(total_vector_count=n) for n in [0, 5, 10]
+    ]
+    engine.wait_for_records(C, 10)
+    assert mock_index.describe_index_stats.call_count == 3
+
+    mock_index.describe_index_stats.side_effect = None
+    mock_index.describe_index_stats.return_value = MagicMock(
+        total_vector_count=5
+    )
+    with pytest.raises(TimeoutError):
+        engine.wait_for_records(C, 10, timeout=0)
@@ -0,0 +1,55 @@
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from affine.collection import Collection, Metric, Vector
+from affine.engine.qdrant import AsyncQdrantEngine
+
+
+class C(Collection):
+    field1: str
+    vector: Vector[2, Metric.COSINE]
+
+
+@pytest.fixture
+def engine():
+    with patch("affine.engine.qdrant.AsyncQdrantClient"):
+        engine = AsyncQdrantEngine(host="localhost", port=6333)
+    engine.client = AsyncMock()
+    engine.created_collections.add("C")
+    return engine
+
+
+def _track_in_flight(engine: AsyncQdrantEngine, method: str) -> list[int]:
+    """Make `engine.client.<method>` slow and record the number of calls in
+    flight whenever one starts"""
+    in_flight = []
+    num_running = 0
+
+    async def call(**kwargs):
+        nonlocal num_running
+        num_running += 1
+        in_flight.append(num_running)
+        await asyncio.sleep(0.001)
+        num_running -= 1
+        return []
+
+    getattr(engine.client, method).side_effect = call
+    return in_flight
+
+
+def test_async_delete_many_bounds_requests(engine):
+    in_flight = _track_in_flight(engine, "delete")
+    asyncio.run(engine.delete_many(C, [str(i) for i in range(50_500)]))
+
+    assert len(in_flight) == 51
+    assert max(in_flight) == engine._MAX_CONCURRENT_REQUESTS
+
+
+def test_async_get_elements_by_ids_bounds_requests(engine):
+    in_flight = _track_in_flight(engine, "retrieve")
+    asyncio.run(engine.get_elements_by_ids(C, list(range(20_000))))
+
+    assert len(in_flight) == 20
+    assert max(in_flight) == engine._MAX_CONCURRENT_REQUESTS
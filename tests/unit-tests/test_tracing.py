@@ -0,0 +1,146 @@
+import asyncio
+from typing import Type
+
+import numpy as np
+import pytest
+
+from affine.collection import Collection, Metric, Vector
+from affine.engine import AsyncLocalEngine, CachingEngine, LocalEngine
+from affine.tracing import OpenTelemetryTracer, StatsTracer, Tracer
+
+
+class Point(Collection):
+    group: int
+    vector: Vector[2, Metric.EUCLIDEAN]
+
+
+def _points(n: int = 100) -> list[Point]:
+    rng = np.random.default_rng(0)
+    return [
+        Point(group=i % 10, vector=Vector(v))
+        for i, v in enumerate(rng.normal(size=(n, 2)))
+    ]
+
+
+def test_default_tracer_does_nothing(PersonCollection: Type[Collection], data):
+    db = LocalEngine()
+    assert type(db.tracer) is Tracer and not db.tracer.enabled
+    db.insert_many(data)
+    with db.tracer.span("query", collection="Person") as span:
+        span.set_attribute("key", "value")
+    assert len(db.query(PersonCollection).all()) == 2
+
+
+def test_stats_tracer():
+    db = LocalEngine()
+    db.tracer = tracer = StatsTracer()
+    db.insert_many(_points())
+
+    def query(**filters):
+        q = db.query(Point).similarity(Point.vector == [0.0, 0.0])
+        for name, value in filters.items():
+            q = q.filter(getattr(Point, name) == value)
+        return q.limit(3)
+
+    assert len(query()) == 3
+    assert tracer.spans["query"].count == 1
+    # the index is built by the first similarity query only
+    assert tracer.spans["create_index"].count == 1
+    for name in ["filter", "search", "convert"]:
+        assert tracer.spans[name].count == 1
+    assert tracer.counters["candidates"] == 100
+    assert tracer.counters["records_returned"] == 3
+    assert "rows_scanned" not in tracer.counters
+
+    tracer.reset()
+    # a selective filter is answered with an exact search over the matches
+    assert len(query(group=3)) == 3
+    assert db.last_query_plan.strategy == "brute_force"
+    assert "create_index" not in tracer.spans
+    assert tracer.spans["build_data_matrix"].count == 1
+    assert tracer.counters["rows_scanned"] == 100
+    assert tracer.counters["candidates"] == 10
+
+    tracer.reset()
+    assert len(list(db.query(Point).iter(batch_size=30))) == 100
+    assert tracer.spans["convert"].count == 4
+    assert tracer.counters["records_returned"] == 100
+
+    summary = tracer.summary()
+    assert "convert" in summary and "records_returned" in summary
+    assert tracer.spans["convert"].mean_seconds > 0
+
+
+def test_wrapped_engines_share_tracer():
+    tracer = StatsTracer()
+    local = LocalEngine()
+    db = CachingEngine(local)
+    db.tracer = tracer
+    assert local.tracer is tracer
+    db.insert_many(_points())
+    for _ in range(2):
+        db.query(Point).similarity(Point.vector == [0.0, 0.0]).limit(3)
+    assert tracer.spans["query"].count == 2
+    assert tracer.spans["search"].count == 1
+    assert tracer.counters["cache_hits"] == 1
+    assert tracer.counters["cache_misses"] == 1
+
+    async_db = AsyncLocalEngine(local)
+    assert async_db.tracer is tracer
+    tracer.reset()
+
+    async def run():
+        await async_db.query(Point).filter(Point.group == 1).all()
+
+    asyncio.run(run())
+    assert tracer.spans["query"].count == 1
+    assert tracer.counters["records_returned"] == 10
+
+
+def test_opentelemetry_tracer():
+    pytest.importorskip("opentelemetry.sdk")
+    from opentelemetry.sdk.metrics import MeterProvider
+    from opentelemetry.sdk.metrics.export import InMemoryMetricReader
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+        InMemorySpanExporter,
+    )
+
+    exporter = InMemorySpanExporter()
+    tracer_provider = TracerProvider()
+    tracer_provider.add_span_processor(SimpleSpanProcessor(exporter))
+    reader = InMemoryMetricReader()
+    meter_provider = MeterProvider(metric_readers=[reader])
+
+    db = AsyncLocalEngine()
+    db.tracer = OpenTelemetryTracer(tracer_provider, meter_provider)
+
+    async def run():
+        await db.insert_many(_points())
+        return (
+            await db.query(Point)
+            .similarity(Point.vector == [0.0, 0.0])
+            .limit(5)
+        )
+
+    assert len(asyncio.run(run())) == 5
+
+    spans = {s.name: s for s in exporter.get_finished_spans()}
+    root = spans["affine.query"]
+    assert root.attributes["collection"] == "Point"
+    assert root.attributes["limit"] == 5
+    # the spans of the wrapped engine, which run in the executor, are
+    # children of the query span
+    for name in ["affine.filter", "affine.search", "affine.convert"]:
+        assert spans[name].parent.span_id == root.context.span_id
+        assert spans[name].context.trace_id == root.context.trace_id
+
+    metrics = {
+        m.name: m
+        for rm in reader.get_metrics_data().resource_metrics
+        for sm in rm.scope_metrics
+        for m in sm.metrics
+    }
+    points = metrics["affine.records_returned"].data.data_points
+    assert sum(p.value for p in points) == 5